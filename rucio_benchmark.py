@@ -0,0 +1,64 @@
+#!/usr/bin/python3 -u
+
+"""@package rucio-benchmark
+
+ Benchmark of the input readers and items configurators
+ of rucio_uploader.py on synthetic inputs: directory trees,
+ tar archives of file lists, uploader logs and manifests.
+
+"""
+import sys
+import json
+import argparse
+
+import rucio_uploader.benchmark.harness as harness
+
+parser = argparse.ArgumentParser(prog="rucio_benchmark.py",
+                            description='Benchmark the input readers of rucio_uploader.py on synthetic inputs')
+
+parser.add_argument('--workdir',
+                    required=True,
+                    help="directory where the synthetic inputs are generated (and reused)")
+
+parser.add_argument('--sizes',
+                    nargs="+",
+                    type=int,
+                    default=[10**3, 10**4, 10**5],
+                    help="number of items of each scale, e.g. 1000 10000 ... 10000000")
+
+parser.add_argument('--benchmark',
+                    nargs="+",
+                    help="benchmarks to run (default: all)")
+
+parser.add_argument('--runs',
+                    type=int,
+                    default=100,
+                    help="number of runs in the synthetic inputs")
+
+parser.add_argument('--log_filler_lines',
+                    type=int,
+                    default=20,
+                    help="log lines for each item in the synthetic uploader logs")
+
+parser.add_argument('--no_memory',
+                    action="store_true",
+                    help="do not measure peak memory")
+
+parser.add_argument('--output',
+                    help="json file where the results are written")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    results = harness.run(args.workdir,
+                          args.sizes,
+                          args.benchmark,
+                          not args.no_memory,
+                          args.runs,
+                          args.log_filler_lines)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    sys.exit(0)
@@ -26,77 +26,306 @@
  7- checks if a transfer rule already exists, if not define it for the run 
  8- uploads missing files in parallel threads
 
+ PLAN AND EXECUTE: ['plan'] steps 1-7 only reconcile the 
+ inputs with RUCIO and the resulting work is written to a 
+ plan file. ['execute'] the work of a plan file, or of a 
+ slice of it, is done without any further discovery.
+
 """
+import atexit
 import logging
+import signal
 import sys
 import argparse
 
 import rucio_uploader.utils as utils
-import rucio_uploader.interfaces.file as file_interface
-import rucio_uploader.interfaces.tar as tar_interface
-import rucio_uploader.interfaces.samweb as sam_interface
-import rucio_uploader.interfaces.log as log_interface
-import rucio_uploader.rucio.manager as rucio_manager
+import rucio_uploader.interfaces as interfaces
+import rucio_uploader.trace as trace
 
 parser = argparse.ArgumentParser(prog="rucio_uploader.py", 
                             description='Upload files to RUCIO and create replicas at CNAF')
                             
+parser.add_argument('command',
+                    choices=['run', 'plan', 'execute', 'status', 'watch'],
+                    help="run: reconcile and upload, plan: reconcile and write the plan, execute: execute a plan, status: report the progress of the rules, watch: upload new files continuously. The command goes before the options, e.g. rucio_uploader.py run --type dir --source DIR")
+
 parser.add_argument('--type', 
                     nargs=1,
-                    choices=['dir', 'tar', 'sam', 'log'],
-                    required=True,
-                    help="type of input either directory, list of tar file, samweb or log file",
+                    choices=interfaces.names(),
+                    help="type of input: {}".format(", ".join("{} ({})".format(n, interfaces.get(n).help) for n in interfaces.names())),
                     dest="type")
 
+parser.add_argument('--inputs',
+                    help="json file with a list of typed sources, merged in a single run")
+
 parser.add_argument('--source',
-                    required='tar' in sys.argv or 'dir' in sys.argv or 'log' in sys.argv,
                     nargs="+",
                     help="list of sources")
 
 parser.add_argument('--run_number',
                     nargs="+",
-                    required='sam' in sys.argv,
                     help="run number")
 
 parser.add_argument('--data_tier',
                     nargs="+",
-                    required='sam' in sys.argv,
                     help="data tier ['raw', 'reco1', reco2', ...]")
 
 parser.add_argument('--data_stream',
                     nargs="+",
-                    required='sam' in sys.argv,
                     help="data stream ['numi', 'bnb', ...]")
 
+parser.add_argument('--timeout',
+                    type=float,
+                    help="maximum seconds of each transfer: transfers exceeding their size-aware deadline are abandoned and requeued")
+
+parser.add_argument('--split',
+                    type=int,
+                    metavar="MAX_FILES",
+                    help="split the files of the runs with more than MAX_FILES files in sub-datasets of about MAX_FILES files of a container of the run")
+
+parser.add_argument('--rule_container',
+                    metavar="TEMPLATE",
+                    help="attach the runs to the containers named by TEMPLATE ({run}, {block}, {tier}, {name}), with one rule for each container, e.g. icarus-{tier}-{block}")
+
+parser.add_argument('--rule_block',
+                    type=int,
+                    default=1000,
+                    help="number of runs in a {block} of --rule_container")
+
+parser.add_argument('--lease_db',
+                    help="SQLite file, on storage shared by concurrent invocations, where datasets and files are leased so that the invocations do disjoint work")
+
+parser.add_argument('--lease_ttl',
+                    type=float,
+                    default=3600.,
+                    help="seconds before the leases of an invocation that stopped renewing them expire")
+
+parser.add_argument('--engine',
+                    choices=['upload', 'local'],
+                    default='upload',
+                    help="transfer engine: upload with the RUCIO upload client or copy into the mounted RSE and register in bulk")
+
+parser.add_argument('--schedule',
+                    choices=['smallest', 'newest', 'fifo'],
+                    default='smallest',
+                    help="order of the datasets: smallest remaining bytes first, newest run first or input order")
+
+parser.add_argument('--small_files',
+                    type=int,
+                    metavar="BYTES",
+                    default=64*2**20,
+                    help="upload: files smaller than BYTES bytes are grouped by dataset and uploaded with a single upload call, 0 to upload each file alone")
+
+parser.add_argument('--pool_command',
+                    metavar="COMMAND",
+                    help="shell command printing the source pool of a file ({path} replaced by the file path), instead of its mount point")
+
+parser.add_argument('--pool_max_active',
+                    type=int,
+                    metavar="N",
+                    help="maximum concurrent transfers from each source pool (default 5 with --pool_command, unlimited otherwise)")
+
+parser.add_argument('--pool_bytes_per_sec',
+                    type=float,
+                    metavar="BYTES",
+                    help="maximum bytes per second read from each source pool")
+
+parser.add_argument('--tape_locator',
+                    metavar="COMMAND",
+                    help="shell command printing the tape volume and the position of a file ({path} replaced by the file path), instead of the Enstore layer 4")
+
+parser.add_argument('--in_place',
+                    action="store_true",
+                    help="register in place on INPLACE_RSE the files already in the namespace of the upload RSE, without transfer")
+
+parser.add_argument('--inplace_rse',
+                    help="non deterministic RSE, sharing the storage of the upload RSE, where the files are registered in place at their current PFN")
+
+parser.add_argument('--no_reconcile',
+                    action="store_true",
+                    help="consider uploaded the files whose DID exists, without checking their replicas and destination paths")
+
+parser.add_argument('--verify',
+                    action="store_true",
+                    help="verify state, size and checksum of the uploaded replicas and upload again the missing ones")
+
+parser.add_argument('--poll',
+                    type=float,
+                    help="status: seconds between polls, until all the rules are OK")
+
+parser.add_argument('--status_cache',
+                    help="status: json file caching the status of the rules between invocations")
+
+parser.add_argument('--debounce',
+                    type=float,
+                    default=30.,
+                    help="watch: seconds without modifications before a new file is uploaded")
+
+parser.add_argument('--interval',
+                    type=float,
+                    default=60.,
+                    help="watch: seconds between scans of the sources, changes notified by inotify are found sooner")
+
+parser.add_argument('--trace',
+                    help="json file where the timeline of the run is written (chrome://tracing, ui.perfetto.dev)")
+
+parser.add_argument('--profile',
+                    help="pstats file where the cProfile statistics of the main thread and of the upload workers are written")
+
+parser.add_argument('--plan',
+                    help="plan file written by 'plan' and read by 'execute'")
+
+parser.add_argument('--checksum',
+                    action="store_true",
+                    help="evaluate the adler32 checksum of the files to upload when planning")
+
+parser.add_argument('--slice',
+                    nargs=2,
+                    type=int,
+                    metavar=("INDEX", "COUNT"),
+                    help="execute only the INDEX-th of COUNT slices of the plan")
+
 if __name__ == '__main__':
     args = parser.parse_args()
 
+    if args.command != "execute" and args.type is None and args.inputs is None:
+        parser.error("one of the arguments --type --inputs is required")
+    if args.type is not None and args.inputs is not None:
+        parser.error("argument --inputs: not allowed with argument --type")
+    if args.command in ["plan", "execute"] and args.plan is None:
+        parser.error("the following arguments are required: --plan")
+    if args.command == "watch" and (args.type is None or args.type[0] != "dir"):
+        parser.error("watch is supported only for --type dir")
+    if args.timeout is not None and args.timeout <= 0:
+        parser.error("argument --timeout: must be positive")
+    if args.small_files < 0:
+        parser.error("argument --small_files: must not be negative")
+    if args.pool_max_active is not None and args.pool_max_active < 1:
+        parser.error("argument --pool_max_active: must be positive")
+    if args.pool_bytes_per_sec is not None and args.pool_bytes_per_sec <= 0:
+        parser.error("argument --pool_bytes_per_sec: must be positive")
+    if args.in_place and args.inplace_rse is None:
+        parser.error("argument --in_place: requires --inplace_rse")
+    if args.no_reconcile and args.command == "execute":
+        parser.error("argument --no_reconcile: not allowed with execute")
+    if args.split is not None and args.split < 1:
+        parser.error("argument --split: must be positive")
+    if args.split is not None and args.command in ["execute", "watch"]:
+        parser.error("argument --split: not allowed with {}".format(args.command))
+    if args.rule_container is not None and args.command in ["execute", "watch"]:
+        parser.error("argument --rule_container: not allowed with {}".format(args.command))
+    if args.type is not None:
+        missing = [a for a in interfaces.get(args.type[0]).arguments if getattr(args, a) is None]
+        if len(missing) != 0:
+            parser.error("the following arguments are required for --type {}: {}".format(args.type[0], ", ".join("--" + a for a in missing)))
+
+    if args.trace is not None:
+        trace.TRACER.enable()
+        atexit.register(trace.TRACER.write, args.trace)
+    if args.profile is not None:
+        trace.PROFILER.enable()
+        atexit.register(trace.PROFILER.write, args.profile)
+
+    # the RUCIO clients are imported only after the arguments are validated
+    import rucio_uploader.rucio.manager as rucio_manager
+    import rucio_uploader.rucio.plan as upload_plan
+    import rucio_uploader.interfaces.multi as multi_interface
+
+    if args.command == "execute":
+        try:
+            plan = upload_plan.UploadPlan.read(args.plan)
+        except upload_plan.UploadPlanError as e:
+            print("Error: {}".format(e))
+            sys.exit(1)
+        if args.slice is not None:
+            plan = plan.slice(*args.slice)
+        plan.config["transfer_engine"] = args.engine
+        plan.config["register_in_place"] = args.in_place
+        plan.config["inplace_rse"] = args.inplace_rse
+        plan.config["schedule_policy"] = args.schedule
+        plan.config["small_file_threshold"] = args.small_files
+        plan.config["source_pool_command"] = args.pool_command
+        plan.config["pool_max_active"] = args.pool_max_active
+        plan.config["pool_bytes_per_sec"] = args.pool_bytes_per_sec
+        plan.config["tape_locator_command"] = args.tape_locator
+        plan.config["verify_uploads"] = args.verify
+        plan.config["upload_timeout"] = args.timeout
+        plan.config["lease_db"] = args.lease_db
+        plan.config["lease_ttl"] = args.lease_ttl
+        rucio_manager.RucioManager({}, 
+                    {}, 
+                    {}, 
+                    plan.config,
+                    args,
+                    logging_level=logging.INFO).run_plan(plan)
+        sys.exit(0)
+
     config = {"scope":"user.icaruspro",
             "upl_rse":"FNAL_DCACHE", 
             "rse_local_path":"/pnfs/icarus/archive/rucio/user/icaruspro",
             "dst_rse":"INFN_CNAF_DISK_TEST",
-            "register_after_upload":True}
+            "register_after_upload":True,
+            "transfer_engine":args.engine,
+            "register_in_place":args.in_place,
+            "inplace_rse":args.inplace_rse,
+            "schedule_policy":args.schedule,
+            "small_file_threshold":args.small_files,
+            "source_pool_command":args.pool_command,
+            "pool_max_active":args.pool_max_active,
+            "pool_bytes_per_sec":args.pool_bytes_per_sec,
+            "tape_locator_command":args.tape_locator,
+            "reconcile_replicas":not args.no_reconcile,
+            "verify_uploads":args.verify,
+            "upload_timeout":args.timeout,
+            "dataset_split_max_files":args.split,
+            "lease_db":args.lease_db,
+            "lease_ttl":args.lease_ttl,
+            "rule_container_template":args.rule_container,
+            "rule_container_block":args.rule_block,
+            "inplace_local_prefix":"/pnfs",
+            "inplace_pfn_prefix":"gsiftp://fndca1.fnal.gov:2811/pnfs/fnal.gov/usr"}
     
     if not utils.sources_exist(args.source):
         sys.exit(0)
     
-    items = None
-    if args.type[0] == "tar":
-        config["ds_name_template"] = "run-{}-raw"
-        config["filename_run_pattern"] = r"run_([0-9]{4})_filelist.dat"
-        items = tar_interface.TarItemsConfigurator(tar_interface.TarReader(args.source), config)
-    elif args.type[0] == "dir":
-        config["ds_name_template"] = "run-{}-calib"
-        config["filename_run_pattern"] = r"hist.*_run([0-9]{4})_.*.root"
-        items = file_interface.FileItemsConfigurator(file_interface.DirectoryTreeReader(args.source), config)
-    elif args.type[0] == "sam":
-        items = sam_interface.SamwebItemsConfigurator(sam_interface.SamwebReader(args.run_number, args.data_tier, args.data_stream), config)
-    elif args.type[0] == "log":
-        items = log_interface.RucioLogItemsConfigurator(log_interface.RucioLogReader(args.source), config)
+    if args.command == "watch":
+        import rucio_uploader.interfaces.file as file_interface
+        import rucio_uploader.interfaces.watch as watch_interface
+        config.update(interfaces.get("dir").defaults)
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        watcher = watch_interface.DirectoryWatcher(args.source, config["filename_run_pattern"], args.debounce, args.interval)
+        rucio_manager.RucioManager({}, 
+                    {}, 
+                    {}, 
+                    config,
+                    args,
+                    logging_level=logging.INFO).watch(watcher, lambda paths: file_interface.FileItemsConfigurator(watch_interface.WatchedItems(paths), config))
+        sys.exit(0)
+    
+    if args.inputs is not None:
+        try:
+            sources = multi_interface.read_inputs(args.inputs)
+        except multi_interface.InputsError as e:
+            print("Error: {}".format(e))
+            sys.exit(1)
+    else:
+        sources = [dict({a: getattr(args, a) for a in interfaces.get(args.type[0]).arguments}, type=args.type[0])]
+    split_layouts = None
+    if args.split is not None:
+        split_layouts = lambda datasets: rucio_manager.RucioClient(config).split_layouts(datasets, config.get("lookup_threads", 16))
+    items = multi_interface.MultiItemsConfigurator(sources, config, split_layouts)
         
-    rucio_manager.RucioManager(items.dids, 
+    manager = rucio_manager.RucioManager(items.dids, 
                 items.datasets, 
                 items.rules, 
                 config,
                 args,
-                logging_level=logging.INFO).run()
+                logging_level=logging.INFO,
+                containers=items.containers)
+    
+    if args.command == "plan":
+        manager.write_plan(args.plan, args.checksum)
+    elif args.command == "status":
+        manager.status(args.poll, args.status_cache)
+    else:
+        manager.run()
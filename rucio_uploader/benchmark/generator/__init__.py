@@ -0,0 +1,232 @@
+"""@package generator
+
+ Generators of synthetic inputs for the input readers:
+ directory trees, tar archives of file lists, uploader logs
+ and manifests
+
+"""
+
+import os
+import io
+import gzip
+import json
+import random
+import tarfile
+
+SURL_PREFIX = "gsiftp://fndca1.fnal.gov:2811/pnfs/fnal.gov/usr/icarus/archive/raw"
+
+def run_numbers(n_runs: int, first_run: int = 1000) -> list:
+    """Return a list of run numbers formatted as in the file names
+
+    Args:
+        n_runs (int): number of runs
+        first_run (int, optional): first run number. Defaults to 1000.
+
+    Returns:
+        list: list of four digits run numbers
+    """
+    return ["{:04d}".format((first_run + i) % 10000) for i in range(n_runs)]
+
+def leaf_directories(root: str, depth: int, fanout: int) -> list:
+    """Return the leaf directories of a tree with given depth and fanout
+
+    Args:
+        root (str): root of the tree
+        depth (int): depth of the tree
+        fanout (int): number of subdirectories for each directory
+
+    Returns:
+        list: list of leaf directories
+    """
+    dirs = [root]
+    for level in range(depth):
+        dirs = [os.path.join(d, "d{}_{}".format(level, i)) for d in dirs for i in range(fanout)]
+    return dirs
+
+def generate_directory_tree(root: str,
+                            n_files: int,
+                            n_runs: int = 100,
+                            depth: int = 3,
+                            fanout: int = 8,
+                            duplicate_fraction: float = 0.01,
+                            other_fraction: float = 0.05,
+                            file_size: int = 64,
+                            seed: int = 0) -> int:
+    """Generate a directory tree of hist*_runNNNN_*.root files, as read by DirectoryTreeReader.
+    A fraction of the files is duplicated with the same name and content in another
+    directory and a fraction of files with names not matching the pattern is added.
+
+    Args:
+        root (str): root of the tree
+        n_files (int): number of distinct matching files
+        n_runs (int, optional): number of runs. Defaults to 100.
+        depth (int, optional): depth of the tree. Defaults to 3.
+        fanout (int, optional): subdirectories for each directory. Defaults to 8.
+        duplicate_fraction (float, optional): fraction of files duplicated. Defaults to 0.01.
+        other_fraction (float, optional): fraction of not matching files. Defaults to 0.05.
+        file_size (int, optional): size of each file in bytes. Defaults to 64.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        int: total number of files written
+    """
+    rnd = random.Random(seed)
+    runs = run_numbers(n_runs)
+    leaves = leaf_directories(root, depth, fanout)
+    for d in leaves:
+        os.makedirs(d, exist_ok=True)
+
+    # content depends only on the name: duplicates are identical
+    def write(path, name):
+        with open(path, "wb") as f:
+            f.write(name.encode("utf-8").ljust(file_size, b"\0")[:max(file_size, 1)])
+
+    n_written = 0
+    for i in range(n_files):
+        run = runs[i % n_runs]
+        name = "hist{}_run{}_{:08d}.root".format(rnd.choice(["bnb", "numi", "offbeam"]), run, i)
+        write(os.path.join(leaves[i % len(leaves)], name), name)
+        n_written += 1
+        if rnd.random() < duplicate_fraction:
+            write(os.path.join(leaves[(i + 1 + rnd.randrange(len(leaves))) % len(leaves)], name), name)
+            n_written += 1
+        if rnd.random() < other_fraction:
+            other = "reco_run{}_{:08d}.log".format(run, i)
+            write(os.path.join(leaves[rnd.randrange(len(leaves))], other), other)
+            n_written += 1
+    return n_written
+
+def generate_tars(root: str,
+                  n_items: int,
+                  n_runs: int = 100,
+                  n_tars: int = 4,
+                  seed: int = 0) -> list:
+    """Generate gzip tar archives of run_NNNN_filelist.dat members, as read by TarReader
+
+    Args:
+        root (str): output directory
+        n_items (int): total number of file surls
+        n_runs (int, optional): number of runs. Defaults to 100.
+        n_tars (int, optional): number of tar archives. Defaults to 4.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        list: list of tar archives
+    """
+    rnd = random.Random(seed)
+    runs = run_numbers(n_runs)
+    os.makedirs(root, exist_ok=True)
+    tars = []
+    per_run = max(1, n_items // n_runs)
+    for t in range(n_tars):
+        path = os.path.join(root, "filelists_{}.tar.gz".format(t))
+        with tarfile.open(path, "w:gz") as tar:
+            for r, run in enumerate(runs):
+                if r % n_tars != t:
+                    continue
+                n = per_run + (1 if r < n_items - per_run * n_runs else 0)
+                lines = []
+                for i in range(n):
+                    lines.append("{}/{}/{}/data_run{}_{:06d}_{:08x}.root\n".format(SURL_PREFIX,
+                                                                                 run[:2],
+                                                                                 run,
+                                                                                 run,
+                                                                                 i,
+                                                                                 rnd.getrandbits(32)))
+                data = "".join(lines).encode("utf-8")
+                info = tarfile.TarInfo("run_{}_filelist.dat".format(run))
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        tars.append(path)
+    return tars
+
+def generate_log(path: str,
+                 n_items: int,
+                 items_per_recovery: int = 1000,
+                 filler_lines: int = 20,
+                 seed: int = 0) -> int:
+    """Generate an uploader log file with recovery lines, as read by RucioLogReader.
+    The size of the log is controlled by the number of filler lines written for each item.
+
+    Args:
+        path (str): output log file
+        n_items (int): number of items in the recovery lines
+        items_per_recovery (int, optional): items in each recovery line. Defaults to 1000.
+        filler_lines (int, optional): log lines for each item. Defaults to 20.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        int: size of the log file in bytes
+    """
+    rnd = random.Random(seed)
+    prefix = "2023-05-04 12:00:00,{} [root] [INFO] : "
+    with open(path, "w") as f:
+        for start in range(0, n_items, items_per_recovery):
+            items = []
+            for i in range(start, min(n_items, start + items_per_recovery)):
+                name = "data_run{:04d}_{:08d}.root".format(1000 + i % 100, i)
+                for _ in range(filler_lines):
+                    f.write(prefix.format(rnd.randrange(1000)) + "uploading {} - Thread ID: {}\n".format(name, i % 20))
+                items.append({"path": "/pnfs/icarus/archive/raw/{}".format(name),
+                              "did_name": name,
+                              "did_scope": "user.icaruspro",
+                              "dataset_name": "run-{:04d}-raw".format(1000 + i % 100),
+                              "dataset_scope": "user.icaruspro",
+                              "register_after_upload": True,
+                              "rse": "FNAL_DCACHE",
+                              "upload_ok": False,
+                              "size": rnd.randrange(1 << 30)})
+            f.write(prefix.format(0) + " =============== recovery =====================\n")
+            f.write(prefix.format(0) + "  _RECOVERY_JSON_STRING_ : {}\n".format(json.dumps(items)))
+            f.write(prefix.format(0) + " =============================================\n")
+    return os.path.getsize(path)
+
+def generate_manifest(path: str,
+                      n_items: int,
+                      n_runs: int = 100,
+                      columns: bool = True,
+                      seed: int = 0) -> int:
+    """Generate a gzip compressed manifest, as read by ManifestReader: a csv
+    with size, adler32 checksum and dataset columns or a plain list of paths
+
+    Args:
+        path (str): output manifest
+        n_items (int): number of files
+        n_runs (int, optional): number of runs. Defaults to 100.
+        columns (bool, optional): True for the csv with columns, False for the plain list. Defaults to True.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        int: size of the manifest in bytes
+    """
+    rnd = random.Random(seed)
+    runs = run_numbers(n_runs)
+    with gzip.open(path, "wt") as f:
+        if columns:
+            f.write("path,size,adler32,dataset\n")
+        for i in range(n_items):
+            run = runs[i % n_runs]
+            file = "/pnfs/icarus/archive/raw/{}/data_run{}_{:08d}.root".format(run, run, i)
+            if columns:
+                f.write("{},{},{:08x},run-{}-raw\n".format(file, 1 + rnd.randrange(1 << 30), rnd.getrandbits(32), run))
+            else:
+                f.write(file + "\n")
+    return os.path.getsize(path)
+
+def generate_samweb_items(n_items: int, n_runs: int = 100) -> list:
+    """Generate items in the format of SamwebReader.items
+
+    Args:
+        n_items (int): number of files
+        n_runs (int, optional): number of runs. Defaults to 100.
+
+    Returns:
+        list: list of dictionaries with run number, data tier and items
+    """
+    runs = run_numbers(n_runs)
+    items = {run: {} for run in runs}
+    for i in range(n_items):
+        run = runs[i % n_runs]
+        name = "data_run{}_{:08d}.root".format(run, i)
+        items[run][name] = "/pnfs/icarus/archive/raw/{}/{}".format(run, name)
+    return [{"run_number": run, "data_tier": "raw", "items": v} for run, v in items.items()]
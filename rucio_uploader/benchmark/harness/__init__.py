@@ -0,0 +1,232 @@
+"""@package harness
+
+ Benchmark harness of the input readers and items configurators.
+ Each benchmark is timed and, optionally, its peak memory is measured
+ in a second run traced by tracemalloc.
+
+"""
+
+import os
+import gc
+import time
+import tracemalloc
+
+import rucio_uploader.benchmark.generator as generator
+import rucio_uploader.interfaces.file as file_interface
+import rucio_uploader.interfaces.tar as tar_interface
+import rucio_uploader.interfaces.log as log_interface
+import rucio_uploader.interfaces.manifest as manifest_interface
+
+CONFIG = {"scope":"user.icaruspro",
+          "upl_rse":"FNAL_DCACHE",
+          "rse_local_path":"/pnfs/icarus/archive/rucio/user/icaruspro",
+          "dst_rse":"INFN_CNAF_DISK_TEST",
+          "register_after_upload":True}
+
+class SamwebItems:
+    """Stand-in of SamwebReader holding synthetic items
+    """
+
+    def __init__(self, items: list, item_class):
+        """SamwebItems constructor
+
+        Args:
+            items (list): items as returned by generator.generate_samweb_items
+            item_class (class): class representing a replica
+        """
+        self.items = [{"run_number": el["run_number"],
+                       "data_tier": el["data_tier"],
+                       "items": {k: item_class(v) for k, v in el["items"].items()}} for el in items]
+
+def dir_config() -> dict:
+    """Return the configuration of the items from directories
+
+    Returns:
+        dict: configuration
+    """
+    config = dict(CONFIG)
+    config["ds_name_template"] = "run-{}-calib"
+    config["filename_run_pattern"] = r"hist.*_run([0-9]{4})_.*.root"
+    return config
+
+def tar_config() -> dict:
+    """Return the configuration of the items from tar archives
+
+    Returns:
+        dict: configuration
+    """
+    config = dict(CONFIG)
+    config["ds_name_template"] = "run-{}-raw"
+    config["filename_run_pattern"] = r"run_([0-9]{4})_filelist.dat"
+    return config
+
+def manifest_config() -> dict:
+    """Return the configuration of the items from manifests
+
+    Returns:
+        dict: configuration
+    """
+    config = dict(CONFIG)
+    config["ds_name_template"] = "run-{}-raw"
+    config["filename_run_pattern"] = r".*_run([0-9]{4})_.*"
+    return config
+
+def benchmarks() -> list:
+    """Return the list of benchmarks as tuples (name, input type, setup, timed function).
+    The setup function builds the argument of the timed function from the inputs.
+
+    Returns:
+        list: list of benchmarks
+    """
+    bench = [
+        ("DirectoryTreeReader", "dir",
+            lambda inputs: inputs["dir"],
+            lambda dirs: file_interface.DirectoryTreeReader(dirs)),
+        ("FileItemsConfigurator", "dir",
+            lambda inputs: file_interface.DirectoryTreeReader(inputs["dir"]),
+            lambda reader: file_interface.FileItemsConfigurator(reader, dir_config())),
+        ("TarReader", "tar",
+            lambda inputs: inputs["tar"],
+            lambda tars: tar_interface.TarReader(tars)),
+        ("TarItemsConfigurator", "tar",
+            lambda inputs: tar_interface.TarReader(inputs["tar"]),
+            lambda reader: tar_interface.TarItemsConfigurator(reader, tar_config())),
+        ("RucioLogReader", "log",
+            lambda inputs: inputs["log"],
+            lambda logs: log_interface.RucioLogReader(logs)),
+        ("RucioLogItemsConfigurator", "log",
+            lambda inputs: log_interface.RucioLogReader(inputs["log"]),
+            lambda reader: log_interface.RucioLogItemsConfigurator(reader, CONFIG)),
+        ("ManifestReader", "manifest",
+            lambda inputs: inputs["manifest"]["plain"],
+            lambda manifests: sum(1 for _ in manifest_interface.ManifestReader(manifests).read())),
+        ("ManifestItemsConfigurator", "manifest",
+            lambda inputs: manifest_interface.ManifestReader(inputs["manifest"]["csv"]),
+            lambda reader: manifest_interface.ManifestItemsConfigurator(reader, manifest_config())),
+    ]
+    try:
+        import rucio_uploader.interfaces.samweb as sam_interface
+    except ImportError:
+        print("warning: samweb_client not available, SamwebItemsConfigurator is not benchmarked")
+    else:
+        bench.append(("SamwebItemsConfigurator", "sam",
+            lambda inputs: SamwebItems(inputs["sam"], sam_interface.SamReplicaItem),
+            lambda reader: sam_interface.SamwebItemsConfigurator(reader, CONFIG)))
+    return bench
+
+def measure(function, argument, memory: bool = True) -> dict:
+    """Time a function and measure its peak memory
+
+    Args:
+        function (function): function to be measured
+        argument (object): argument of the function
+        memory (bool, optional): True to measure peak memory in a second run. Defaults to True.
+
+    Returns:
+        dict: elapsed seconds and peak memory in bytes
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = function(argument)
+    elapsed = time.perf_counter() - start
+    del result
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = function(argument)
+            peak = tracemalloc.get_traced_memory()[1]
+            del result
+        finally:
+            tracemalloc.stop()
+    return {"seconds": elapsed, "peak_bytes": peak}
+
+def prepare_inputs(workdir: str, n_items: int, types: set, n_runs: int = 100, log_filler_lines: int = 20) -> dict:
+    """Generate the synthetic inputs for a given scale. Inputs already
+    generated in a previous run are reused.
+
+    Args:
+        workdir (str): working directory
+        n_items (int): number of items
+        types (set): input types to be generated
+        n_runs (int, optional): number of runs. Defaults to 100.
+        log_filler_lines (int, optional): log lines for each item. Defaults to 20.
+
+    Returns:
+        dict: dictionary ("input type":"sources")
+    """
+    base = os.path.join(workdir, "n{}".format(n_items))
+    inputs = {}
+    if "dir" in types:
+        root = os.path.join(base, "tree")
+        if not os.path.exists(root):
+            generator.generate_directory_tree(root, n_items, n_runs=n_runs)
+        inputs["dir"] = [root]
+    if "tar" in types:
+        root = os.path.join(base, "tars")
+        if not os.path.exists(root):
+            generator.generate_tars(root, n_items, n_runs=n_runs)
+        inputs["tar"] = sorted(os.path.join(root, t) for t in os.listdir(root))
+    if "log" in types:
+        path = os.path.join(base, "uploader.log")
+        if not os.path.exists(path):
+            os.makedirs(base, exist_ok=True)
+            generator.generate_log(path, n_items, filler_lines=log_filler_lines)
+        inputs["log"] = [path]
+    if "manifest" in types:
+        inputs["manifest"] = {}
+        for kind, columns in [("plain", False), ("csv", True)]:
+            path = os.path.join(base, "manifest_{}.gz".format(kind))
+            if not os.path.exists(path):
+                os.makedirs(base, exist_ok=True)
+                generator.generate_manifest(path, n_items, n_runs=n_runs, columns=columns)
+            inputs["manifest"][kind] = [path]
+    if "sam" in types:
+        inputs["sam"] = generator.generate_samweb_items(n_items, n_runs=n_runs)
+    return inputs
+
+def run(workdir: str, sizes: list, names: list = None, memory: bool = True, n_runs: int = 100, log_filler_lines: int = 20) -> list:
+    """Run the benchmarks for all the sizes
+
+    Args:
+        workdir (str): working directory for the synthetic inputs
+        sizes (list): list of number of items
+        names (list, optional): names of the benchmarks to run. Defaults to None (all).
+        memory (bool, optional): True to measure peak memory. Defaults to True.
+        n_runs (int, optional): number of runs in the inputs. Defaults to 100.
+        log_filler_lines (int, optional): log lines for each item. Defaults to 20.
+
+    Returns:
+        list: list of results
+    """
+    selected = [b for b in benchmarks() if names is None or b[0] in names]
+    results = []
+    for n in sizes:
+        inputs = prepare_inputs(workdir, n, set(b[1] for b in selected), n_runs, log_filler_lines)
+        for name, _, setup, function in selected:
+            argument = setup(inputs)
+            result = measure(function, argument, memory)
+            result.update({"benchmark": name, "items": n})
+            print(format_result(result), flush=True)
+            results.append(result)
+            del argument
+    return results
+
+def format_result(result: dict) -> str:
+    """Return formatted benchmark result
+
+    Args:
+        result (dict): benchmark result
+
+    Returns:
+        str: formatted benchmark result
+    """
+    peak = "-" if result["peak_bytes"] is None else "{:.1f} MiB".format(result["peak_bytes"] / 2**20)
+    rate = result["items"] / result["seconds"] if result["seconds"] > 0 else float("inf")
+    return "{:<28} {:>10} items {:>10.3f} s {:>12.0f} items/s {:>14}".format(result["benchmark"],
+                                                                        result["items"],
+                                                                        result["seconds"],
+                                                                        rate,
+                                                                        peak)
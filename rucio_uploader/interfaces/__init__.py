@@ -0,0 +1,115 @@
+"""@package interfaces
+
+ Registry of the input types. Each type is a plugin mapping its
+ name to the reader and the items configurator of a module, which
+ is imported only when the type is used.
+
+"""
+
+import importlib
+
+class InputPlugin:
+    """An input type: reader and items configurator of a module
+    """
+
+    def __init__(self, name: str, module: str, reader: str, configurator: str, arguments: list, defaults: dict = None, help: str = ""):
+        """InputPlugin constructor
+
+        Args:
+            name (str): name of the input type
+            module (str): module of the reader and of the configurator
+            reader (str): name of the reader class (or factory) in the module
+            configurator (str): name of the configurator class (or factory) in the module
+            arguments (list): keys of the source passed, in order, to the reader
+            defaults (dict, optional): configuration of the input type. Defaults to None.
+            help (str, optional): description of the input type. Defaults to "".
+        """
+        self.name = name
+        self.module = module
+        self.reader_name = reader
+        self.configurator_name = configurator
+        self.arguments = arguments
+        self.defaults = defaults if defaults is not None else {}
+        self.help = help
+
+    def load(self):
+        """Import the module of the input type
+
+        Returns:
+            module: the module
+        """
+        return importlib.import_module(self.module)
+
+    def reader(self, source: dict):
+        """Create the reader of a source
+
+        Args:
+            source (dict): description of the source
+
+        Returns:
+            object: reader of the items
+        """
+        return getattr(self.load(), self.reader_name)(*[source[a] for a in self.arguments])
+
+    def configurator(self, source: dict, config: dict):
+        """Create the items configurator of a source
+
+        Args:
+            source (dict): description of the source
+            config (dict): configuration
+
+        Returns:
+            object: items configurator, with dids, datasets and rules
+        """
+        return getattr(self.load(), self.configurator_name)(self.reader(source), config)
+
+PLUGINS = {}
+
+def register(plugin: InputPlugin):
+    """Register an input type
+
+    Args:
+        plugin (InputPlugin): the input type
+    """
+    PLUGINS[plugin.name] = plugin
+
+def get(name: str) -> InputPlugin:
+    """Return a registered input type
+
+    Args:
+        name (str): name of the input type
+
+    Returns:
+        InputPlugin: the input type
+    """
+    return PLUGINS[name]
+
+def names() -> list:
+    """Return the names of the registered input types
+
+    Returns:
+        list: list of names
+    """
+    return list(PLUGINS)
+
+register(InputPlugin("dir", "rucio_uploader.interfaces.file", "DirectoryTreeReader", "FileItemsConfigurator",
+                     ["source"],
+                     {"ds_name_template": "run-{}-calib",
+                      "filename_run_pattern": r"hist.*_run([0-9]{4})_.*.root"},
+                     "directories"))
+register(InputPlugin("tar", "rucio_uploader.interfaces.tar", "TarReader", "TarItemsConfigurator",
+                     ["source"],
+                     {"ds_name_template": "run-{}-raw",
+                      "filename_run_pattern": r"run_([0-9]{4})_filelist.dat"},
+                     "list of tar files"))
+register(InputPlugin("sam", "rucio_uploader.interfaces.samweb", "SamwebReader", "SamwebItemsConfigurator",
+                     ["run_number", "data_tier", "data_stream"],
+                     help="samweb"))
+register(InputPlugin("log", "rucio_uploader.interfaces.log", "RucioLogReader", "RucioLogItemsConfigurator",
+                     ["source"],
+                     help="log files"))
+register(InputPlugin("manifest", "rucio_uploader.interfaces.manifest", "ManifestReader", "ManifestItemsConfigurator",
+                     ["source"],
+                     {"ds_name_template": "run-{}-raw",
+                      "filename_run_pattern": r".*_run([0-9]{4})_.*"},
+                     "manifests: plain text, csv or jsonl, optionally compressed, - for stdin"))
@@ -0,0 +1,304 @@
+"""@package manifest
+
+ Reader of file lists produced by the production workflows.
+ Manifests are plain text (one path per line, optionally followed
+ by size, adler32 checksum and dataset), csv with a header or jsonl,
+ optionally gzip or zstd (zstandard) compressed, or the standard
+ input ("-"). The format and the compression are detected from the
+ content. The items are streamed: with size and checksum in the
+ manifest, the DIDs are created without stat and checksums.
+
+"""
+
+import io
+import os
+import re
+import sys
+import csv
+import gzip
+import json
+
+import rucio_uploader.utils as utils
+import rucio_uploader.rucio.wrappers as wrapper
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# columns of the plain text manifests, after the path
+PLAIN_COLUMNS = ["size", "adler32", "dataset"]
+
+class ManifestItem:
+    """Class to represent a file from a manifest
+    """
+
+    __slots__ = ["path", "size", "adler32", "dataset"]
+
+    def __init__(self, path: str, size: int = None, adler32: str = None, dataset: str = None):
+        """ManifestItem constructor
+
+        Args:
+            path (str): filepath (or surl)
+            size (int, optional): size of the file. Defaults to None.
+            adler32 (str, optional): adler32 checksum of the file. Defaults to None.
+            dataset (str, optional): name of the dataset of the file. Defaults to None.
+        """
+        self.path = path
+        self.size = size
+        self.adler32 = adler32
+        self.dataset = dataset
+
+def open_manifest(path: str):
+    """Open a manifest as text, decompressing it if gzip or zstd compressed
+
+    Args:
+        path (str): manifest file, "-" for the standard input
+
+    Returns:
+        io.TextIOWrapper: text stream of the manifest
+    """
+    raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+    magic = raw.peek(4)[:4]
+    if magic[:2] == GZIP_MAGIC:
+        raw = gzip.GzipFile(fileobj=raw)
+    elif magic == ZSTD_MAGIC:
+        if zstandard is None:
+            print("ERROR: {} is zstd compressed and zstandard is not available".format(path))
+            exit(1)
+        raw = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw))
+    return io.TextIOWrapper(raw, encoding="utf-8")
+
+def make_item(fields: dict) -> ManifestItem:
+    """Create an item from the fields of a manifest line
+
+    Args:
+        fields (dict): fields of the line, "path" and optionally "size", "adler32", "dataset"
+
+    Returns:
+        ManifestItem: the item
+    """
+    size = fields.get("size")
+    adler32 = fields.get("adler32")
+    return ManifestItem(fields["path"],
+                        int(size) if size not in [None, ""] else None,
+                        str(adler32).lower().zfill(8) if adler32 not in [None, ""] else None,
+                        fields.get("dataset") or None)
+
+class ManifestReader:
+    """Reader of items from manifests
+    """
+
+    def __init__(self, manifests: list):
+        """ManifestReader constructor
+
+        Args:
+            manifests (list): list of manifests to be read, "-" for the standard input
+        """
+        self.manifests = manifests
+        # number of the last line read of the current manifest
+        self.line = 0
+
+    def read_plain(self, first: str, lines):
+        """Read the items of a plain text manifest
+
+        Args:
+            first (str): first line
+            lines (iterator): following lines
+
+        Yields:
+            ManifestItem: items of the manifest
+        """
+        for line in self.chain(first, lines):
+            columns = line.split()
+            if len(columns) != 0:
+                yield make_item(dict(zip(PLAIN_COLUMNS, columns[1:]), path=columns[0]))
+
+    def read_csv(self, first: str, lines):
+        """Read the items of a csv manifest with a header
+
+        Args:
+            first (str): header
+            lines (iterator): following lines
+
+        Yields:
+            ManifestItem: items of the manifest
+        """
+        for row in csv.DictReader(lines, fieldnames=next(csv.reader([first]))):
+            yield make_item(row)
+
+    def read_jsonl(self, first: str, lines):
+        """Read the items of a jsonl manifest
+
+        Args:
+            first (str): first line
+            lines (iterator): following lines
+
+        Yields:
+            ManifestItem: items of the manifest
+        """
+        for line in self.chain(first, lines):
+            if line.strip():
+                fields = json.loads(line)
+                if not isinstance(fields, dict):
+                    raise ValueError("not a json object: {}".format(line.strip()))
+                yield make_item(fields)
+
+    def chain(self, first: str, lines):
+        """Iterate over the first line and the following lines
+
+        Args:
+            first (str): first line
+            lines (iterator): following lines
+
+        Yields:
+            str: lines
+        """
+        yield first
+        yield from lines
+
+    def numbered(self, f):
+        """Iterate over the lines of a manifest, counting them
+
+        Args:
+            f (io.TextIOWrapper): text stream of the manifest
+
+        Yields:
+            str: lines
+        """
+        for line in f:
+            self.line += 1
+            yield line
+
+    def read_one(self, manifest: str):
+        """Read the items of a manifest, detecting its format from the first line
+
+        Args:
+            manifest (str): manifest file, "-" for the standard input
+
+        Yields:
+            ManifestItem: items of the manifest
+        """
+        f = open_manifest(manifest)
+        self.line = 0
+        lines = self.numbered(f)
+        try:
+            first = ""
+            for first in lines:
+                if first.strip():
+                    break
+            if first.lstrip().startswith("{"):
+                items = self.read_jsonl(first, lines)
+            elif "path" in [c.strip() for c in first.split(",")]:
+                items = self.read_csv(first, lines)
+            else:
+                items = self.read_plain(first, lines)
+            yield from items
+        except (ValueError, KeyError, TypeError) as e:
+            print("ERROR: invalid manifest {}, line {}: {}".format(manifest, self.line, e))
+            exit(1)
+        finally:
+            if manifest != "-":
+                f.close()
+
+    def read(self):
+        """Read the items of all the manifests
+
+        Yields:
+            ManifestItem: items of the manifests
+        """
+        for manifest in self.manifests:
+            yield from self.read_one(manifest)
+
+class ManifestItemsConfigurator:
+    """Configurator of the items from manifests
+    """
+
+    def __init__(self, mitems: ManifestReader, config: dict):
+        """ManifestItemsConfigurator constructor
+
+        Args:
+            mitems (ManifestReader): ManifestReader
+            config (dict): configuration
+        """
+        self.config = config
+        self.pattern = re.compile(config["filename_run_pattern"])
+        self.dids = {}
+        self.datasets = {}
+        self.rules = {}
+        self.zero_size_dids = {}
+        self.createDIDs(mitems)
+        self.createDatasets()
+        self.createRules()
+
+    def filepath(self, path: str) -> str:
+        """Translate a file surl into a file path, paths are returned unchanged
+
+        Args:
+            path (str): file path or surl
+
+        Returns:
+            str: file path
+        """
+        prefix = self.config.get("inplace_pfn_prefix")
+        if prefix is not None and path.startswith(prefix):
+            return self.config["inplace_local_prefix"] + path[len(prefix):]
+        return path
+
+    def dataset_name(self, filename: str) -> str:
+        """Construct dataset name from the run number in the filename and the template
+
+        Args:
+            filename (str): filename
+
+        Returns:
+            str: RUCIO dataset name, None if the filename does not match the pattern
+        """
+        matches = self.pattern.match(filename)
+        if matches is None:
+            return None
+        return self.config["ds_name_template"].format(matches.group(1))
+
+    def createDIDs(self, mitems: ManifestReader):
+        """Create RUCIO DIDs from manifest items. The dataset of the manifest,
+        if any, is used instead of the one from the filename
+
+        Args:
+            mitems (ManifestReader): ManifestReader
+        """
+        for item in mitems.read():
+            path = self.filepath(item.path)
+            name = os.path.basename(path)
+            ds_name = item.dataset if item.dataset is not None else self.dataset_name(name)
+            if ds_name is None:
+                continue
+            did = wrapper.RucioDID(path,
+                                   name,
+                                   self.config["scope"],
+                                   ds_name,
+                                   self.config["scope"],
+                                   item.size,
+                                   item.adler32)
+            did.configure(self.config["register_after_upload"], self.config["upl_rse"])
+            if did.size == 0:
+                self.zero_size_dids[did.get_scoped_name()] = did
+            else:
+                self.dids[did.get_scoped_name()] = did
+
+    def createDatasets(self):
+        """Creates RUCIO Datasets
+        """
+        for did in self.dids.values():
+            sname = utils.get_scoped_name(did.ds_name, did.ds_scope)
+            if sname not in self.datasets:
+                self.datasets[sname] = wrapper.RucioDataset(did.ds_name, self.config["scope"], [])
+            self.datasets[sname].dids.append(did)
+
+    def createRules(self):
+        """Creates RUCIO rules
+        """
+        for sname, ds in self.datasets.items():
+            self.rules[sname] = wrapper.RucioRule(self.config["dst_rse"], ds.name, ds.scope)
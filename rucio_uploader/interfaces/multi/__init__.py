@@ -0,0 +1,211 @@
+"""@package multi
+
+ Multiple typed sources in a single run: the items of each
+ source are configured with their own dataset name template
+ and filename pattern and then merged into one deduplicated
+ set of DIDs, datasets and rules. Optionally the datasets of large
+ runs are split in sub-datasets of bounded size under a container, and
+ the runs are grouped in period or tier containers, each covered
+ by a single rule.
+
+"""
+
+import re
+import json
+
+import rucio_uploader.utils as utils
+import rucio_uploader.interfaces as interfaces
+import rucio_uploader.rucio.wrappers as wrapper
+
+class InputsError(Exception):
+    """Error in the description of the sources
+    """
+
+def source_config(source: dict, config: dict) -> dict:
+    """Return the configuration of a source: the common configuration
+    updated with the defaults of its type and with its own keys
+
+    Args:
+        source (dict): description of the source
+        config (dict): common configuration
+
+    Returns:
+        dict: configuration of the source
+    """
+    plugin = interfaces.get(source["type"])
+    sconfig = dict(config)
+    sconfig.update(plugin.defaults)
+    sconfig.update({k: v for k, v in source.items() if k != "type" and k not in plugin.arguments})
+    return sconfig
+
+def check_source(source: dict):
+    """Check the description of a source
+
+    Args:
+        source (dict): description of the source
+
+    Raises:
+        InputsError: if the description is not valid
+    """
+    if not isinstance(source, dict) or source.get("type") not in interfaces.names():
+        raise InputsError("invalid source {}: type must be one of {}".format(source, interfaces.names()))
+    for key in interfaces.get(source["type"]).arguments:
+        if not isinstance(source.get(key), list):
+            raise InputsError("invalid source {}: '{}' must be a list".format(source, key))
+    if not utils.sources_exist(source.get("source")):
+        raise InputsError("invalid source {}: missing input".format(source))
+
+def read_inputs(path: str) -> list:
+    """Read the sources from a json file containing a list of sources, e.g.
+    [{"type": "dir", "source": ["/path"], "ds_name_template": "run-{}-calib"},
+     {"type": "sam", "run_number": ["9000"], "data_tier": ["raw"], "data_stream": ["bnb"]}]
+
+    Args:
+        path (str): json file
+
+    Raises:
+        InputsError: if the file cannot be read or a source is not valid
+
+    Returns:
+        list: list of sources
+    """
+    try:
+        with open(path) as f:
+            sources = json.load(f)
+    except (OSError, ValueError) as e:
+        raise InputsError("cannot read inputs {}: {}".format(path, e))
+    if not isinstance(sources, list) or len(sources) == 0:
+        raise InputsError("inputs {} must contain a non empty list of sources".format(path))
+    for source in sources:
+        check_source(source)
+    return sources
+
+class MultiItemsConfigurator:
+    """Configurator merging the items of several sources
+    """
+
+    def __init__(self, sources: list, config: dict, split_layouts=None):
+        """MultiItemsConfigurator constructor
+
+        Args:
+            sources (list): list of sources
+            config (dict): common configuration
+            split_layouts (function, optional): function returning how the runs are already split in RUCIO, as RucioClient.split_layouts. Defaults to None (no run exists).
+        """
+        self.config = config
+        self.dids = {}
+        self.datasets = {}
+        self.rules = {}
+        self.containers = {}
+        self.zero_size_dids = {}
+        for source in sources:
+            self.merge(interfaces.get(source["type"]).configurator(source, source_config(source, config)))
+        if config.get("dataset_split_max_files") is not None:
+            self.split(config["dataset_split_max_files"], split_layouts)
+        if config.get("rule_container_template") is not None:
+            self.group_rules(config["rule_container_template"], config.get("rule_container_block", 1000))
+
+    def merge(self, items):
+        """Merge the items of a source. A DID already merged from another
+        source is kept in the first dataset it was assigned to, datasets left
+        without DIDs are not merged.
+
+        Args:
+            items (object): items configurator
+        """
+        for sname, did in items.dids.items():
+            if sname in self.dids:
+                first = self.dids[sname]
+                if first.ds_name != did.ds_name or first.ds_scope != did.ds_scope:
+                    print("WARNING: {} in datasets {} and {}: kept in {}".format(sname, first.ds_name, did.ds_name, first.ds_name))
+                continue
+            self.dids[sname] = did
+        self.zero_size_dids.update(getattr(items, "zero_size_dids", {}))
+
+        for sname, ds in items.datasets.items():
+            dids = [did for did in ds.dids if self.dids.get(did.get_scoped_name()) is did]
+            if len(dids) == 0 and sname not in self.datasets:
+                continue
+            if sname not in self.datasets:
+                self.datasets[sname] = wrapper.RucioDataset(ds.name, ds.scope, [])
+            merged = self.datasets[sname]
+            known = set(did.get_scoped_name() for did in merged.dids)
+            for did in dids:
+                if did.get_scoped_name() not in known:
+                    known.add(did.get_scoped_name())
+                    merged.dids.append(did)
+
+        for sname, rule in items.rules.items():
+            if sname in self.datasets and sname not in self.rules:
+                self.rules[sname] = rule
+
+    def split(self, max_files: int, split_layouts=None):
+        """Split the files of the datasets with more than max_files files in sub-datasets
+        ("<dataset>-000", "<dataset>-001", ...) of a container with the name of the dataset.
+        Each file is assigned to a stable bucket of its name, among the smallest power of two
+        number of buckets holding on average at most max_files files, or among the buckets of
+        the run already split in RUCIO, so that re-runs are stable. Runs already split are
+        split whatever their size, runs existing as datasets are never split. The rules are
+        placed on the containers.
+
+        Args:
+            max_files (int): maximum number of files of a dataset not split
+            split_layouts (function, optional): function returning how the runs are already split in RUCIO. Defaults to None.
+        """
+        layouts = split_layouts(list(self.datasets.values())) if split_layouts is not None else {}
+        datasets = {}
+        for sname, ds in self.datasets.items():
+            kind, buckets = layouts.get(sname, (None, 0))
+            if kind == "DATASET" or (kind is None and len(ds.dids) <= max_files):
+                if kind == "DATASET" and len(ds.dids) > max_files:
+                    print("WARNING: {} exists as dataset: not split".format(sname))
+                datasets[sname] = ds
+                continue
+            if buckets == 0:
+                buckets = utils.next_power_of_two(-(-len(ds.dids) // max_files))
+            elif len(ds.dids) > buckets * max_files:
+                print("WARNING: {} already split in {} sub-datasets: more than {} files each".format(sname, buckets, max_files))
+            container = wrapper.RucioContainer(ds.name, ds.scope, [])
+            for did in ds.dids:
+                name = "{}-{:03d}".format(ds.name, utils.bucket(did.name, buckets))
+                sub = utils.get_scoped_name(name, ds.scope)
+                if sub not in datasets:
+                    datasets[sub] = wrapper.RucioDataset(name, ds.scope, [])
+                    container.datasets.append(datasets[sub])
+                datasets[sub].dids.append(did)
+                did.ds_name = name
+                did.asUpload["dataset_name"] = name
+            self.containers[sname] = container
+        self.datasets = datasets
+
+    def group_rules(self, template: str, block_size: int = 1000):
+        """Attach the datasets (or the containers of the split runs) to the containers named by the template
+        and replace their rules with one rule for each container. The template fields are
+        the run number {run}, the first run of its block of block_size runs {block}, the
+        rest of the name {tier} and the name itself {name}, e.g. "icarus-{tier}-{block}".
+        Names not in the form run-<run>-<tier> keep their own rule.
+
+        Args:
+            template (str): template of the container names
+            block_size (int, optional): number of runs in a block. Defaults to 1000.
+        """
+        # the containers of the split runs, the datasets of the others
+        children = {sname: self.containers.get(sname, self.datasets.get(sname)) for sname in self.rules}
+        parents = {}
+        rules = {}
+        for sname, child in children.items():
+            matches = re.match("run-([0-9]+)-(.*)", child.name)
+            if matches is None:
+                rules[sname] = self.rules[sname]
+                continue
+            run = matches.group(1)
+            block = "{:0{}d}".format(int(run) // block_size * block_size, len(run))
+            name = template.format(run=run, block=block, tier=matches.group(2), name=child.name)
+            parent = utils.get_scoped_name(name, child.scope)
+            if parent not in parents:
+                parents[parent] = wrapper.RucioContainer(name, child.scope, [])
+                rule = self.rules[sname]
+                rules[parent] = wrapper.RucioRule(rule.rse, name, child.scope, rule.ncopy)
+            parents[parent].datasets.append(child)
+        self.containers.update(parents)
+        self.rules = rules
@@ -0,0 +1,170 @@
+"""@package watch
+
+ Watcher of directory trees reporting the new files matching a
+ pattern once they are complete, i.e. not modified for a debounce
+ time. The trees are scanned periodically, changes are notified sooner
+ by inotify (inotify_simple) if available.
+
+"""
+
+import os
+import re
+import time
+import logging
+
+import rucio_uploader.interfaces.file as file_interface
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+class WatchedItems:
+    """Items of new files, in the format of DirectoryTreeReader
+    """
+
+    def __init__(self, paths: list):
+        """WatchedItems constructor
+
+        Args:
+            paths (list): list of filepaths
+        """
+        self.items = {os.path.basename(p): file_interface.FileItem(p) for p in paths}
+
+class DirectoryWatcher:
+    """Watcher of new files in directory trees
+    """
+
+    def __init__(self, dirs: list, pattern: str, debounce: float = 30., interval: float = 60.):
+        """DirectoryWatcher constructor
+
+        Args:
+            dirs (list): list of directories to be watched
+            pattern (str): pattern of the filenames
+            debounce (float, optional): seconds without modifications before a file is reported. Defaults to 30.
+            interval (float, optional): seconds between scans. Defaults to 60.
+        """
+        self.dirs = dirs
+        self.pattern = re.compile(pattern)
+        self.debounce = debounce
+        self.interval = interval
+        self.seen = {}
+        self.candidates = set()
+        self.last_scan = None
+        self.logger = logging.getLogger()
+        self.inotify = None
+        self.watches = {}
+        if INotify is not None:
+            self.inotify = INotify()
+            self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        else:
+            self.logger.info(" inotify_simple not available: changes found by the scans every {} s".format(interval))
+
+    def add_candidate(self, path: str):
+        """Add a file, if matching the pattern and not seen yet, to the candidates
+
+        Args:
+            path (str): filepath
+        """
+        name = os.path.basename(path)
+        if self.pattern.match(name) is None:
+            return
+        if name in self.seen:
+            if self.seen[name] != path:
+                self.logger.info(" ignoring {}: file with same name already seen in {}".format(path, self.seen[name]))
+            return
+        self.candidates.add(path)
+
+    def scan(self, dir: str):
+        """Scan a directory tree, adding the watches of its directories
+
+        Args:
+            dir (str): directory
+        """
+        if self.inotify is not None and dir not in self.watches.values():
+            try:
+                self.watches[self.inotify.add_watch(dir, self.mask)] = dir
+            except OSError as e:
+                self.logger.info(" cannot watch {}: {}".format(dir, e))
+        try:
+            entries = list(os.scandir(dir))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                self.scan(entry.path)
+            elif entry.is_file():
+                self.add_candidate(entry.path)
+
+    def read_events(self, timeout: float):
+        """Read the inotify events and scan the trees every interval. Writes from other
+        clients of network filesystems (NFS, /pnfs) are not notified by inotify: the scans
+        find them, the events only report the local changes sooner
+
+        Args:
+            timeout (float): maximum seconds to wait
+        """
+        wait = min(self.last_scan + self.interval - time.time(), timeout)
+        if self.inotify is None:
+            if wait > 0:
+                time.sleep(wait)
+        else:
+            for event in self.inotify.read(timeout=int(max(0, wait) * 1000)):
+                dir = self.watches.get(event.wd)
+                if dir is None or event.name == "":
+                    continue
+                path = os.path.join(dir, event.name)
+                if event.mask & flags.ISDIR:
+                    self.scan(path)
+                else:
+                    self.add_candidate(path)
+        if time.time() >= self.last_scan + self.interval:
+            self.last_scan = time.time()
+            for dir in self.dirs:
+                self.scan(dir)
+
+    def ready(self) -> list:
+        """Return the candidates not modified for the debounce time
+
+        Returns:
+            list: list of complete new files
+        """
+        now = time.time()
+        ready = []
+        for path in list(self.candidates):
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                self.candidates.discard(path)
+                continue
+            if now - mtime >= self.debounce:
+                self.candidates.discard(path)
+                self.seen[os.path.basename(path)] = path
+                ready.append(path)
+        return ready
+
+    def wait(self, timeout: float = None) -> list:
+        """Wait for new complete files
+
+        Args:
+            timeout (float, optional): maximum seconds to wait. Defaults to None (the scan interval).
+
+        Returns:
+            list: list of new complete files, possibly empty
+        """
+        if self.last_scan is None:
+            self.last_scan = time.time()
+            for dir in self.dirs:
+                self.scan(dir)
+        timeout = self.interval if timeout is None else timeout
+        deadline = time.time() + timeout
+        while True:
+            ready = self.ready()
+            now = time.time()
+            if len(ready) != 0 or now >= deadline:
+                return ready
+            # wake up when the first candidate may be complete
+            step = deadline - now
+            if len(self.candidates) != 0:
+                step = min(step, max(1., self.debounce / 2))
+            self.read_events(step)
@@ -0,0 +1,117 @@
+"""@package logger
+
+ Asynchronous logging: the records are put in a queue by the
+ logging threads and written to file by a background thread.
+ Large per-item dumps go to a separate, compressed and rotating,
+ dump file through the "rucio_uploader.dump" logger.
+
+"""
+
+import os
+import gzip
+import queue
+import atexit
+import shutil
+import logging
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s,%(msecs)d [%(name)s] [%(levelname)s] : %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+DUMP_LOGGER = "rucio_uploader.dump"
+
+# the running background writer and the handler feeding it
+_listener = None
+_queue_handler = None
+
+class ExcludeFilter(logging.Filter):
+    """Filter rejecting the records of a logger and its children
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not super().filter(record)
+
+def gzip_rotator(source: str, dest: str):
+    """Compress a rotated log file
+
+    Args:
+        source (str): log file to be rotated
+        dest (str): rotated log file
+    """
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def gzip_namer(name: str) -> str:
+    """Return the name of a compressed rotated log file
+
+    Args:
+        name (str): name of the rotated log file
+
+    Returns:
+        str: name of the compressed rotated log file
+    """
+    return name + ".gz"
+
+def setup(log_filename: str, dump_filename: str, level=logging.INFO, dump_max_bytes: int = 256*2**20, dump_backups: int = 20):
+    """Configure the root logger and the dump logger to write through a background thread.
+    Dumps are enabled only if level is DEBUG.
+
+    Args:
+        log_filename (str): log file
+        dump_filename (str): dump file
+        level (int, optional): logging level. Defaults to logging.INFO.
+        dump_max_bytes (int, optional): size of the dump file before rotation. Defaults to 256 MiB.
+        dump_backups (int, optional): number of rotated dump files kept. Defaults to 20.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT, LOG_DATEFMT)
+
+    log_handler = logging.FileHandler(log_filename, mode='a')
+    log_handler.setFormatter(formatter)
+    log_handler.addFilter(ExcludeFilter(DUMP_LOGGER))
+
+    dump_handler = logging.handlers.RotatingFileHandler(dump_filename,
+                                                        mode='a',
+                                                        maxBytes=dump_max_bytes,
+                                                        backupCount=dump_backups,
+                                                        delay=True)
+    dump_handler.rotator = gzip_rotator
+    dump_handler.namer = gzip_namer
+    dump_handler.setFormatter(formatter)
+    dump_handler.addFilter(logging.Filter(DUMP_LOGGER))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    _queue_handler = logging.handlers.QueueHandler(records)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    dump = logging.getLogger(DUMP_LOGGER)
+    dump.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, log_handler, dump_handler)
+    _listener.start()
+    atexit.register(stop)
+
+def stop():
+    """Write all the pending records and stop the background writer
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def get_dump_logger() -> logging.Logger:
+    """Return the logger of the per-item dumps
+
+    Returns:
+        logging.Logger: the dump logger
+    """
+    return logging.getLogger(DUMP_LOGGER)
@@ -0,0 +1,286 @@
+"""@package clients
+
+ Pool of long-lived RUCIO clients shared by the worker threads,
+ manager of the authentication token they use and cache of the
+ RSE settings they need to upload.
+
+"""
+
+import os
+import time
+import queue
+import logging
+import weakref
+
+from contextlib import contextmanager
+from threading import Lock
+
+from rucio.client import Client
+from rucio.client.uploadclient import UploadClient
+from rucio.client.didclient import DIDClient
+from rucio.client.ruleclient import RuleClient
+from rucio.client.replicaclient import ReplicaClient
+from rucio.common import exception
+from rucio.rse import rsemanager as rsemgr
+
+class TokenManager:
+    """Manager of the RUCIO authentication token shared by all the clients.
+    The token is renewed before it expires, or when a call fails to authenticate,
+    by a single thread and the new token is handed to all the registered clients.
+    """
+
+    def __init__(self, token_file: str = None, lifetime: float = 3600., margin: float = 300., max_retries: int = 2):
+        """TokenManager constructor
+
+        Args:
+            token_file (str, optional): token file. Defaults to None (the one of the clients).
+            lifetime (float, optional): lifetime of a token in seconds, if not known from the clients. Defaults to 3600.
+            margin (float, optional): seconds before expiration when the token is renewed. Defaults to 300.
+            max_retries (int, optional): renewals attempted for a call failing to authenticate. Defaults to 2.
+        """
+        self.token_file = token_file
+        self.lifetime = lifetime
+        self.margin = margin
+        self.max_retries = max_retries
+        self.generation = 0
+        self.expires_at = None
+        self.lock = Lock()
+        self.holders = weakref.WeakSet()
+        self.logger = logging.getLogger()
+
+    def register(self, client):
+        """Register a client (or anything holding an auth_token) to receive the renewed tokens
+
+        Args:
+            client (object): RUCIO client
+        """
+        with self.lock:
+            self.holders.add(client)
+            if self.token_file is None:
+                self.token_file = getattr(client, "token_file", None)
+            if self.expires_at is None:
+                self.expires_at = self.expiration(client)
+
+    def expiration(self, client) -> float:
+        """Return the expiration time of the token of a client
+
+        Args:
+            client (object): RUCIO client
+
+        Returns:
+            float: expiration time of the token (epoch)
+        """
+        try:
+            return float(client.token_exp_epoch)
+        except (AttributeError, TypeError, ValueError):
+            return time.time() + self.lifetime
+
+    def renew(self, generation: int):
+        """Renew the token, unless another thread already did it since generation
+
+        Args:
+            generation (int): generation of the token seen as expired
+        """
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.logger.info("renewing RUCIO auth token")
+            if self.token_file is not None and os.path.exists(self.token_file):
+                os.remove(self.token_file)
+            # a new client authenticates and writes the new token file
+            client = Client()
+            for holder in list(self.holders):
+                holder.auth_token = client.auth_token
+                headers = getattr(holder, "headers", None)
+                if isinstance(headers, dict):
+                    headers['X-Rucio-Auth-Token'] = client.auth_token
+            self.expires_at = self.expiration(client)
+            self.generation += 1
+            self.logger.info("renewing RUCIO auth token .. done")
+
+    def check(self):
+        """Renew the token if it is about to expire
+        """
+        generation = self.generation
+        if self.expires_at is not None and time.time() > self.expires_at - self.margin:
+            self.renew(generation)
+
+    def call(self, function, *args, **kwargs):
+        """Call a function renewing the token, at most max_retries times, if it fails to authenticate
+
+        Args:
+            function (function): function using a RUCIO client
+
+        Returns:
+            object: result of the function
+        """
+        self.check()
+        for retry in range(self.max_retries + 1):
+            generation = self.generation
+            try:
+                return function(*args, **kwargs)
+            except exception.CannotAuthenticate:
+                if retry == self.max_retries:
+                    raise
+                self.renew(generation)
+
+class RSEInfoCache:
+    """Cache of the RSE settings (protocols, attributes, RSE expressions)
+    shared by all the upload clients. Entries are refreshed after ttl seconds.
+    """
+
+    def __init__(self, ttl: float = 900.):
+        """RSEInfoCache constructor
+
+        Args:
+            ttl (float, optional): lifetime of the entries in seconds. Defaults to 900.
+        """
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = Lock()
+        self.logger = logging.getLogger()
+
+    def get(self, key: tuple, fetch):
+        """Return a cached entry, fetching it if missing or expired.
+        Only one thread fetches at a time.
+
+        Args:
+            key (tuple): key of the entry
+            fetch (function): function returning the value of the entry
+
+        Returns:
+            object: value of the entry
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+            self.logger.info("fetching RSE info {}".format(key))
+            value = fetch()
+            self.entries[key] = (time.time() + self.ttl, value)
+            return value
+
+    def install(self, client: UploadClient):
+        """Make an upload client use the cache for RSE settings,
+        RSE attributes and RSE expressions
+
+        Args:
+            client (UploadClient): RUCIO Upload Client
+        """
+        base = client.client
+        list_rse_attributes = base.list_rse_attributes
+        list_rses = base.list_rses
+        base.list_rse_attributes = lambda rse: self.get(("attributes", rse), lambda: list_rse_attributes(rse))
+        base.list_rses = lambda rse_expression="": self.get(("expression", rse_expression), lambda: list(list_rses(rse_expression)))
+        client.rses = RSESettings(self, base.vo)
+
+class RSESettings(dict):
+    """Mapping ("rse":"settings") backed by a RSEInfoCache, used in place of UploadClient.rses
+    """
+
+    def __init__(self, cache: RSEInfoCache, vo: str):
+        """RSESettings constructor
+
+        Args:
+            cache (RSEInfoCache): RSE info cache
+            vo (str): virtual organization
+        """
+        super().__init__()
+        self.cache = cache
+        self.vo = vo
+
+    def __getitem__(self, rse: str) -> dict:
+        return self.cache.get(("settings", rse, self.vo), lambda: rsemgr.get_rse_info(rse, vo=self.vo))
+
+    def get(self, rse: str, default=None) -> dict:
+        return self[rse]
+
+    def setdefault(self, rse: str, default=None) -> dict:
+        return self[rse]
+
+class ClientPool:
+    """Pool of long-lived RUCIO clients. Each client keeps its own
+    HTTP session and is used by one thread at a time.
+    """
+
+    def __init__(self, tokens: TokenManager = None, logger: logging.Logger = None, rse_info: RSEInfoCache = None):
+        """ClientPool constructor
+
+        Args:
+            tokens (TokenManager, optional): manager of the auth token. Defaults to None (a new one).
+            logger (logging.Logger, optional): logger of the upload clients. Defaults to None (root logger).
+            rse_info (RSEInfoCache, optional): cache of the RSE settings. Defaults to None (a new one).
+        """
+        self.tokens = tokens if tokens is not None else TokenManager()
+        self.rse_info = rse_info if rse_info is not None else RSEInfoCache()
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.factories = {"did": DIDClient,
+                          "rule": RuleClient,
+                          "replica": ReplicaClient,
+                          "upload": self.new_upload_client}
+        self.idle = {kind: queue.SimpleQueue() for kind in self.factories}
+
+    def new_upload_client(self) -> UploadClient:
+        """Create an UploadClient
+
+        Returns:
+            UploadClient: RUCIO Upload Client
+        """
+        client = UploadClient(_client=Client(), logger=self.logger)
+        self.tokens.register(client.client)
+        self.rse_info.install(client)
+        return client
+
+    def acquire(self, kind: str):
+        """Get an idle client, or a new one if all are in use
+
+        Args:
+            kind (str): kind of client ["did", "rule", "replica", "upload"]
+
+        Returns:
+            object: RUCIO client
+        """
+        try:
+            return self.idle[kind].get_nowait()
+        except queue.Empty:
+            client = self.factories[kind]()
+            self.tokens.register(client)
+            return client
+
+    def release(self, kind: str, client):
+        """Give back a client to the pool
+
+        Args:
+            kind (str): kind of client ["did", "rule", "replica", "upload"]
+            client (object): RUCIO client
+        """
+        self.idle[kind].put(client)
+
+    @contextmanager
+    def client(self, kind: str):
+        """Context manager lending a client of the pool
+
+        Args:
+            kind (str): kind of client ["did", "rule", "replica", "upload"]
+        """
+        client = self.acquire(kind)
+        try:
+            yield client
+        finally:
+            self.release(kind, client)
+
+    def call(self, kind: str, function):
+        """Call a function with a client of the pool, renewing the token if needed
+
+        Args:
+            kind (str): kind of client ["did", "rule", "replica", "upload"]
+            function (function): function taking the client as argument
+
+        Returns:
+            object: result of the function
+        """
+        with self.client(kind) as client:
+            return self.tokens.call(function, client)
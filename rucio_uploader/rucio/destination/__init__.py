@@ -0,0 +1,99 @@
+"""@package destination
+
+ Preparation of the destinations of the uploads in the
+ locally mounted upload RSE: stale files left by previous
+ uploads are removed and missing hash directories created,
+ listing each directory only once.
+
+"""
+
+import os
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+import rucio_uploader.utils as utils
+
+TEMP_SUFFIX = ".rucio.upload"
+
+class DestinationPreparer:
+    """Bulk cleanup of the destinations of the uploads
+    """
+
+    def __init__(self, rse_local_path: str, n_threads: int = 16):
+        """DestinationPreparer constructor
+
+        Args:
+            rse_local_path (str): local path of the upload RSE
+            n_threads (int, optional): number of parallel threads. Defaults to 16.
+        """
+        self.rse_local_path = rse_local_path
+        self.n_threads = n_threads
+        self.logger = logging.getLogger()
+
+    def group(self, items: list) -> dict:
+        """Group the destination filenames by hash directory
+
+        Args:
+            items (list): list of items to be uploaded
+
+        Returns:
+            dict: dictionary ("directory":"set of filenames")
+        """
+        dirs = {}
+        for item in items:
+            path = utils.deterministic_path(self.rse_local_path, item['did_scope'], item['did_name'])
+            dirname, name = os.path.split(path)
+            dirs.setdefault(dirname, set()).update((name, name + TEMP_SUFFIX))
+        return dirs
+
+    def prepare_directory(self, dirname: str, names: set) -> tuple:
+        """List a directory, remove the stale files or create the directory if missing
+
+        Args:
+            dirname (str): hash directory
+            names (set): filenames to be removed
+
+        Returns:
+            tuple: number of removed files and of created directories
+        """
+        try:
+            with os.scandir(dirname) as entries:
+                stale = [e.path for e in entries if e.name in names]
+        except FileNotFoundError:
+            os.makedirs(dirname, exist_ok=True)
+            return 0, 1
+        removed = 0
+        for path in stale:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed, 0
+
+    def prepare(self, items: list) -> bool:
+        """Prepare the destinations of the items. Prepared items are flagged
+        with "destination_ready"
+
+        Args:
+            items (list): list of items to be uploaded
+
+        Returns:
+            bool: True if the destinations are prepared, False if the RSE is not mounted
+        """
+        if not os.path.isdir(self.rse_local_path):
+            self.logger.info(" {} not mounted: destinations are not prepared".format(self.rse_local_path))
+            return False
+
+        dirs = self.group(items)
+        self.logger.info(" preparing {} destination directories".format(len(dirs)))
+        removed = created = 0
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for r, c in executor.map(lambda d: self.prepare_directory(d, dirs[d]), dirs):
+                removed += r
+                created += c
+        for item in items:
+            item["destination_ready"] = True
+        self.logger.info(" preparing {} destination directories .. done: {} stale files removed, {} directories created".format(len(dirs), removed, created))
+        return True
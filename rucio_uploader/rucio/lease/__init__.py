@@ -0,0 +1,113 @@
+"""@package lease
+
+ Leases of the work shared by concurrent invocations: a SQLite table,
+ e.g. on shared storage, records which invocation owns each dataset
+ and each file until the lease expires. Each invocation claims the work
+ not leased by the others, renews its leases while running and releases
+ them at the end; leases of invocations that died expire and are reclaimed.
+
+"""
+
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+
+from threading import Thread, Lock, Event
+
+# maximum number of parameters of a query
+CHUNK_SIZE = 500
+
+class LeaseTable:
+    """Table of the leases of datasets and files
+    """
+
+    def __init__(self, path: str, ttl: float = 3600., owner: str = None):
+        """LeaseTable constructor
+
+        Args:
+            path (str): SQLite database file
+            ttl (float, optional): duration of the leases in seconds. Defaults to 3600.
+            owner (str, optional): owner of the leases. Defaults to None (host, pid and a random id).
+        """
+        self.path = path
+        self.ttl = ttl
+        self.owner = owner if owner is not None else "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.lock = Lock()
+        self.stopped = Event()
+        self.heartbeat = None
+        self.logger = logging.getLogger()
+        self.connection = sqlite3.connect(path, timeout=300., isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS leases (kind TEXT, key TEXT, owner TEXT, expires REAL, PRIMARY KEY (kind, key))")
+
+    def claim(self, kind: str, keys: list) -> set:
+        """Claim the keys not leased by other owners
+
+        Args:
+            kind (str): kind of the keys ["dataset", "file"]
+            keys (list): list of keys
+
+        Returns:
+            set: keys leased to this owner
+        """
+        keys = list(dict.fromkeys(keys))
+        claimed = set()
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                cursor.execute("DELETE FROM leases WHERE expires < ?", (now,))
+                for i in range(0, len(keys), CHUNK_SIZE):
+                    chunk = keys[i:i + CHUNK_SIZE]
+                    cursor.execute("SELECT key FROM leases WHERE kind = ? AND owner != ? AND key IN ({})".format(",".join("?" * len(chunk))),
+                                   [kind, self.owner] + chunk)
+                    taken = set(row[0] for row in cursor.fetchall())
+                    free = [key for key in chunk if key not in taken]
+                    cursor.executemany("INSERT OR REPLACE INTO leases (kind, key, owner, expires) VALUES (?, ?, ?, ?)",
+                                       [(kind, key, self.owner, now + self.ttl) for key in free])
+                    claimed.update(free)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def renew(self):
+        """Extend all the leases of this owner
+        """
+        with self.lock:
+            self.connection.execute("UPDATE leases SET expires = ? WHERE owner = ?", (time.time() + self.ttl, self.owner))
+
+    def release(self):
+        """Release all the leases of this owner
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM leases WHERE owner = ?", (self.owner,))
+
+    def renew_loop(self):
+        """Renew the leases every third of their duration, until stopped
+        """
+        while not self.stopped.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except sqlite3.Error as e:
+                self.logger.info(" renewing leases .. fail: {}".format(e))
+
+    def start(self):
+        """Start renewing the leases in the background
+        """
+        self.heartbeat = Thread(target=self.renew_loop, daemon=True)
+        self.heartbeat.start()
+
+    def stop(self):
+        """Stop renewing and release the leases
+        """
+        self.stopped.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+        self.release()
+        self.connection.close()
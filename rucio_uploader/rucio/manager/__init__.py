@@ -1,34 +1,56 @@
 import os
+import re
 import time
 import logging
-import hashlib
 import json
+import tempfile
 import subprocess
 
 import rucio_uploader.utils as utils
+import rucio_uploader.logger as rucio_logger
+import rucio_uploader.trace as trace
+import rucio_uploader.rucio.plan as upload_plan
+import rucio_uploader.rucio.clients as rucio_clients
+import rucio_uploader.rucio.destination as destination
+import rucio_uploader.rucio.transfer as transfer
+import rucio_uploader.rucio.scheduler as scheduler
+import rucio_uploader.rucio.status as rule_status
+import rucio_uploader.rucio.verify as verify
+import rucio_uploader.rucio.watchdog as watchdog
+import rucio_uploader.rucio.recall as recall
+import rucio_uploader.rucio.reconcile as reconcile
+import rucio_uploader.rucio.lease as lease_table
 
 from rucio.client.uploadclient import UploadClient
-from rucio.client.didclient import DIDClient
-from rucio.client.ruleclient import RuleClient
 from rucio.common import exception
-from threading import Thread, Lock
+from rucio.rse import rsemanager as rsemgr
+from threading import Thread
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from requests.exceptions import ConnectionError
 
-# lock for cuncurrent writing of log file
-mutex = Lock()
-
 class RucioClient:
     """Wrapper of several RUCIO clients
     """
-    def __init__(self, rse_local_path):
+    def __init__(self, config: dict):
         """RucioClient constructor
 
+        Args:
+            config (dict): configuration
         """
-        self.DIDCLIENT = DIDClient()
-        self.RULECLIENT = RuleClient()
         self.logger = logging.getLogger()
-        self.rse_local_path = rse_local_path
+        self.dump = rucio_logger.get_dump_logger()
+        self.rse_local_path = config["rse_local_path"]
+        self.min_upload_duration = config.get("min_upload_duration", 60.)
+        self.watchdog = watchdog.Watchdog(config.get("watchdog_floor", 300.),
+                                          config.get("upload_timeout") or 21600.,
+                                          config.get("watchdog_factor", 3.))
+        self.watchdog_retries = config.get("watchdog_retries", 1)
+        self.watchdog_grace = config.get("watchdog_grace", 600.)
+        self.pool = rucio_clients.ClientPool(rucio_clients.TokenManager(config.get("auth_token_file")),
+                                             self.logger,
+                                             rucio_clients.RSEInfoCache(config.get("rse_info_ttl", 900.)))
     
     def log(self, message: str):
         """Log message
@@ -36,11 +58,7 @@ class RucioClient:
         Args:
             message (str): txt message to be logged
         """
-        mutex.acquire()
-        try:
-            self.logger.info(message)
-        finally:
-            mutex.release()
+        self.logger.info(message)
 
     def dids_in_rucio(self, scope: str) -> list:
         """Get list of DIDs in RUCIO within the scope
@@ -51,11 +69,7 @@ class RucioClient:
         Returns:
             list: list of DIDs in RUCIO within the scope
         """
-        try:
-            return [utils.get_scoped_name(name, scope) for name in list(self.DIDCLIENT.list_dids(scope,{},did_type="file"))]
-        except:
-            os.remove("/tmp/icaruspro/.rucio_icaruspro/auth_token_for_account_icaruspro")
-            return self.dids_in_rucio(scope)
+        return self.pool.call("did", lambda client: [utils.get_scoped_name(name, scope) for name in client.list_dids(scope,{},did_type="file")])
     
     def dataset_in_rucio(self, scope: str) -> list:
         """Get list of datasets in RUCIO within the scope
@@ -66,7 +80,7 @@ class RucioClient:
         Returns:
             list: list of datasets in RUCIO within the scope
         """
-        return [utils.get_scoped_name(name, scope) for name in list(self.DIDCLIENT.list_dids(scope,{},did_type="dataset"))]
+        return self.pool.call("did", lambda client: [utils.get_scoped_name(name, scope) for name in client.list_dids(scope,{},did_type="dataset")])
 
     def dids_in_dataset(self, dataset_scope: str, dataset_name: str) -> list:
         """Get list of DIDs within a dataset
@@ -78,8 +92,60 @@ class RucioClient:
         Returns:
             list: list of DIDs within a dataset
         """
-        return [utils.get_scoped_name(x["name"],x["scope"]) for x in list(self.DIDCLIENT.list_content(dataset_scope,dataset_name))]
+        return self.pool.call("did", lambda client: [utils.get_scoped_name(x["name"],x["scope"]) for x in client.list_content(dataset_scope,dataset_name)])
     
+    def locality(self, path: str, max_attempts: int = 10) -> str:
+        """Get the locality of a file in dCache
+
+        Args:
+            path (str): filepath
+            max_attempts (int, optional): number of attempts. Defaults to 10.
+
+        Returns:
+            str: locality ["ONLINE", "NEARLINE", "ONLINE_AND_NEARLINE"], empty if not available or if the query hangs
+        """
+        where = ""
+        for _ in range(max_attempts):
+            try:
+                with trace.span("locality", "file", file=os.path.basename(path)):
+                    proc = subprocess.run('cat {}/\".(get)({})(locality)\"'.format(os.path.dirname(path),os.path.basename(path)), shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=-1, timeout=60)
+            except subprocess.TimeoutExpired:
+                self.log("locality of {} .. fail: timeout".format(path))
+                return ""
+            where = proc.stdout.decode().strip()
+            if where != "" or not os.path.exists(path):
+                break
+        return where
+
+    def is_deterministic(self, rse: str) -> bool:
+        """Check if the paths of the replicas at a RSE are deterministic, i.e.
+        derived from their names and not chosen by whom registers them
+
+        Args:
+            rse (str): RUCIO storage element
+
+        Returns:
+            bool: True if the RSE is deterministic
+        """
+        return self.pool.rse_info.get(("settings", rse), lambda: rsemgr.get_rse_info(rse))["deterministic"]
+
+    def recall_if_on_tape(self, item: dict, id: int) -> bool:
+        """Trigger the recall of a file on tape
+
+        Args:
+            item (dict): item to be uploaded
+            id (int): batch id
+
+        Returns:
+            bool: True if the file is on tape only
+        """
+        where = item["locality"] if "locality" in item else self.locality(item["path"])
+        if where == "NEARLINE":
+            self.log("file {} is on tape -> recall to disk - Thread ID: {}".format(item['did_name'], id))
+            os.popen('timeout 3 ifdh cp {} /dev/null'.format(item["path"]))
+            return True
+        return False
+
     def upload(self, item: dict, client: UploadClient, id: int) -> bool:
         """Upload items
 
@@ -94,31 +160,22 @@ class RucioClient:
         self.log("uploading {} - Thread ID: {}".format(item['did_name'], id))
 
         # check if file is on tape
-        where = ""
-        while(where == ""):
-            # stream = os.popen('cat {}/\".(get)({})(locality)\"'.format(os.path.dirname(item["path"]),os.path.basename(item["path"])))
-            # where = stream.read().strip()
-            proc = subprocess.run('cat {}/\".(get)({})(locality)\"'.format(os.path.dirname(item["path"]),os.path.basename(item["path"])), shell=True, stdout=subprocess.PIPE, bufsize=-1, timeout=60)
-            where = proc.stdout.decode().strip()
-        if(where == "NEARLINE"):
-            self.log("file {} is on tape -> recall to disk - Thread ID: {}".format(item['did_name'], id))
-            os.popen('timeout 3 ifdh cp {} /dev/null'.format(item["path"]))
+        if self.recall_if_on_tape(item, id):
             return True
 
-        # remove possible temporary files
-        hash = hashlib.md5("{}:{}".format(item['did_scope'],item['did_name']).encode('utf-8')).hexdigest()
-        destination_path="{}/{}/{}/{}".format(self.rse_local_path,hash[:2],hash[2:4],item["did_name"])
-        temp_destination_path="{}.rucio.upload".format(destination_path)
-        if os.path.exists(destination_path):
-            os.remove(destination_path)
-        if os.path.exists(temp_destination_path):
-            os.remove(temp_destination_path)
+        # remove possible temporary files, unless already done in bulk
+        self.clean_destination(item)
 
         result = False
         start = time.time()
+        generation = self.pool.tokens.generation
 
         try:
-            client.upload([item])
+            with trace.span("transfer", "file", file=item['did_name'], bytes=item['size']):
+                self.watchdog.run(lambda: client.upload([item]), item['size'])
+        except exception.CannotAuthenticate as e:
+            self.log("uploading {} - Thread ID: {} .. fail: {}".format(item['did_name'], id, e))
+            self.pool.tokens.renew(generation)
         except exception.NoFilesUploaded as e:
             self.log("uploading {} - Thread ID: {} .. fail: {}".format(item['did_name'], id, e))
         except exception.ServerConnectionException as e:
@@ -143,27 +200,197 @@ class RucioClient:
             result = True
 
 
-        stop = time.time()
-
-        if(stop - start < 60):
-            time.sleep(60.)
+        self.wait_min_duration(start)
         
         return result
-    
-    def upload_batch(self, items: list, id: int):
-        """Upload a batch of items
+
+    def clean_destination(self, item: dict):
+        """Remove possible files left in the destination by previous uploads,
+        unless already done in bulk
+
+        Args:
+            item (dict): item to be uploaded
+        """
+        if not item.get("destination_ready"):
+            with trace.span("clean_destination", "file", file=item['did_name']):
+                destination_path = utils.deterministic_path(self.rse_local_path, item['did_scope'], item['did_name'])
+                temp_destination_path="{}{}".format(destination_path, destination.TEMP_SUFFIX)
+                if os.path.exists(destination_path):
+                    os.remove(destination_path)
+                if os.path.exists(temp_destination_path):
+                    os.remove(temp_destination_path)
+
+    def wait_min_duration(self, start: float):
+        """Wait until each upload call lasts at least min_upload_duration seconds
 
         Args:
-            items (list): batch of items
+            start (float): start time of the upload call
+        """
+        elapsed = time.time() - start
+        if elapsed < self.min_upload_duration:
+            with trace.span("min_duration_wait", "file"):
+                time.sleep(self.min_upload_duration - elapsed)
+
+    def upload_group(self, items: list, client: UploadClient, id: int) -> list:
+        """Upload a group of items with a single upload call
+
+        Args:
+            items (list): items to be uploaded
+            client (UploadClient): RUCIO Upload Client
             id (int): batch id
 
         Returns:
-            tuple: list of successfully and failed uploaded items
+            list: list of the items whose upload failed
         """
-        UPCLIENT = UploadClient()
+        items = [item for item in items if not self.recall_if_on_tape(item, id)]
+        if len(items) == 0:
+            return []
         for item in items:
-            if not self.upload(item, UPCLIENT, id):
-                UPCLIENT = UploadClient(logger=self.logger)
+            self.clean_destination(item)
+
+        self.log("uploading group of {} files - Thread ID: {}".format(len(items), id))
+        start = time.time()
+        generation = self.pool.tokens.generation
+        summary_file, summary_path = tempfile.mkstemp(prefix="rucio_upload_summary_", suffix=".json")
+        os.close(summary_file)
+        try:
+            with trace.span("transfer_group", "file", files=len(items), bytes=sum(item['size'] for item in items)):
+                self.watchdog.run(lambda: client.upload(items, summary_file_path=summary_path), sum(item['size'] for item in items))
+        except watchdog.TransferTimeout as e:
+            # the abandoned transfer may still write the summary
+            e.temporary_files.append(summary_path)
+            raise
+        except exception.CannotAuthenticate as e:
+            self.log("uploading group of {} files - Thread ID: {} .. fail: {}".format(len(items), id, e))
+            self.pool.tokens.renew(generation)
+        except (exception.RucioException, ConnectionError) as e:
+            self.log("uploading group of {} files - Thread ID: {} .. fail: {}".format(len(items), id, e))
+
+        # the summary lists the files successfully uploaded
+        uploaded = {}
+        try:
+            with open(summary_path) as f:
+                uploaded = json.load(f)
+        except ValueError:
+            pass
+        finally:
+            os.remove(summary_path)
+
+        failed = []
+        for item in items:
+            if utils.get_scoped_name(item['did_name'], item['did_scope']) in uploaded:
+                item["upload_ok"] = True
+            else:
+                failed.append(item)
+        self.log("uploading group of {} files - Thread ID: {} .. done: {} failed".format(len(items), id, len(failed)))
+
+        self.wait_min_duration(start)
+
+        return failed
+    
+    def upload_unit(self, unit: list, client: UploadClient, id: int):
+        """Upload a list of items with a single upload call
+
+        Args:
+            unit (list): list of items
+            client (UploadClient): RUCIO Upload Client
+            id (int): batch id
+        """
+        self.pool.tokens.check()
+        if len(unit) == 1:
+            self.upload(unit[0], client, id)
+            return
+        # retry individually the items of the group that failed
+        for item in self.upload_group(unit, client, id):
+            self.pool.tokens.check()
+            self.upload(item, client, id)
+
+    def upload_worker(self, queue: scheduler.UploadScheduler, id: int):
+        """Upload the units of work taken from the scheduler
+
+        Args:
+            queue (scheduler.UploadScheduler): scheduler of the uploads
+            id (int): batch id
+        """
+        client = self.pool.acquire("upload")
+        try:
+            while True:
+                unit = queue.get()
+                if unit is None:
+                    break
+                try:
+                    with trace.span("upload", "file", files=len(unit)):
+                        self.upload_unit(unit, client, id)
+                except watchdog.TransferTimeout as e:
+                    # the abandoned transfer keeps its client and its unit, done once ended
+                    client = self.pool.acquire("upload")
+                    Thread(target=self.abandon, args=(unit, queue, id, e), daemon=True).start()
+                    continue
+                except Exception as e:
+                    # e.g. a hung dCache query or a failing cleanup: the worker goes on
+                    for item in unit:
+                        if not item["upload_ok"]:
+                            self.log("uploading {} - Thread ID: {} .. fail: {}".format(item['did_name'], id, repr(e)))
+                queue.done(unit)
+        finally:
+            self.pool.release("upload", client)
+
+    def abandon(self, unit: list, queue: scheduler.UploadScheduler, id: int, error: watchdog.TransferTimeout):
+        """Wait at most watchdog_grace seconds for the end of an abandoned transfer,
+        then settle its unit. The unit of a transfer still running is settled
+        only once the transfer ends: until then it stays active in the scheduler,
+        and its items are neither cleaned nor requeued, to avoid two concurrent
+        uploads of the same files.
+
+        Args:
+            unit (list): unit of work
+            queue (scheduler.UploadScheduler): scheduler of the uploads
+            id (int): batch id
+            error (watchdog.TransferTimeout): the timeout
+        """
+        self.log("uploading {} files - Thread ID: {} .. timeout: {}".format(len(unit), id, error))
+        if error.settle(self.watchdog_grace) is None:
+            self.log("uploading {} files - Thread ID: {} .. abandoned transfer still running after {:.0f} s: settled when it ends".format(len(unit), id, self.watchdog_grace))
+        error.when_settled(lambda succeeded: self.settle(unit, queue, id, error, succeeded))
+
+    def settle(self, unit: list, queue: scheduler.UploadScheduler, id: int, error: watchdog.TransferTimeout, succeeded: bool):
+        """Settle the unit of an abandoned transfer once ended. If it succeeded
+        its items are uploaded, if it failed its temporary files are removed and
+        its items requeued, up to watchdog_retries times.
+
+        Args:
+            unit (list): unit of work
+            queue (scheduler.UploadScheduler): scheduler of the uploads
+            id (int): batch id
+            error (watchdog.TransferTimeout): the timeout
+            succeeded (bool): True if the abandoned transfer succeeded
+        """
+        try:
+            for path in error.temporary_files:
+                if os.path.exists(path):
+                    os.remove(path)
+            requeue = []
+            for item in unit:
+                if item["upload_ok"]:
+                    continue
+                if succeeded:
+                    self.log("uploading {} - Thread ID: {} .. done after timeout".format(item['did_name'], id))
+                    item["upload_ok"] = True
+                    continue
+                self.log("uploading {} - Thread ID: {} .. fail: {}".format(item['did_name'], id, error.outcome.get("error")))
+                destination_path = utils.deterministic_path(self.rse_local_path, item['did_scope'], item['did_name'])
+                try:
+                    os.remove("{}{}".format(destination_path, destination.TEMP_SUFFIX))
+                except OSError:
+                    pass
+                item["timeouts"] = item.get("timeouts", 0) + 1
+                if item["timeouts"] <= self.watchdog_retries:
+                    requeue.append(item)
+            if len(requeue) != 0:
+                self.log("requeuing {} files - Thread ID: {}".format(len(requeue), id))
+                queue.requeue(requeue)
+        finally:
+            queue.done(unit)
     
     def attach(self, dataset_scope: str, dataset_name: str, items: list):
         """Attach items to RUCIO dataset
@@ -173,9 +400,12 @@ class RucioClient:
             dataset_name (str): dataset name
             items (list): list of items to be attached
         """
-        self.log("attaching {} in {}:{}".format([x['name'] for x in items], dataset_scope, dataset_name))
-        self.DIDCLIENT.attach_dids(dataset_scope,dataset_name,items)
-        self.log("attaching {} in {}:{} .. done".format([x['name'] for x in items], dataset_scope, dataset_name))
+        self.log("attaching {} items in {}:{}".format(len(items), dataset_scope, dataset_name))
+        if self.dump.isEnabledFor(logging.DEBUG):
+            self.dump.debug("attaching {} in {}:{}".format([x['name'] for x in items], dataset_scope, dataset_name))
+        with trace.span("attach", "dataset", dataset=dataset_name, files=len(items)):
+            self.pool.call("did", lambda client: client.attach_dids(dataset_scope,dataset_name,items))
+        self.log("attaching {} items in {}:{} .. done".format(len(items), dataset_scope, dataset_name))
     
     def rules_in_rucio(self, filter: dict) -> list:
         """Get list of rules in RUCIO
@@ -186,21 +416,118 @@ class RucioClient:
         Returns:
             list: list of rules in RUCIO
         """
-        return [utils.get_scoped_name(rule['name'],rule['scope']) for rule in list(self.RULECLIENT.list_replication_rules(filter))]
+        return self.pool.call("rule", lambda client: [utils.get_scoped_name(rule['name'],rule['scope']) for rule in client.list_replication_rules(filter)])
     
+    def existing(self, dids: list, n_threads: int = 16) -> list:
+        """Get the list of the given DIDs existing in RUCIO, looking up each DID in parallel
+
+        Args:
+            dids (list): list of datasets or containers (objects with scope and name)
+            n_threads (int, optional): number of parallel lookups. Defaults to 16.
+
+        Returns:
+            list: list of the scoped names of the existing DIDs
+        """
+        def exists(did):
+            try:
+                self.pool.call("did", lambda client: client.get_did(did.scope, did.name))
+            except exception.DataIdentifierNotFound:
+                return False
+            return True
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            found = list(executor.map(exists, dids))
+        return [did.get_scoped_name() for did, ok in zip(dids, found) if ok]
+
+    def split_layouts(self, datasets: list, n_threads: int = 16) -> dict:
+        """Get how the given runs are already split in RUCIO, looking up each run in parallel:
+        a run existing as dataset is not split, a run existing as container keeps the
+        number of buckets of its sub-datasets "<name>-NNN"
+
+        Args:
+            datasets (list): list of datasets of the runs (objects with scope and name)
+            n_threads (int, optional): number of parallel lookups. Defaults to 16.
+
+        Returns:
+            dict: dictionary ("scoped name":"(type, number of buckets)") of the existing runs, the number of buckets is 0 if not known
+        """
+        def layout(ds):
+            try:
+                did = self.pool.call("did", lambda client: client.get_did(ds.scope, ds.name))
+            except exception.DataIdentifierNotFound:
+                return None
+            if did["type"].upper() != "CONTAINER":
+                return (did["type"].upper(), 0)
+            pattern = re.compile(r".*:{}-([0-9]{{3}})$".format(re.escape(ds.name)))
+            indexes = [int(m.group(1)) for m in map(pattern.match, self.dids_in_dataset(ds.scope, ds.name)) if m is not None]
+            return ("CONTAINER", utils.next_power_of_two(max(indexes) + 1) if len(indexes) != 0 else 0)
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            found = list(executor.map(layout, datasets))
+        return {ds.get_scoped_name(): n for ds, n in zip(datasets, found) if n is not None}
+
+    def contents(self, dids: list, n_threads: int = 16) -> dict:
+        """Get the content of the given datasets or containers, listing each one in parallel
+
+        Args:
+            dids (list): list of existing datasets or containers (objects with scope and name)
+            n_threads (int, optional): number of parallel listings. Defaults to 16.
+
+        Returns:
+            dict: dictionary ("scoped name":"list of DIDs within")
+        """
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            content = list(executor.map(lambda did: self.dids_in_dataset(did.scope, did.name), dids))
+        return {did.get_scoped_name(): c for did, c in zip(dids, content)}
+
+    def rules_of(self, rules: list, rse: str, n_threads: int = 16) -> list:
+        """Get the list of the given DIDs having a rule to the RSE, querying the rules of each DID in parallel
+
+        Args:
+            rules (list): list of RucioRule whose DID exists
+            rse (str): RUCIO storage element
+            n_threads (int, optional): number of parallel queries. Defaults to 16.
+
+        Returns:
+            list: list of the scoped names of the DIDs with a rule to the RSE
+        """
+        def has_rule(rule):
+            return self.pool.call("did", lambda client: any(r["rse_expression"] == rse for r in client.list_did_rules(rule.scope, rule.name)))
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            found = list(executor.map(has_rule, rules))
+        return [rule.get_scoped_name() for rule, ok in zip(rules, found) if ok]
+
     def add_dataset(self, dataset_scope: str, dataset_name: str):
-        """Add a dataset to RUCIO
+        """Add a dataset to RUCIO. A dataset already existing, e.g. added by a concurrent
+        slice or since the plan, is not an error
 
         Args:
             dataset_scope (str): dataset scope
             dataset_name (str): dataset name
         """
         self.log("adding dataset {}:{}".format(dataset_scope, dataset_name))
-        self.DIDCLIENT.add_dataset(dataset_scope, dataset_name)
+        try:
+            self.pool.call("did", lambda client: client.add_dataset(dataset_scope, dataset_name))
+        except exception.DataIdentifierAlreadyExists:
+            self.log("adding dataset {}:{} .. already exists".format(dataset_scope, dataset_name))
+            return
         self.log("adding dataset {}:{} .. done".format(dataset_scope, dataset_name))
     
+    def add_container(self, container_scope: str, container_name: str):
+        """Add a container to RUCIO. A container already existing is not an error
+
+        Args:
+            container_scope (str): container scope
+            container_name (str): container name
+        """
+        self.log("adding container {}:{}".format(container_scope, container_name))
+        try:
+            self.pool.call("did", lambda client: client.add_container(container_scope, container_name))
+        except exception.DataIdentifierAlreadyExists:
+            self.log("adding container {}:{} .. already exists".format(container_scope, container_name))
+            return
+        self.log("adding container {}:{} .. done".format(container_scope, container_name))
+    
     def add_rule(self, dataset_scope: str, dataset_name: str, n_replicas: int, rse: str):
-        """Add a rule to RUCIO
+        """Add a rule to RUCIO. A rule already existing is not an error
 
         Args:
             dataset_scope (str): dataset scope
@@ -209,14 +536,18 @@ class RucioClient:
             rse (str): RUCIO storage element
         """
         self.log("adding rule for {}:{} to {}".format(dataset_scope, dataset_name, rse))
-        self.RULECLIENT.add_replication_rule([{"scope":dataset_scope, "name": dataset_name}], n_replicas, rse)
+        try:
+            self.pool.call("rule", lambda client: client.add_replication_rule([{"scope":dataset_scope, "name": dataset_name}], n_replicas, rse))
+        except exception.DuplicateRule:
+            self.log("adding rule for {}:{} to {} .. already exists".format(dataset_scope, dataset_name, rse))
+            return
         self.log("adding rule for {}:{} to {} .. done".format(dataset_scope, dataset_name, rse))
 
 class RucioManager:
     """Manager of the interaction with RUCIO 
     """
   
-    def __init__(self, dids: dict, datasets: dict, rules: dict, config: dict, args: dict, logging_level=logging.DEBUG):
+    def __init__(self, dids: dict, datasets: dict, rules: dict, config: dict, args: dict, logging_level=logging.DEBUG, containers: dict = None):
         """RucioManager constructor
 
         Args:
@@ -224,21 +555,21 @@ class RucioManager:
             datasets (dict): input datasets
             rules (dict): input rules
             config (dict): configuration
+            containers (dict, optional): input containers of the datasets. Defaults to None.
         """
-        #self.log = open(datetime.now().strftime('uploader_%Y_%m_%d_%H_%M_%S.log'),"w")
         log_filename=datetime.now().strftime('uploader_%Y_%m_%d_%H_%M_%S.log')
-        logging.basicConfig(filename=log_filename,
-                    filemode='a',
-                    format='%(asctime)s,%(msecs)d [%(name)s] [%(levelname)s] : %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S',
-                    level=logging_level)
+        dump_filename=datetime.now().strftime('uploader_%Y_%m_%d_%H_%M_%S.dump.log')
+        rucio_logger.setup(log_filename, dump_filename, logging_level)
         self.logger = logging.getLogger()
-        self.rucio = RucioClient(config["rse_local_path"])
+        self.dump = rucio_logger.get_dump_logger()
+        self.rucio = RucioClient(config)
+        self.config = config
         self.scope = config["scope"]
         self.rse = config["dst_rse"]
         self.dids = dids
         self.datasets = datasets
         self.rules = rules
+        self.containers = containers if containers is not None else {}
         self.args = args
         self.to_upload = []
         print(f"log: {log_filename}")
@@ -248,14 +579,19 @@ class RucioManager:
         self.logger.info("  _RECOVERY_JSON_STRING_ : {}".format(json.dumps(up_no)))
         self.logger.info(" =============================================")
     
-    def log_summary(self):
+    def log_summary(self, dropped: tuple = (0, 0)):
+        """Log
+
+        Args:
+            dropped (tuple, optional): number and bytes of the uploaded files no longer in to_upload. Defaults to (0, 0).
+        """
         up_ok = [x for x in self.to_upload if x["upload_ok"] == True]
         up_no = [x for x in self.to_upload if x["upload_ok"] != True]
-        up_all_size = sum(map(lambda x : x["size"], self.to_upload))
-        up_ok_size = sum(map(lambda x : x["size"], up_ok))
+        up_all_size = sum(map(lambda x : x["size"], self.to_upload)) + dropped[1]
+        up_ok_size = sum(map(lambda x : x["size"], up_ok)) + dropped[1]
         
         self.logger.info(" =============== summary =====================")
-        self.logger.info("   uploaded files: {} of {}".format(len(up_ok), len(self.to_upload)))
+        self.logger.info("   uploaded files: {} of {}".format(len(up_ok) + dropped[0], len(self.to_upload) + dropped[0]))
         self.logger.info("   uploaded bytes: {} of {}".format(up_ok_size, up_all_size))
         self.logger.info(" =============================================")
     
@@ -265,26 +601,32 @@ class RucioManager:
     def log_dids_input(self):
         """Log
         """
-        self.logger.debug(" ============ input dids =====================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ input dids =====================")
         for v in self.dids.values():
-            self.logger.debug("   {}, {}, {}, {}, {}, {}, {}, {}".format(v.name, v.scope, v.ds_name, v.ds_scope, v.path, v.in_rucio, v.in_dataset, v.size))
-        self.logger.debug(" =============================================")
+            self.dump.debug("   {}, {}, {}, {}, {}, {}, {}, {}".format(v.name, v.scope, v.ds_name, v.ds_scope, v.path, v.in_rucio, v.in_dataset, v.size))
+        self.dump.debug(" =============================================")
     
     def log_datasets_input(self):
         """Log
         """
-        self.logger.debug(" ============ input datasets =================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ input datasets =================")
         for v in self.datasets.values():
-            self.logger.debug("   {}, {}, {}".format(v.name, v.scope, v.in_rucio))
-        self.logger.debug(" =============================================")
+            self.dump.debug("   {}, {}, {}".format(v.name, v.scope, v.in_rucio))
+        self.dump.debug(" =============================================")
     
     def log_rules_input(self):
         """Log
         """
-        self.logger.debug(" ============ input rules ====================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ input rules ====================")
         for k,v in self.rules.items():
-            self.logger.debug("   {}, {}, {}, {}, {}".format(v.name, v.scope, v.ncopy, v.rse, v.in_rucio))
-        self.logger.debug(" =============================================")
+            self.dump.debug("   {}, {}, {}, {}, {}".format(v.name, v.scope, v.ncopy, v.rse, v.in_rucio))
+        self.dump.debug(" =============================================")
     
     def log_input(self):
         """Log inputs
@@ -296,35 +638,43 @@ class RucioManager:
     def log_dids_in_rucio(self, files: list):
         """Log
         """
-        self.logger.debug(" ============ files in RUCIO =================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ files in RUCIO =================")
         for f in files:
-            self.logger.debug("   {}".format(f))
-        self.logger.debug(" =============================================")
+            self.dump.debug("   {}".format(f))
+        self.dump.debug(" =============================================")
 
     def log_dids_in_dataset(self, datasets: dict):
         """Log
         """
-        self.logger.debug(" ============ files in datasets ==============")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ files in datasets ==============")
         for name, ds in datasets.items():
             for did in ds:
-                self.logger.debug("   {}, {}".format(name,did))
-        self.logger.debug(" =============================================")
+                self.dump.debug("   {}, {}".format(name,did))
+        self.dump.debug(" =============================================")
 
     def log_rules_in_rucio(self, rules: list):
         """Log
         """
-        self.logger.debug(" ============ rules in RUCIO =================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ rules in RUCIO =================")
         for r in rules:
-            self.logger.debug("   {}".format(r))
-        self.logger.debug(" =============================================")
+            self.dump.debug("   {}".format(r))
+        self.dump.debug(" =============================================")
 
     def log_datasets_in_rucio(self, datasets: list):
         """Log
         """
-        self.logger.debug(" ============ datasets in RUCIO ==============")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ datasets in RUCIO ==============")
         for ds in datasets:
-            self.logger.debug("   {}".format(ds))
-        self.logger.debug(" =============================================")
+            self.dump.debug("   {}".format(ds))
+        self.dump.debug(" =============================================")
     
     def log_rucio(self, dids: list, datasets: list, dids_in_dataset: dict, rules: list):
         """Log
@@ -337,9 +687,11 @@ class RucioManager:
     def log_dids_to_upload(self, files: list):
         """Log
         """
-        self.logger.debug(" ============ files to upload ================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ files to upload ================")
         for f in files:
-            self.logger.debug("   {}, {}, {}, {}, {}, {}, {}, {}".format(f['did_scope'], 
+            self.dump.debug("   {}, {}, {}, {}, {}, {}, {}, {}".format(f['did_scope'], 
                                                                   f['did_name'], 
                                                                   f['dataset_scope'],
                                                                   f['dataset_name'],
@@ -347,41 +699,39 @@ class RucioManager:
                                                                   f['register_after_upload'],
                                                                   f['path'],
                                                                   f['size']))
-        self.logger.debug(" =============================================")
+        self.dump.debug(" =============================================")
 
     def log_datasets_to_add(self, datasets: list):
         """Log
         """
-        self.logger.debug(" ============ datasets to add ================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ datasets to add ================")
         for ds in datasets:
-            self.logger.debug("   {}".format(ds.get_scoped_name()))
-        self.logger.debug(" =============================================")
+            self.dump.debug("   {}".format(ds.get_scoped_name()))
+        self.dump.debug(" =============================================")
 
     def log_rules_to_add(self, rules: list):
         """Log
         """
-        self.logger.debug(" ============ rules to add ===================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ rules to add ===================")
         for rule in rules:
-            self.logger.debug("   {}".format(rule.get_scoped_name()))
-        self.logger.debug(" =============================================")
+            self.dump.debug("   {}".format(rule.get_scoped_name()))
+        self.dump.debug(" =============================================")
 
     def log_dids_to_attach(self, datasets: list):
         """Log
         """
-        self.logger.debug(" ============ files to attach ================")
+        if not self.dump.isEnabledFor(logging.DEBUG):
+            return
+        self.dump.debug(" ============ files to attach ================")
         for dn, files in datasets.items():
             for f in files:
-                self.logger.debug("   {}, {}, {}".format(dn, f['name'], f['scope']))
-        self.logger.debug(" =============================================")
+                self.dump.debug("   {}, {}, {}".format(dn, f['name'], f['scope']))
+        self.dump.debug(" =============================================")
     
-    def log_todo(self, dids: list, datasets: list, rules: list):
-        """Log
-        """
-        self.log_dids_to_upload(self, dids)
-        self.log_datasets_to_add(self, datasets)
-        self.log_dids_to_attach(self, datasets)
-        self.log_rules_to_add(self, rules)
-
     def start_log(self):
         """Log
         """
@@ -393,6 +743,7 @@ class RucioManager:
         """
         self.logger.info(" ============ run complete ===================")
         self.logger.info(" =============================================")
+        rucio_logger.stop()
     
     def log_arguments(self):
         """Log
@@ -402,6 +753,7 @@ class RucioManager:
             self.logger.info("  {}: {}".format(key,value))
         self.logger.info(" =============================================")
     
+    @trace.traced("add_datasets")
     def add_datasets(self, datasets: list):
         """Add datasets to RUCIO
 
@@ -414,6 +766,20 @@ class RucioManager:
                 self.rucio.add_dataset(ds.scope, ds.name)
             self.logger.info(" =============================================")
     
+    @trace.traced("add_containers")
+    def add_containers(self, containers: list):
+        """Add containers to RUCIO
+
+        Args:
+            containers (list): list of containers to be added
+        """
+        if len(containers) != 0:
+            self.logger.info(" ============ add containers =================")
+            for c in containers:
+                self.rucio.add_container(c.scope, c.name)
+            self.logger.info(" =============================================")
+    
+    @trace.traced("add_rules")
     def add_rules(self, datasets: list):
         """Add rules to RUCIO
 
@@ -426,26 +792,58 @@ class RucioManager:
                 self.rucio.add_rule(ds.scope, ds.name, ds.ncopy, ds.rse) 
             self.logger.info(" =============================================")
 
+    @trace.traced("rucio_info")
     def rucio_info(self):
         """Get info from RUCIO for the input items
         """
+        n_threads = self.config.get("lookup_threads", 16)
         dids_in_rucio = self.rucio.dids_in_rucio(self.scope)
-        rules_in_rucio = self.rucio.rules_in_rucio({'rse_expression': self.rse})
-        dataset_in_rucio = self.rucio.dataset_in_rucio(self.scope)
 
-        dids_in_dataset = {}
+        # only the input datasets, containers and rules are looked up
+        dataset_in_rucio = set(self.rucio.existing(list(self.datasets.values()), n_threads))
+        container_in_rucio = set(self.rucio.existing(list(self.containers.values()), n_threads))
+        existing = dataset_in_rucio.union(container_in_rucio)
+        rules_in_rucio = set(self.rucio.rules_of([rule for name, rule in self.rules.items() if name in existing], self.rse, n_threads))
+
         for name, ds in self.datasets.items():
-            dids_in_dataset[name] = self.rucio.dids_in_dataset(ds.scope, ds.name)
             ds.in_rucio = True if name in dataset_in_rucio else False
+        for name, c in self.containers.items():
+            c.in_rucio = True if name in container_in_rucio else False
+
+        dids_in_dataset = {name: [] for name in self.datasets}
+        dids_in_dataset.update(self.rucio.contents([ds for ds in self.datasets.values() if ds.in_rucio], n_threads))
+        self.datasets_in_container = {name: [] for name in self.containers}
+        self.datasets_in_container.update(self.rucio.contents([c for c in self.containers.values() if c.in_rucio], n_threads))
 
+        dids_in_dataset = {name: set(dids) for name, dids in dids_in_dataset.items()}
         self.log_rucio(dids_in_rucio, dataset_in_rucio, dids_in_dataset, rules_in_rucio)
 
         for name, rule in self.rules.items():
             rule.in_rucio = True if name in rules_in_rucio else False
 
+        dids_in_rucio = set(dids_in_rucio)
         for name, did in self.dids.items():
             did.in_rucio = True if name in dids_in_rucio else False
             did.in_dataset = True if name in dids_in_dataset[utils.get_scoped_name(did.ds_name, did.ds_scope)] else False
+            did.asUpload["reconcile"] = reconcile.DONE if did.in_rucio else reconcile.TRANSFER
+
+        if self.config.get("reconcile_replicas", True):
+            self.reconcile_replicas()
+
+    @trace.traced("reconcile_replicas")
+    def reconcile_replicas(self):
+        """Classify the input items by the missing step of their upload, from the state
+        of their replicas at the upload RSE and from their destination paths
+        """
+        reconciler = reconcile.ReplicaReconciler(self.rucio.pool,
+                                                 self.replica_rses(),
+                                                 self.config["rse_local_path"],
+                                                 n_threads=self.config.get("lookup_threads", 16),
+                                                 batch_size=self.config.get("verify_batch_size", 1000))
+        items = [did.asUpload for did in self.dids.values()]
+        in_rucio = set(name for name, did in self.dids.items() if did.in_rucio)
+        counts = reconciler.classify(items, in_rucio)
+        self.logger.info(" reconciled files: {}".format(verify.summary(counts)))
 
     def dids_to_upload(self) -> list:
         """Create list of items to be uploaded 
@@ -455,7 +853,7 @@ class RucioManager:
         """
         to_upload = []
         for v in self.dids.values():
-            if v.in_rucio == False:
+            if v.asUpload["reconcile"] != reconcile.DONE:
                 to_upload.append(v.asUpload)
         self.log_dids_to_upload(to_upload)
         return to_upload
@@ -468,7 +866,7 @@ class RucioManager:
         """
         to_attach = {}
         for v in self.dids.values():
-            if v.in_dataset == False and v.in_rucio == True:
+            if v.in_dataset == False and v.asUpload["reconcile"] == reconcile.DONE:
                 dn = utils.get_scoped_name(v.ds_name, v.ds_scope)
                 if dn not in to_attach:
                     to_attach[dn] = []
@@ -486,6 +884,32 @@ class RucioManager:
         self.log_datasets_to_add(datasets_to_add)
         return datasets_to_add
 
+    def containers_to_add(self) -> list:
+        """Create list of containers to be added to RUCIO
+
+        Returns:
+            list: list of containers to be added to RUCIO
+        """
+        containers_to_add = [c for c in self.containers.values() if not c.in_rucio]
+        if len(containers_to_add) != 0:
+            self.logger.info(" containers to add: {}".format(len(containers_to_add)))
+        return containers_to_add
+
+    def datasets_to_attach(self) -> dict:
+        """Create dictionary ("container":"list of datasets") of datasets to be attached to containers
+
+        Returns:
+            dict: dictionary ("container":"list of datasets") of datasets to be attached to containers
+        """
+        to_attach = {}
+        for name, c in self.containers.items():
+            attached = set(self.datasets_in_container[name])
+            missing = [{"scope": ds.scope, "name": ds.name} for ds in c.datasets if ds.get_scoped_name() not in attached]
+            if len(missing) != 0:
+                to_attach[name] = missing
+        self.log_dids_to_attach(to_attach)
+        return to_attach
+
     def rules_to_add(self) -> list:
         """Create list of datasets to be added to RUCIO
 
@@ -496,44 +920,66 @@ class RucioManager:
         self.log_rules_to_add(rules_to_add)
         return rules_to_add
     
-    def add_all_datasets(self):
-        """Add datasets to RUCIO
-        """
-        datasets_to_add = self.datasets_to_add()
-        self.add_datasets(datasets_to_add)
-    
-    def add_all_rules(self):
-        """Add rules to RUCIO
-        """
-        rules_to_add = self.rules_to_add()
-        self.add_rules(rules_to_add)
-    
-    def upload_all(self, n_batches: int):
+    @trace.traced("upload_all")
+    def upload_all(self, n_batches: int, to_upload: list):
         """Upload all items
 
         Args:
             n_batches (int): number of parallel threads
+            to_upload (list): list of items to be uploaded
         """
         
-        self.to_upload = self.dids_to_upload()
-        
-        if len(self.to_upload) == 0:
+        self.to_upload = to_upload
+        self.transfer_all(n_batches, to_upload)
+        if self.config.get("verify_uploads", False):
+            self.verify_all(n_batches)
+
+    def transfer_all(self, n_batches: int, to_upload: list):
+        """Transfer items with the configured engine
+
+        Args:
+            n_batches (int): number of parallel threads
+            to_upload (list): list of items to be uploaded
+        """
+        if len(to_upload) == 0:
             return
         
-        self.logger.info(" number of files to upload: {}".format(len(self.to_upload)))
+        self.logger.info(" number of files to upload: {}".format(len(to_upload)))
         
-        batches = []
-        for i in range(n_batches):
-            batches.append([])
+        to_register = [x for x in to_upload if x.get("reconcile") == reconcile.REGISTER]
+        if len(to_register) != 0:
+            self.register_all_at_destination(to_register)
+            to_upload = [x for x in to_upload if x.get("reconcile") != reconcile.REGISTER]
+            if len(to_upload) == 0:
+                return
+        
+        if self.config.get("register_in_place", False):
+            to_upload = self.register_all_in_place(to_upload)
+            if len(to_upload) == 0:
+                return
+        
+        self.recall_all(to_upload)
+        to_upload = [x for x in to_upload if x.get("locality") != "NEARLINE"]
+        if len(to_upload) == 0:
+            return
+        
+        with trace.span("prepare_destinations", "phase"):
+            destination.DestinationPreparer(self.config["rse_local_path"],
+                                            self.config.get("destination_threads", 16)).prepare(to_upload)
+
+        if self.config.get("transfer_engine", "upload") == "local":
+            self.copy_all(to_upload)
+            return
+
+        queue = self.upload_scheduler()
+        queue.put_all(self.group_small_files(to_upload))
+        queue.close()
         
-        for i in range(len(self.to_upload)):
-            batches[i%n_batches].append(self.to_upload[i])
-            
         self.logger.info(" ============ upload =========================")
         threads = []
         for i in range(n_batches):
-            threads.append(Thread(target = self.rucio.upload_batch, args = ([batches[i],i])))
-        
+            threads.append(Thread(target = trace.profiled(self.rucio.upload_worker), args = ([queue,i])))
+
         for t in threads:
             t.start()
 
@@ -541,10 +987,190 @@ class RucioManager:
             t.join()
         self.logger.info(" =============================================")
 
-    def attach_all(self):
+    def recall_all(self, to_upload: list) -> Thread:
+        """Submit in the background the recalls of the items only on tape,
+        grouped per tape volume and ordered by position. The run does not
+        wait for the recalls: the files recalled are uploaded by the next run
+
+        Args:
+            to_upload (list): list of items to be uploaded
+
+        Returns:
+            Thread: thread submitting the recalls, None if no item is only on tape
+        """
+        if not self.config.get("recall_ordering", True):
+            return None
+        locator = recall.EnstoreLocator()
+        if self.config.get("tape_locator_command") is not None:
+            locator = recall.CommandLocator(self.config["tape_locator_command"])
+        planner = recall.RecallPlanner(self.rucio.locality,
+                                       locator,
+                                       n_threads=self.config.get("recall_threads", 16),
+                                       max_volumes=self.config.get("recall_volumes", 4),
+                                       bytes_per_sec=self.config.get("recall_bytes_per_sec"))
+        with trace.span("locality", "phase"):
+            nearline = planner.nearline(to_upload)
+        if len(nearline) == 0:
+            return None
+        volumes = planner.group(nearline)
+        self.logger.info(" files on tape: {} on {} volumes -> recall to disk".format(len(nearline), len(volumes)))
+        recalls = Thread(target = planner.submit, args = ([volumes]), daemon = True)
+        recalls.start()
+        return recalls
+
+    @trace.traced("verify_all")
+    def verify_all(self, n_batches: int):
+        """Verify the replicas of the uploaded items. Items whose replica is missing
+        or not available are uploaded again, up to verify_retries times, items whose
+        replica has wrong size or checksum are marked as failed.
+
+        Args:
+            n_batches (int): number of parallel threads for the uploads again
+        """
+        verifier = verify.ReplicaVerifier(self.rucio.pool,
+                                          self.replica_rses(),
+                                          n_threads=self.config.get("verify_threads", 8),
+                                          batch_size=self.config.get("verify_batch_size", 1000))
+        retries = self.config.get("verify_retries", 1)
+        for attempt in range(retries + 1):
+            uploaded = [x for x in self.to_upload if x["upload_ok"] == True and x.get("verify_error", "") is not None]
+            if len(uploaded) == 0:
+                return
+            self.logger.info(" ============ verify =========================")
+            counts = verifier.verify(uploaded)
+            self.logger.info(" verified files: {}".format(verify.summary(counts)))
+            self.logger.info(" =============================================")
+            failed = [x for x in uploaded if x["verify_error"] not in [None, "unverified"]]
+            for x in failed:
+                x["upload_ok"] = False
+            requeue = [x for x in failed if x["verify_error"] in verify.REQUEUE_ERRORS]
+            if attempt == retries or len(requeue) == 0:
+                return
+            for x in requeue:
+                x["destination_ready"] = False
+                # transferred again, not registered as at destination
+                x.pop("reconcile", None)
+            self.transfer_all(n_batches, requeue)
+
+    def upload_scheduler(self, on_items_done=None) -> scheduler.UploadScheduler:
+        """Create the scheduler of the uploads with the per source pool budgets.
+        Without a pool command all the files of a mount point share one pool, so
+        the concurrency of a pool is limited only if pool_max_active is set.
+
+        Args:
+            on_items_done (function, optional): called with the items whose upload ended. Defaults to None.
+
+        Returns:
+            scheduler.UploadScheduler: scheduler of the uploads
+        """
+        resolver = None
+        max_active = self.config.get("pool_max_active")
+        if self.config.get("source_pool_command") is not None:
+            resolver = scheduler.CommandPoolResolver(self.config["source_pool_command"])
+            if max_active is None:
+                max_active = 5
+        return scheduler.UploadScheduler(resolver,
+                                         max_active,
+                                         self.config.get("pool_bytes_per_sec"),
+                                         policy=self.config.get("schedule_policy", "smallest"),
+                                         on_items_done=on_items_done)
+
+    def group_small_files(self, to_upload: list) -> list:
+        """Group the small files of each dataset, to be uploaded with a single upload call.
+        Files smaller than small_file_threshold bytes are grouped up to small_file_group_bytes
+        bytes and small_file_group_count files for each group.
+
+        Args:
+            to_upload (list): list of items to be uploaded
+
+        Returns:
+            list: list of lists of items
+        """
+        units = scheduler.group_small_files(to_upload,
+                                            self.config.get("small_file_threshold", 64*2**20),
+                                            self.config.get("small_file_group_bytes", 2*2**30),
+                                            self.config.get("small_file_group_count", 200))
+        self.logger.info(" number of upload calls: {}".format(len(units)))
+        return units
+
+    def copy_all(self, to_upload: list):
+        """Copy all items into the locally mounted upload RSE and register them in bulk
+
+        Args:
+            to_upload (list): list of items to be uploaded
+        """
+        self.logger.info(" ============ local copy =====================")
+        engine = transfer.LocalCopyEngine(self.config["rse_local_path"],
+                                          transfer.RucioRegistrar(self.rucio.pool, self.config["upl_rse"]),
+                                          n_threads=self.config.get("local_copy_threads", 8),
+                                          batch_size=self.config.get("register_batch_size", 1000),
+                                          skip=lambda item: self.rucio.recall_if_on_tape(item, 0))
+        engine.transfer(to_upload)
+        self.logger.info(" =============================================")
+
+    def register_all_at_destination(self, to_register: list):
+        """Register the items already at their destination in the upload RSE, without transfer
+
+        Args:
+            to_register (list): list of items at their destination
+        """
+        self.logger.info(" ============ register =======================")
+        self.logger.info(" files at destination: {}".format(len(to_register)))
+        transfer.BulkRegistration(transfer.RucioRegistrar(self.rucio.pool, self.config["upl_rse"]),
+                                  self.config.get("register_batch_size", 1000)).register_all(to_register)
+        self.logger.info(" =============================================")
+
+    def replica_rses(self) -> list:
+        """Return the RSEs where the replicas of the items are registered:
+        the upload RSE and, if configured, the RSE of the registrations in place
+
+        Returns:
+            list: list of RSEs
+        """
+        if self.config.get("inplace_rse") is None:
+            return [self.config["upl_rse"]]
+        return [self.config["upl_rse"], self.config["inplace_rse"]]
+
+    def register_all_in_place(self, to_upload: list) -> list:
+        """Register in place the items already in the namespace of the upload RSE.
+        Replicas at user defined PFNs are accepted only by a non deterministic RSE:
+        without one all the items are uploaded.
+
+        Args:
+            to_upload (list): list of items to be uploaded
+
+        Returns:
+            list: list of items outside the namespace, or failing registration, still to be uploaded
+        """
+        rse = self.config.get("inplace_rse")
+        if rse is None:
+            self.logger.info(" register in place: inplace_rse not configured, uploading all the files")
+            return to_upload
+        if self.rucio.is_deterministic(rse):
+            self.logger.info(" register in place: {} is deterministic, uploading all the files".format(rse))
+            return to_upload
+        engine = transfer.InPlaceEngine(self.config["inplace_local_prefix"],
+                                        self.config["inplace_pfn_prefix"],
+                                        transfer.RucioRegistrar(self.rucio.pool, rse),
+                                        n_threads=self.config.get("local_copy_threads", 8),
+                                        batch_size=self.config.get("register_batch_size", 1000))
+        inside, outside = engine.split(to_upload)
+        self.logger.info(" ============ register in place ==============")
+        self.logger.info(" files in place: {}, files to upload: {}".format(len(inside), len(outside)))
+        engine.transfer(inside)
+        failed = [x for x in inside if not x["upload_ok"]]
+        if len(failed) != 0:
+            self.logger.info(" files failing registration in place, to upload: {}".format(len(failed)))
+        self.logger.info(" =============================================")
+        return outside + failed
+
+    @trace.traced("attach_all")
+    def attach_all(self, dids_to_attach: dict):
         """Attach all items 
+
+        Args:
+            dids_to_attach (dict): dictionary ("dataset":"list of items") of items to be attached to datasets
         """
-        dids_to_attach = self.dids_to_attach()
         if len(dids_to_attach) != 0:
             self.logger.info(" ============ attach =========================")
             for ds, items in dids_to_attach.items():
@@ -552,16 +1178,252 @@ class RucioManager:
                 self.rucio.attach(scope, name, items)
             self.logger.info(" =============================================")
 
+    @trace.traced("plan")
+    def plan(self, checksums: bool = False) -> upload_plan.UploadPlan:
+        """Reconcile the input items with RUCIO and return the work to be done
+
+        Args:
+            checksums (bool, optional): True to evaluate the adler32 checksum of the items to upload. Defaults to False.
+
+        Returns:
+            upload_plan.UploadPlan: the work to be done
+        """
+        self.rucio_info()
+        self.log_input()
+        attachments = self.dids_to_attach()
+        if len(self.containers) != 0:
+            attachments.update(self.datasets_to_attach())
+        plan = upload_plan.UploadPlan(self.config,
+                                      self.datasets_to_add(),
+                                      self.rules_to_add(),
+                                      attachments,
+                                      self.dids_to_upload(),
+                                      self.containers_to_add())
+        if checksums:
+            for item in plan.uploads:
+                if item.get("adler32") is None:
+                    item["adler32"] = utils.adler32(item["path"])
+        self.logger.info(" plan: {}".format(plan.summary()))
+        return plan
+
+    @trace.traced("execute")
+    def execute(self, plan: upload_plan.UploadPlan):
+        """Execute the work of a plan: add datasets, containers and rules,
+        attach and upload items
+
+        Args:
+            plan (upload_plan.UploadPlan): the work to be done
+        """
+        lease = None
+        if self.config.get("lease_db") is not None:
+            lease = lease_table.LeaseTable(self.config["lease_db"], self.config.get("lease_ttl", 3600.))
+            lease.start()
+            plan = self.claim(plan, lease)
+        try:
+            self.add_datasets(plan.datasets)
+            self.add_containers(plan.containers)
+            self.add_rules(plan.rules)
+            self.attach_all(plan.attachments)
+            self.upload_all(20, plan.uploads)
+            self.log_summary()
+        finally:
+            if lease is not None:
+                lease.stop()
+
+    def claim(self, plan: upload_plan.UploadPlan, lease: lease_table.LeaseTable) -> upload_plan.UploadPlan:
+        """Claim the work of a plan not leased by concurrent invocations: datasets,
+        containers, their rules and attachments at dataset granularity, uploads at
+        file granularity
+
+        Args:
+            plan (upload_plan.UploadPlan): the work to be done
+            lease (lease_table.LeaseTable): table of the leases
+
+        Returns:
+            upload_plan.UploadPlan: the work claimed
+        """
+        names = [x.get_scoped_name() for x in plan.datasets + plan.containers + plan.rules] + list(plan.attachments)
+        datasets = lease.claim("dataset", names)
+        files = lease.claim("file", [utils.get_scoped_name(x["did_name"], x["did_scope"]) for x in plan.uploads])
+        claimed = upload_plan.UploadPlan(plan.config,
+                                         [ds for ds in plan.datasets if ds.get_scoped_name() in datasets],
+                                         [rule for rule in plan.rules if rule.get_scoped_name() in datasets],
+                                         {ds: items for ds, items in plan.attachments.items() if ds in datasets},
+                                         [x for x in plan.uploads if utils.get_scoped_name(x["did_name"], x["did_scope"]) in files],
+                                         [c for c in plan.containers if c.get_scoped_name() in datasets])
+        self.logger.info(" leased by other invocations: {} datasets, {} files".format(len(set(names)) - len(datasets),
+                                                                                      len(plan.uploads) - len(claimed.uploads)))
+        n_claimed = len(claimed.uploads)
+        claimed.uploads = self.not_available(claimed.uploads)
+        self.logger.info(" uploaded by other invocations since the plan: {} files".format(n_claimed - len(claimed.uploads)))
+        self.logger.info(" claimed: {}".format(claimed.summary()))
+        return claimed
+
+    def not_available(self, items: list) -> list:
+        """Return the items without an available replica, listing the replicas in bulk. Leases
+        of finished work are released, so the files of a plan may have been uploaded since by
+        another invocation. Items whose replicas cannot be listed are kept.
+
+        Args:
+            items (list): list of items to be uploaded
+
+        Returns:
+            list: list of the items still to be uploaded
+        """
+        reconciler = reconcile.ReplicaReconciler(self.rucio.pool,
+                                                 self.replica_rses(),
+                                                 self.config["rse_local_path"],
+                                                 n_threads=self.config.get("lookup_threads", 16),
+                                                 batch_size=self.config.get("verify_batch_size", 1000))
+        batches = [items[i:i + reconciler.batch_size] for i in range(0, len(items), reconciler.batch_size)]
+        replicas = {}
+        with ThreadPoolExecutor(max_workers=reconciler.n_threads) as executor:
+            for found in executor.map(reconciler.fetch, batches):
+                replicas.update(found or {})
+        return [x for x in items if reconciler.replica_state(replicas.get(utils.get_scoped_name(x["did_name"], x["did_scope"]))) != "AVAILABLE"]
+
+    def write_plan(self, path: str, checksums: bool = False):
+        """Reconcile the input items with RUCIO and write the plan to a file
+
+        Args:
+            path (str): plan file
+            checksums (bool, optional): True to evaluate the adler32 checksum of the items to upload. Defaults to False.
+        """
+        self.start_log()
+        self.log_arguments()
+        self.plan(checksums).write(path)
+        self.logger.info(" plan written to {}".format(path))
+        self.stop_log()
+
+    def run_plan(self, plan: upload_plan.UploadPlan):
+        """Execute the work of a plan read from a file
+
+        Args:
+            plan (upload_plan.UploadPlan): the work to be done
+        """
+        self.start_log()
+        self.log_arguments()
+        self.logger.info(" plan: {}".format(plan.summary()))
+        self.execute(plan)
+        self.stop_log()
+
+    def status(self, interval: float = None, cache_file: str = None):
+        """Report the progress of the input replication rules, on datasets or containers
+
+        Args:
+            interval (float, optional): seconds between polls, until all rules are OK. Defaults to None (poll once).
+            cache_file (str, optional): json file caching the status between invocations. Defaults to None.
+        """
+        self.start_log()
+        self.log_arguments()
+        tracker = rule_status.RuleStatusTracker(self.rucio.pool, self.rse, cache_file=cache_file)
+        datasets = [(rule.scope, rule.name) for rule in self.rules.values()]
+        def report(line):
+            print(line)
+            self.logger.info(line)
+        tracker.watch(datasets, interval, report)
+        self.stop_log()
+
+    def watch(self, watcher, make_items, n_batches: int = 20):
+        """Upload continuously the new files reported by a watcher. The content of
+        RUCIO is listed once and kept in memory, the upload threads are persistent.
+        A file is known to be in RUCIO once uploaded; failed uploads are requeued
+        up to watch_retries times, waiting watch_backoff seconds doubled at each retry.
+        The uploaded files are not kept in memory, only counted in the summary.
+
+        Args:
+            watcher (DirectoryWatcher): watcher of new files
+            make_items (function): function returning the items configurator of a list of new files
+            n_batches (int, optional): number of parallel threads. Defaults to 20.
+        """
+        self.start_log()
+        self.log_arguments()
+        known_dids = set(self.rucio.dids_in_rucio(self.scope))
+        known_datasets = set(self.rucio.dataset_in_rucio(self.scope))
+        known_rules = set(self.rucio.rules_in_rucio({'rse_expression': self.rse}))
+
+        max_retries = self.config.get("watch_retries", 5)
+        backoff = self.config.get("watch_backoff", 60.)
+        finished = deque()
+        in_flight = {}
+        retries = []
+        # number and bytes of the uploaded files, dropped from memory
+        uploaded = [0, 0]
+
+        queue = self.upload_scheduler(finished.extend)
+        threads = []
+        for i in range(n_batches):
+            threads.append(Thread(target = trace.profiled(self.rucio.upload_worker), args = ([queue,i])))
+        for t in threads:
+            t.start()
+
+        self.logger.info(" ============ watch ==========================")
+        try:
+            while True:
+                timeout = None
+                if len(retries) != 0:
+                    timeout = min(watcher.interval, max(0., min(due for due, _ in retries) - time.time()))
+                paths = watcher.wait(timeout)
+
+                now = time.time()
+                while len(finished) != 0:
+                    item = finished.popleft()
+                    sname = utils.get_scoped_name(item["did_name"], item["did_scope"])
+                    if item["upload_ok"]:
+                        known_dids.add(sname)
+                        in_flight.pop(sname, None)
+                        uploaded[0] += 1
+                        uploaded[1] += item["size"]
+                        continue
+                    item["watch_retries"] = item.get("watch_retries", 0) + 1
+                    if item["watch_retries"] > max_retries:
+                        self.logger.info(" uploading {} .. fail: giving up after {} retries".format(item["did_name"], max_retries))
+                        in_flight.pop(sname, None)
+                        self.to_upload.append(item)
+                        continue
+                    retries.append((now + backoff * 2**(item["watch_retries"] - 1), item))
+                due = [item for t, item in retries if t <= now]
+                if len(due) != 0:
+                    retries = [(t, item) for t, item in retries if t > now]
+                    self.logger.info(" retrying files: {}".format(len(due)))
+                    for item in due:
+                        item["destination_ready"] = False
+                    queue.put_all(self.group_small_files(due))
+
+                if len(paths) == 0:
+                    continue
+                self.logger.info(" new files: {}".format(len(paths)))
+                items = make_items(paths)
+
+                self.add_datasets([ds for name, ds in items.datasets.items() if name not in known_datasets])
+                known_datasets.update(items.datasets.keys())
+                self.add_rules([rule for name, rule in items.rules.items() if name not in known_rules])
+                known_rules.update(items.rules.keys())
+
+                to_upload = [did.asUpload for name, did in items.dids.items() if name not in known_dids and name not in in_flight]
+                in_flight.update((utils.get_scoped_name(x["did_name"], x["did_scope"]), x) for x in to_upload)
+                if len(to_upload) == 0:
+                    continue
+                self.log_dids_to_upload(to_upload)
+                destination.DestinationPreparer(self.config["rse_local_path"],
+                                                self.config.get("destination_threads", 16)).prepare(to_upload)
+                queue.put_all(self.group_small_files(to_upload))
+        except KeyboardInterrupt:
+            self.logger.info(" watch stopped: waiting for the running uploads")
+        finally:
+            queue.close()
+            for t in threads:
+                t.join()
+            self.logger.info(" =============================================")
+            # the files given up and the ones not uploaded yet, the uploaded ones are only counted
+            self.to_upload.extend(in_flight.values())
+            self.log_summary(tuple(uploaded))
+            self.stop_log()
+
     def run(self):
         """Process all items
         """
         self.start_log()
         self.log_arguments()
-        self.rucio_info()
-        self.log_input()
-        self.attach_all()
-        self.add_all_datasets()
-        self.add_all_rules()
-        self.upload_all(20)
-        self.log_summary()
+        self.execute(self.plan())
         self.stop_log()
@@ -0,0 +1,151 @@
+"""@package plan
+
+ Serializable upload plan: the result of the reconciliation
+ of the input items with RUCIO (datasets and rules to add,
+ items to attach and to upload) stored in a compact, versioned,
+ gzip compressed json file.
+
+"""
+
+import gzip
+import json
+
+import rucio_uploader.rucio.wrappers as wrapper
+
+PLAN_VERSION = 2
+
+# versions that can be read: version 1 has no containers
+SUPPORTED_VERSIONS = [1, 2]
+
+# fields of the items to upload, stored as columns
+UPLOAD_FIELDS = ["path",
+                 "did_name",
+                 "did_scope",
+                 "dataset_name",
+                 "dataset_scope",
+                 "register_after_upload",
+                 "rse",
+                 "size",
+                 "adler32",
+                 "reconcile",
+                 "replica_state"]
+
+class UploadPlanError(Exception):
+    """Error reading an upload plan
+    """
+
+class UploadPlan:
+    """Reconciled work to be done in RUCIO
+    """
+
+    def __init__(self, config: dict, datasets: list = None, rules: list = None, attachments: dict = None, uploads: list = None, containers: list = None):
+        """UploadPlan constructor
+
+        Args:
+            config (dict): configuration
+            datasets (list, optional): list of RucioDataset to be added. Defaults to None.
+            rules (list, optional): list of RucioRule to be added. Defaults to None.
+            attachments (dict, optional): dictionary ("dataset":"list of items") of items, or datasets in containers, to be attached. Defaults to None.
+            uploads (list, optional): list of items to be uploaded. Defaults to None.
+            containers (list, optional): list of RucioContainer to be added. Defaults to None.
+        """
+        self.config = config
+        self.datasets = datasets if datasets is not None else []
+        self.rules = rules if rules is not None else []
+        self.attachments = attachments if attachments is not None else {}
+        self.uploads = uploads if uploads is not None else []
+        self.containers = containers if containers is not None else []
+
+    def slice(self, index: int, count: int):
+        """Return the index-th of count slices of the plan. The uploads are
+        split round robin among the slices, datasets, containers, rules and
+        attachments are kept only in the first slice.
+
+        Args:
+            index (int): index of the slice
+            count (int): number of slices
+
+        Returns:
+            UploadPlan: slice of the plan
+        """
+        if count < 1 or index < 0 or index >= count:
+            raise ValueError("invalid slice {} of {}".format(index, count))
+        if index == 0:
+            return UploadPlan(self.config, self.datasets, self.rules, self.attachments, self.uploads[index::count], self.containers)
+        return UploadPlan(self.config, uploads=self.uploads[index::count])
+
+    def to_dict(self) -> dict:
+        """Return the plan as a json serializable dictionary
+
+        Returns:
+            dict: the plan
+        """
+        return {"version": PLAN_VERSION,
+                "config": self.config,
+                "datasets": [[ds.scope, ds.name] for ds in self.datasets],
+                "containers": [[c.scope, c.name] for c in self.containers],
+                "rules": [[rule.scope, rule.name, rule.rse, rule.ncopy] for rule in self.rules],
+                "attachments": {ds: [[x["scope"], x["name"]] for x in items] for ds, items in self.attachments.items()},
+                "upload_fields": UPLOAD_FIELDS,
+                "uploads": [[item.get(f) for f in UPLOAD_FIELDS] for item in self.uploads]}
+
+    @classmethod
+    def from_dict(cls, plan: dict):
+        """Build the plan from a dictionary
+
+        Args:
+            plan (dict): the plan as returned by to_dict
+
+        Returns:
+            UploadPlan: the plan
+        """
+        if plan.get("version") not in SUPPORTED_VERSIONS:
+            raise UploadPlanError("unsupported plan version {} (expected {})".format(plan.get("version"), PLAN_VERSION))
+        datasets = [wrapper.RucioDataset(name, scope, []) for scope, name in plan["datasets"]]
+        containers = [wrapper.RucioContainer(name, scope, []) for scope, name in plan.get("containers", [])]
+        rules = [wrapper.RucioRule(rse, name, scope, ncopy) for scope, name, rse, ncopy in plan["rules"]]
+        attachments = {ds: [{"scope": scope, "name": name} for scope, name in items] for ds, items in plan["attachments"].items()}
+        uploads = []
+        for row in plan["uploads"]:
+            item = {k: v for k, v in zip(plan["upload_fields"], row) if v is not None}
+            item["upload_ok"] = False
+            uploads.append(item)
+        return cls(plan["config"], datasets, rules, attachments, uploads, containers)
+
+    def write(self, path: str):
+        """Write the plan to a gzip compressed json file
+
+        Args:
+            path (str): plan file
+        """
+        with gzip.open(path, "wt") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+
+    @classmethod
+    def read(cls, path: str):
+        """Read the plan from a gzip compressed json file
+
+        Args:
+            path (str): plan file
+
+        Returns:
+            UploadPlan: the plan
+        """
+        try:
+            with gzip.open(path, "rt") as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            raise UploadPlanError("cannot read plan {}: {}".format(path, e))
+
+    def summary(self) -> str:
+        """Return a one line summary of the plan
+
+        Returns:
+            str: summary of the plan
+        """
+        return "datasets: {}, containers: {}, rules: {}, attachments: {}, uploads: {} ({} bytes)".format(len(self.datasets),
+                                                                                                         len(self.containers),
+                                                                                                         len(self.rules),
+                                                                                                         sum(len(x) for x in self.attachments.values()),
+                                                                                                         len(self.uploads),
+                                                                                                         sum(x["size"] for x in self.uploads))
@@ -0,0 +1,164 @@
+"""@package recall
+
+ Recall from tape ordered by volume: the files only on tape are located
+ on their tape volume, grouped per volume and their recalls submitted in
+ order of position on the volume, so that each cartridge is mounted once
+ and read sequentially. A limited number of volumes is served at a time
+ and the recalls of each volume can be paced.
+
+"""
+
+import os
+import time
+import logging
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+UNKNOWN_VOLUME = "unknown"
+
+class EnstoreLocator:
+    """Locator of a file on tape from the Enstore layer 4 of its dCache
+    namespace entry: volume in the first line, location cookie in the second
+    """
+
+    def locate(self, path: str) -> tuple:
+        """Return the tape volume and the position of a file
+
+        Args:
+            path (str): filepath
+
+        Returns:
+            tuple: volume and position, UNKNOWN_VOLUME and 0 if not available
+        """
+        layer = os.path.join(os.path.dirname(path), ".(use)(4)({})".format(os.path.basename(path)))
+        try:
+            with open(layer) as f:
+                lines = f.read().split("\n")
+        except OSError:
+            return UNKNOWN_VOLUME, 0
+        if len(lines) < 2 or lines[0].strip() == "":
+            return UNKNOWN_VOLUME, 0
+        # location cookie, e.g. 0000_000000000_0001234: the last field is the file number on the volume
+        try:
+            position = int(lines[1].strip().split("_")[-1])
+        except ValueError:
+            position = 0
+        return lines[0].strip(), position
+
+class CommandLocator:
+    """Locator of a file on tape with a shell command
+    """
+
+    def __init__(self, command: str):
+        """CommandLocator constructor
+
+        Args:
+            command (str): shell command template, {path} is replaced by the filepath; the output is the volume and the position
+        """
+        self.command = command
+
+    def locate(self, path: str) -> tuple:
+        """Return the tape volume and the position of a file
+
+        Args:
+            path (str): filepath
+
+        Returns:
+            tuple: volume and position, UNKNOWN_VOLUME and 0 if not available
+        """
+        try:
+            proc = subprocess.run(self.command.format(path=path), shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60)
+            fields = proc.stdout.decode().split()
+            return fields[0], int(fields[1])
+        except (subprocess.TimeoutExpired, IndexError, ValueError):
+            return UNKNOWN_VOLUME, 0
+
+def trigger_recall(path: str):
+    """Trigger the recall of a file to disk, without waiting for the copy
+
+    Args:
+        path (str): filepath
+    """
+    subprocess.Popen('timeout 3 ifdh cp {} /dev/null'.format(path), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+class RecallPlanner:
+    """Planner of the recalls of the files only on tape
+    """
+
+    def __init__(self, locality, locator, n_threads: int = 16, max_volumes: int = 4, bytes_per_sec: float = None, recall = trigger_recall):
+        """RecallPlanner constructor
+
+        Args:
+            locality (function): function returning the dCache locality of a file
+            locator (object): locator of the files on tape, with the locate method
+            n_threads (int, optional): number of parallel locality and location queries. Defaults to 16.
+            max_volumes (int, optional): number of volumes served at a time. Defaults to 4.
+            bytes_per_sec (float, optional): recalled bytes per second for each volume. Defaults to None (no limit).
+            recall (function, optional): function triggering the recall of a file. Defaults to trigger_recall.
+        """
+        self.locality = locality
+        self.locator = locator
+        self.n_threads = n_threads
+        self.max_volumes = max_volumes
+        self.bytes_per_sec = bytes_per_sec
+        self.recall = recall
+        self.logger = logging.getLogger()
+
+    def nearline(self, items: list) -> list:
+        """Return the items only on tape. The locality of each item is stored in item["locality"]
+
+        Args:
+            items (list): list of items
+
+        Returns:
+            list: list of the items only on tape
+        """
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for item, where in zip(items, executor.map(lambda item: self.locality(item["path"]), items)):
+                item["locality"] = where
+        return [item for item in items if item["locality"] == "NEARLINE"]
+
+    def group(self, items: list) -> dict:
+        """Group the items per volume, in order of position
+
+        Args:
+            items (list): list of items only on tape
+
+        Returns:
+            dict: dictionary ("volume":"list of items") 
+        """
+        volumes = {}
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for item, (volume, position) in zip(items, executor.map(lambda item: self.locator.locate(item["path"]), items)):
+                volumes.setdefault(volume, []).append((position, item))
+        return {volume: [item for _, item in sorted(v, key=lambda x: x[0])] for volume, v in volumes.items()}
+
+    def recall_volume(self, volume: str, items: list):
+        """Submit the recalls of a volume in order of position
+
+        Args:
+            volume (str): tape volume
+            items (list): items of the volume, in order of position
+        """
+        self.logger.info(" recalling {} files from volume {}".format(len(items), volume))
+        start = time.time()
+        submitted = 0
+        for item in items:
+            if self.bytes_per_sec is not None:
+                wait = start + submitted / self.bytes_per_sec - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+            self.recall(item["path"])
+            submitted += item["size"]
+        self.logger.info(" recalling {} files from volume {} .. done".format(len(items), volume))
+
+    def submit(self, volumes: dict):
+        """Submit the recalls, a limited number of volumes at a time, the largest volumes first
+
+        Args:
+            volumes (dict): dictionary ("volume":"list of items") as returned by group
+        """
+        order = sorted(volumes, key=lambda v: -len(volumes[v]))
+        with ThreadPoolExecutor(max_workers=self.max_volumes) as executor:
+            list(executor.map(lambda v: self.recall_volume(v, volumes[v]), order))
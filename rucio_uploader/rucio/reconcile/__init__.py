@@ -0,0 +1,134 @@
+"""@package reconcile
+
+ Reconciliation of the replicas of the input files: the replica
+ states at the upload RSE are fetched in bulk and the deterministic
+ destination paths are checked, so that a half-finished upload only
+ runs its missing step: files with an available replica are done,
+ files already at their destination are registered, the others
+ are transferred.
+
+"""
+
+import os
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+import rucio_uploader.utils as utils
+import rucio_uploader.rucio.verify as verify
+import rucio_uploader.rucio.transfer as transfer
+
+DONE = "done"
+REGISTER = "register"
+TRANSFER = "transfer"
+
+# state of the replicas of interrupted uploads, marked as available once the file is verified at destination
+COPYING = "COPYING"
+
+class ReplicaReconciler(verify.ReplicaVerifier):
+    """Classifier of the input files by the step of the upload still missing
+    """
+
+    def __init__(self, pool, rses: list, rse_local_path: str, n_threads: int = 16, batch_size: int = 1000):
+        """ReplicaReconciler constructor
+
+        Args:
+            pool (ClientPool): pool of RUCIO clients
+            rses (list): RSEs where the replicas are expected
+            rse_local_path (str): local path of the upload RSE
+            n_threads (int, optional): number of parallel bulk calls and destination checks. Defaults to 16.
+            batch_size (int, optional): number of files in each bulk call. Defaults to 1000.
+        """
+        super().__init__(pool, rses, n_threads, batch_size)
+        self.rse_local_path = rse_local_path
+
+    def replica_state(self, replica: dict) -> str:
+        """Return the state of a replica at the RSEs
+
+        Args:
+            replica (dict): replica as returned by list_replicas, None if not found
+
+        Returns:
+            str: "AVAILABLE" if available at any of the RSEs, else the state of the replica, None if there is no replica
+        """
+        if replica is None:
+            return None
+        states = [state for rse, state in replica.get("states", {}).items() if rse in self.rses]
+        if "AVAILABLE" in states:
+            return "AVAILABLE"
+        return states[0] if len(states) != 0 else None
+
+    def at_destination(self, item: dict) -> bool:
+        """Check if the file is already at its deterministic destination, with the same
+        size and adler32 checksum. The checksum is stored in item["adler32"]. Files
+        that cannot be read, or whose checksum query hangs, are not at destination
+
+        Args:
+            item (dict): item to be uploaded
+
+        Returns:
+            bool: True if the destination holds the file
+        """
+        path = utils.deterministic_path(self.rse_local_path, item['did_scope'], item['did_name'])
+        try:
+            if os.stat(path).st_size != item["size"]:
+                return False
+            if not self.local_checksum(item):
+                return False
+            remote = transfer.dcache_checksum(path) or utils.adler32(path)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.logger.info("checking destination of {} .. fail: {}".format(item['did_name'], e))
+            return False
+        return remote == item["adler32"]
+
+    def classify(self, items: list, in_rucio: set) -> dict:
+        """Classify the items by the missing step: DONE, REGISTER or TRANSFER.
+        The step is stored in item["reconcile"], the state of a replica not available
+        in item["replica_state"]. Only the files without replica or with a replica left
+        COPYING can be registered, the files with a replica in another state (e.g.
+        BEING_DELETED, BAD, UNAVAILABLE) are transferred again. Items whose replicas
+        cannot be listed are DONE if their DID exists, as without reconciliation
+
+        Args:
+            items (list): list of items
+            in_rucio (set): scoped names of the DIDs existing in RUCIO
+
+        Returns:
+            dict: dictionary ("step":"number of items")
+        """
+        registered = [item for item in items if utils.get_scoped_name(item["did_name"], item["did_scope"]) in in_rucio]
+        batches = [registered[i:i + self.batch_size] for i in range(0, len(registered), self.batch_size)]
+        replicas = {}
+        unknown = set()
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for batch, found in zip(batches, executor.map(self.fetch, batches)):
+                if found is None:
+                    unknown.update(id(item) for item in batch)
+                else:
+                    replicas.update(found)
+
+            pending = []
+            for item in items:
+                item.pop("replica_state", None)
+                sname = utils.get_scoped_name(item["did_name"], item["did_scope"])
+                state = self.replica_state(replicas.get(sname))
+                if id(item) in unknown or state == "AVAILABLE":
+                    item["reconcile"] = DONE
+                    continue
+                if state is not None:
+                    item["replica_state"] = state
+                if state not in [None, COPYING]:
+                    item["reconcile"] = TRANSFER
+                    continue
+                pending.append(item)
+
+            found = []
+            if os.path.isdir(self.rse_local_path):
+                found = list(executor.map(self.at_destination, pending))
+        for i, item in enumerate(pending):
+            item["reconcile"] = REGISTER if i < len(found) and found[i] else TRANSFER
+
+        counts = {}
+        for item in items:
+            counts[item["reconcile"]] = counts.get(item["reconcile"], 0) + 1
+        return counts
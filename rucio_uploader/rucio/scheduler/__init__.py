@@ -0,0 +1,423 @@
+"""@package scheduler
+
+ Scheduler of the uploads: the upload threads take their work from
+ a shared queue, interleaving the source pools so that each pool
+ serves at most a given number of transfers and bytes per second.
+ Datasets are served in order of priority, so that they complete
+ one at a time.
+
+"""
+
+import os
+import re
+import time
+import logging
+import subprocess
+
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+
+class MountPointResolver:
+    """Resolver of the source pool of a file as its mount point
+    """
+
+    def __init__(self):
+        """MountPointResolver constructor
+        """
+        self.mount_points = {}
+
+    def pool(self, path: str) -> str:
+        """Return the mount point of a file
+
+        Args:
+            path (str): filepath
+
+        Returns:
+            str: mount point
+        """
+        dirname = os.path.dirname(os.path.abspath(path))
+        if dirname not in self.mount_points:
+            mount = dirname
+            while not os.path.ismount(mount) and mount != os.path.dirname(mount):
+                mount = os.path.dirname(mount)
+            self.mount_points[dirname] = mount
+        return self.mount_points[dirname]
+
+class CommandPoolResolver:
+    """Resolver of the source pool of a file with a shell command,
+    e.g. a query of the dCache frontend for the file locations
+    """
+
+    def __init__(self, command: str):
+        """CommandPoolResolver constructor
+
+        Args:
+            command (str): shell command template, {path} is replaced by the filepath; the first line of the output is the pool
+        """
+        self.command = command
+        self.fallback = MountPointResolver()
+
+    def pool(self, path: str) -> str:
+        """Return the pool of a file
+
+        Args:
+            path (str): filepath
+
+        Returns:
+            str: pool
+        """
+        try:
+            proc = subprocess.run(self.command.format(path=path), shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60)
+            lines = proc.stdout.decode().split()
+        except subprocess.TimeoutExpired:
+            lines = []
+        return lines[0] if len(lines) != 0 else self.fallback.pool(path)
+
+class PoolBudget:
+    """Concurrency and bandwidth budget of a source pool
+    """
+
+    def __init__(self, max_active: int = None, bytes_per_sec: float = None):
+        """PoolBudget constructor
+
+        Args:
+            max_active (int, optional): maximum number of concurrent transfers. Defaults to None (unlimited).
+            bytes_per_sec (float, optional): maximum bytes per second. Defaults to None (unlimited).
+        """
+        self.max_active = max_active
+        self.bytes_per_sec = bytes_per_sec
+        self.active = 0
+        self.available_at = 0.
+        self.queues = OrderedDict()
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def append(self, dataset: str, unit: list):
+        """Queue a unit of work of a dataset
+
+        Args:
+            dataset (str): dataset of the unit
+            unit (list): unit of work
+        """
+        if dataset not in self.queues:
+            self.queues[dataset] = deque()
+        self.queues[dataset].append(unit)
+
+    def pop(self, dataset: str) -> list:
+        """Take the next unit of work of a dataset
+
+        Args:
+            dataset (str): dataset
+
+        Returns:
+            list: unit of work
+        """
+        unit = self.queues[dataset].popleft()
+        if len(self.queues[dataset]) == 0:
+            del self.queues[dataset]
+        return unit
+
+    def ready_at(self, now: float) -> float:
+        """Return when the pool can start a new transfer
+
+        Args:
+            now (float): current time
+
+        Returns:
+            float: time when a transfer can start, None if the pool is busy or empty
+        """
+        if len(self.queues) == 0 or (self.max_active is not None and self.active >= self.max_active):
+            return None
+        return max(now, self.available_at)
+
+    def start(self, size: int, now: float):
+        """Account the start of a transfer of size bytes: transfers
+        are spaced so that the bytes per second stay within budget
+
+        Args:
+            size (int): bytes of the transfer
+            now (float): current time
+        """
+        self.active += 1
+        if self.bytes_per_sec:
+            self.available_at = max(now, self.available_at) + size / self.bytes_per_sec
+
+class DatasetProgress:
+    """Progress of the uploads of a dataset
+    """
+
+    def __init__(self, name: str):
+        """DatasetProgress constructor
+
+        Args:
+            name (str): scoped name of the dataset
+        """
+        self.name = name
+        self.items = []
+        self.ids = set()
+        self.units = 0
+        self.remaining_bytes = 0
+        self.start = None
+
+    def run(self) -> int:
+        """Return the run number of the dataset, from its name
+
+        Returns:
+            int: run number, -1 if not found
+        """
+        matches = re.search(r"run-([0-9]+)", self.name)
+        return -1 if matches is None else int(matches.group(1))
+
+# priority of the datasets: the lower the key the sooner the dataset is served
+POLICIES = {"fifo": None,
+            "smallest": lambda ds: ds.remaining_bytes,
+            "newest": lambda ds: -ds.run()}
+
+class UploadScheduler:
+    """Shared queue of units of work (lists of items uploaded with a single call)
+    grouped by source pool
+    """
+
+    def __init__(self, resolver=None, max_active: int = None, bytes_per_sec: float = None, n_threads: int = 16, policy: str = "fifo", on_dataset_complete=None, on_items_done=None):
+        """UploadScheduler constructor
+
+        Args:
+            resolver (object, optional): resolver of the source pools. Defaults to None (MountPointResolver).
+            max_active (int, optional): maximum concurrent transfers from a pool. Defaults to None (unlimited).
+            bytes_per_sec (float, optional): maximum bytes per second from a pool. Defaults to None (unlimited).
+            n_threads (int, optional): number of parallel pool lookups. Defaults to 16.
+            policy (str, optional): order of the datasets ["fifo", "smallest", "newest"]. Defaults to "fifo".
+            on_dataset_complete (function, optional): called with the DatasetProgress of each completed dataset. Defaults to None.
+            on_items_done (function, optional): called with the items of a completed unit of work not requeued. Defaults to None.
+        """
+        if policy not in POLICIES:
+            raise ValueError("unknown scheduling policy {}".format(policy))
+        self.priority = POLICIES[policy]
+        self.on_dataset_complete = on_dataset_complete
+        self.on_items_done = on_items_done
+        self.datasets = {}
+        self.resolver = resolver if resolver is not None else MountPointResolver()
+        self.max_active = max_active
+        self.bytes_per_sec = bytes_per_sec
+        self.n_threads = n_threads
+        self.pools = {}
+        self.pending = 0
+        self.closed = False
+        self.condition = Condition()
+        self.logger = logging.getLogger()
+
+    def put(self, unit: list, pool: str = None):
+        """Add a unit of work
+
+        Args:
+            unit (list): list of items to be uploaded with a single call
+            pool (str, optional): source pool. Defaults to None (resolved from the first item).
+        """
+        if pool is None:
+            pool = self.resolver.pool(unit[0]["path"])
+        dataset = dataset_name(unit)
+        with self.condition:
+            if pool not in self.pools:
+                self.pools[pool] = PoolBudget(self.max_active, self.bytes_per_sec)
+            if dataset not in self.datasets:
+                self.datasets[dataset] = DatasetProgress(dataset)
+            progress = self.datasets[dataset]
+            self.pools[pool].append(dataset, unit)
+            for item in unit:
+                item["source_pool"] = pool
+                item["queued"] = item.get("queued", 0) + 1
+                if id(item) not in progress.ids:
+                    progress.ids.add(id(item))
+                    progress.items.append(item)
+                progress.remaining_bytes += item["size"]
+            progress.units += 1
+            self.pending += 1
+            self.condition.notify()
+
+    def put_all(self, units: list):
+        """Add units of work, resolving their pools in parallel
+
+        Args:
+            units (list): list of units of work
+        """
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            pools = list(executor.map(lambda unit: self.resolver.pool(unit[0]["path"]), units))
+        for unit, pool in zip(units, pools):
+            self.put(unit, pool)
+        self.logger.info(" source pools: {}".format(", ".join("{} ({})".format(k, len(v)) for k, v in self.pools.items())))
+
+    def requeue(self, unit: list):
+        """Add again a unit of work taken from the queue, e.g. after its
+        transfer was abandoned. To be called before done of the original unit.
+
+        Args:
+            unit (list): items of the unit of work to be uploaded again
+        """
+        dataset = dataset_name(unit)
+        with self.condition:
+            progress = self.datasets[dataset]
+            self.pools[unit[0]["source_pool"]].append(dataset, unit)
+            for item in unit:
+                item["queued"] = item.get("queued", 0) + 1
+            progress.remaining_bytes += sum(item["size"] for item in unit)
+            progress.units += 1
+            self.pending += 1
+            self.condition.notify()
+
+    def close(self):
+        """No more units will be added: workers stop when the queue is empty
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def select(self, now: float) -> tuple:
+        """Select the pool and the dataset to serve next. Among the pools that can
+        start a transfer, the one with the dataset of highest priority or, with
+        the "fifo" policy, the one with less active transfers
+
+        Args:
+            now (float): current time
+
+        Returns:
+            tuple: the pool and the dataset, or None, and the time when a pool will be ready, or None
+        """
+        best = None
+        best_key = None
+        wait_until = None
+        for budget in self.pools.values():
+            ready = budget.ready_at(now)
+            if ready is None:
+                continue
+            if ready > now:
+                wait_until = ready if wait_until is None else min(wait_until, ready)
+                continue
+            if self.priority is None:
+                dataset = next(iter(budget.queues))
+                key = budget.active
+            else:
+                dataset = min(budget.queues, key=lambda ds: self.priority(self.datasets[ds]))
+                key = (self.priority(self.datasets[dataset]), budget.active)
+            if best is None or key < best_key:
+                best = (budget, dataset)
+                best_key = key
+        return best, wait_until
+
+    def active(self) -> int:
+        """Return the number of units of work taken and not yet done
+
+        Returns:
+            int: number of active units
+        """
+        return sum(budget.active for budget in self.pools.values())
+
+    def get(self) -> list:
+        """Take the next unit of work, waiting until a pool can serve it.
+        Once the queue is closed and empty, workers wait for the active
+        units, which can still be requeued.
+
+        Returns:
+            list: unit of work, None if the queue is closed and empty and no unit is active
+        """
+        with self.condition:
+            while True:
+                if self.pending == 0 and self.closed and self.active() == 0:
+                    return None
+                now = time.time()
+                selected, wait_until = self.select(now)
+                if selected is not None:
+                    budget, dataset = selected
+                    unit = budget.pop(dataset)
+                    budget.start(sum(item["size"] for item in unit), now)
+                    if self.datasets[dataset].start is None:
+                        self.datasets[dataset].start = now
+                    self.pending -= 1
+                    return unit
+                self.condition.wait(None if wait_until is None else wait_until - now)
+
+    def done(self, unit: list):
+        """Release the pool of a completed unit of work
+
+        Args:
+            unit (list): unit of work
+        """
+        completed = None
+        finished = []
+        with self.condition:
+            for item in unit:
+                item["queued"] -= 1
+                if item["queued"] == 0:
+                    finished.append(item)
+            self.pools[unit[0]["source_pool"]].active -= 1
+            progress = self.datasets[dataset_name(unit)]
+            progress.remaining_bytes -= sum(item["size"] for item in unit)
+            progress.units -= 1
+            if progress.units == 0:
+                # the items added later are reported with a new progress
+                completed = self.datasets.pop(progress.name)
+            self.condition.notify_all()
+        if completed is not None:
+            self.report(completed)
+        if len(finished) != 0 and self.on_items_done is not None:
+            self.on_items_done(finished)
+
+    def report(self, progress: DatasetProgress):
+        """Report the completion of a dataset
+
+        Args:
+            progress (DatasetProgress): progress of the dataset
+        """
+        ok = [item for item in progress.items if item["upload_ok"]]
+        self.logger.info(" dataset {} complete: uploaded files: {} of {}, uploaded bytes: {} of {}, in {:.0f} s".format(progress.name,
+                                                                                                                len(ok),
+                                                                                                                len(progress.items),
+                                                                                                                sum(item["size"] for item in ok),
+                                                                                                                sum(item["size"] for item in progress.items),
+                                                                                                                time.time() - progress.start))
+        if self.on_dataset_complete is not None:
+            self.on_dataset_complete(progress)
+
+def dataset_name(unit: list) -> str:
+    """Return the scoped name of the dataset of a unit of work
+
+    Args:
+        unit (list): unit of work
+
+    Returns:
+        str: scoped name of the dataset
+    """
+    return "{}:{}".format(unit[0].get("dataset_scope"), unit[0].get("dataset_name"))
+
+def group_small_files(items: list, threshold: int, max_bytes: int, max_count: int) -> list:
+    """Group the small files of each dataset in units of work uploaded with a single
+    upload call. Files smaller than threshold bytes are grouped up to max_bytes bytes
+    and max_count files for each unit, the other files are a unit each.
+
+    Args:
+        items (list): list of items to be uploaded
+        threshold (int): size in bytes of the smallest file uploaded alone
+        max_bytes (int): maximum bytes of a unit
+        max_count (int): maximum files of a unit
+
+    Returns:
+        list: list of units of work (lists of items)
+    """
+    units = []
+    groups = {}
+    group_bytes = {}
+    for item in items:
+        if item["size"] >= threshold:
+            units.append([item])
+            continue
+        ds = dataset_name([item])
+        group = groups.get(ds)
+        if group is None or len(group) >= max_count or group_bytes[ds] + item["size"] > max_bytes:
+            group = []
+            groups[ds] = group
+            group_bytes[ds] = 0
+            units.append(group)
+        group.append(item)
+        group_bytes[ds] += item["size"]
+    return units
@@ -0,0 +1,230 @@
+"""@package status
+
+ Tracker of the progress of the replication rules of the datasets.
+ Rule states are fetched concurrently, rules in a terminal state
+ are cached and not queried again.
+
+"""
+
+import json
+import time
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+TERMINAL_STATES = ["OK"]
+
+class DatasetStatus:
+    """Replication status of a dataset at a RSE
+    """
+
+    def __init__(self, scope: str, name: str):
+        """DatasetStatus constructor
+
+        Args:
+            scope (str): dataset scope
+            name (str): dataset name
+        """
+        self.scope = scope
+        self.name = name
+        self.rule_id = None
+        self.state = "NO_RULE"
+        self.locks_ok = 0
+        self.locks_replicating = 0
+        self.locks_stuck = 0
+        self.bytes = 0
+        self.bytes_ok = 0
+        self.file_bytes = None
+
+    def terminal(self) -> bool:
+        """Check if the rule is in a terminal state
+
+        Returns:
+            bool: True if the rule is in a terminal state
+        """
+        return self.state in TERMINAL_STATES
+
+    def to_dict(self) -> dict:
+        """Return the status as a json serializable dictionary
+
+        Returns:
+            dict: the status
+        """
+        return {k: v for k, v in vars(self).items() if k != "file_bytes"}
+
+    @classmethod
+    def from_dict(cls, status: dict):
+        """Build the status from a dictionary
+
+        Args:
+            status (dict): the status as returned by to_dict
+
+        Returns:
+            DatasetStatus: the status
+        """
+        ds = cls(status["scope"], status["name"])
+        ds.__dict__.update(status)
+        return ds
+
+    def format(self) -> str:
+        """Return a one line report of the status
+
+        Returns:
+            str: report of the status
+        """
+        return "   {}:{} {} locks ok/replicating/stuck: {}/{}/{} bytes: {} of {}".format(self.scope,
+                                                                                       self.name,
+                                                                                       self.state,
+                                                                                       self.locks_ok,
+                                                                                       self.locks_replicating,
+                                                                                       self.locks_stuck,
+                                                                                       self.bytes_ok,
+                                                                                       self.bytes)
+
+class RuleStatusTracker:
+    """Tracker of the replication rules of datasets at a RSE
+    """
+
+    def __init__(self, pool, rse_expression: str, n_threads: int = 16, cache_file: str = None):
+        """RuleStatusTracker constructor
+
+        Args:
+            pool (ClientPool): pool of RUCIO clients
+            rse_expression (str): RSE expression of the rules
+            n_threads (int, optional): number of concurrent queries. Defaults to 16.
+            cache_file (str, optional): json file caching the status between invocations. Defaults to None.
+        """
+        self.pool = pool
+        self.rse_expression = rse_expression
+        self.n_threads = n_threads
+        self.cache_file = cache_file
+        self.status = {}
+        self.logger = logging.getLogger()
+        self.load()
+
+    def load(self):
+        """Load the cached status of the rules in a terminal state
+        """
+        if self.cache_file is None:
+            return
+        try:
+            with open(self.cache_file) as f:
+                for sname, status in json.load(f).items():
+                    ds = DatasetStatus.from_dict(status)
+                    if ds.terminal():
+                        self.status[sname] = ds
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        """Save the status of the rules
+        """
+        if self.cache_file is None:
+            return
+        with open(self.cache_file, "w") as f:
+            json.dump({k: v.to_dict() for k, v in self.status.items()}, f)
+
+    def fetch(self, ds: DatasetStatus) -> DatasetStatus:
+        """Fetch the state of the rule of a dataset and its progress in bytes
+
+        Args:
+            ds (DatasetStatus): status of the dataset
+
+        Returns:
+            DatasetStatus: the updated status
+        """
+        rules = self.pool.call("did", lambda client: [r for r in client.list_did_rules(ds.scope, ds.name) if r["rse_expression"] == self.rse_expression])
+        if len(rules) == 0:
+            return ds
+        rule = rules[0]
+        ds.rule_id = rule["id"]
+        ds.state = rule["state"]
+        ds.locks_ok = rule["locks_ok_cnt"]
+        ds.locks_replicating = rule["locks_replicating_cnt"]
+        ds.locks_stuck = rule["locks_stuck_cnt"]
+        if ds.file_bytes is None:
+            ds.file_bytes = self.pool.call("did", lambda client: {f["name"]: f["bytes"] or 0 for f in client.list_files(ds.scope, ds.name)})
+            ds.bytes = sum(ds.file_bytes.values())
+        if ds.terminal():
+            ds.bytes_ok = ds.bytes
+        else:
+            locks = self.pool.call("rule", lambda client: list(client.list_replica_locks(ds.rule_id)))
+            ds.bytes_ok = sum(ds.file_bytes.get(lock["name"], 0) for lock in locks if lock["state"] == "OK")
+        return ds
+
+    def poll(self, datasets: list) -> list:
+        """Fetch concurrently the status of the datasets whose rule is not in a terminal state
+
+        Args:
+            datasets (list): list of (scope, name) of the datasets
+
+        Returns:
+            list: list of DatasetStatus
+        """
+        todo = []
+        for scope, name in datasets:
+            sname = "{}:{}".format(scope, name)
+            if sname not in self.status:
+                self.status[sname] = DatasetStatus(scope, name)
+            if not self.status[sname].terminal():
+                todo.append(self.status[sname])
+        self.logger.info(" querying the rules of {} datasets ({} cached)".format(len(todo), len(datasets) - len(todo)))
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for ds, result in zip(todo, executor.map(self.safe_fetch, todo)):
+                if result is not None:
+                    self.logger.info(" querying rules of {}:{} .. fail: {}".format(ds.scope, ds.name, result))
+        self.save()
+        return [self.status["{}:{}".format(scope, name)] for scope, name in datasets]
+
+    def safe_fetch(self, ds: DatasetStatus):
+        """Fetch the status of a dataset, returning the error if any
+
+        Args:
+            ds (DatasetStatus): status of the dataset
+
+        Returns:
+            Exception: the error, None if the status is fetched
+        """
+        try:
+            self.fetch(ds)
+        except Exception as e:
+            return e
+        return None
+
+    def watch(self, datasets: list, interval: float = None, report=print) -> list:
+        """Poll the status of the datasets until all the rules are in a terminal state
+
+        Args:
+            datasets (list): list of (scope, name) of the datasets
+            interval (float, optional): seconds between polls. Defaults to None (poll once).
+            report (function, optional): function reporting the status. Defaults to print.
+
+        Returns:
+            list: list of DatasetStatus
+        """
+        while True:
+            status = self.poll(datasets)
+            for line in summary(status):
+                report(line)
+            if interval is None or all(ds.terminal() or ds.state == "NO_RULE" for ds in status):
+                return status
+            time.sleep(interval)
+
+def summary(status: list) -> list:
+    """Return the report of the status of the datasets
+
+    Args:
+        status (list): list of DatasetStatus
+
+    Returns:
+        list: lines of the report
+    """
+    lines = [" ============ rule status ====================="]
+    counts = {}
+    for ds in status:
+        lines.append(ds.format())
+        counts[ds.state] = counts.get(ds.state, 0) + 1
+    lines.append("   datasets: {}".format(", ".join("{}: {}".format(k, v) for k, v in sorted(counts.items()))))
+    lines.append("   bytes replicated: {} of {}".format(sum(ds.bytes_ok for ds in status), sum(ds.bytes for ds in status)))
+    lines.append(" =============================================")
+    return lines
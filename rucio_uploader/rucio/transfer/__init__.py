@@ -0,0 +1,380 @@
+"""@package transfer
+
+ Transfer engines bypassing the per-file overhead of the UploadClient.
+ Local copy: the files are copied directly into their deterministic
+ path in the locally mounted upload RSE and registered in RUCIO with
+ bulk calls. In place: the files already in the namespace of the RSE
+ are registered in bulk at their current PFN, without any transfer.
+
+"""
+
+import os
+import zlib
+import hashlib
+import logging
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import rucio_uploader.utils as utils
+import rucio_uploader.trace as trace
+import rucio_uploader.rucio.destination as destination
+
+def copy_with_checksums(source: str, destination: str, buffer_size: int = 16*2**20) -> tuple:
+    """Copy a file evaluating its adler32 and md5 checksums while copying
+
+    Args:
+        source (str): source path
+        destination (str): destination path
+        buffer_size (int, optional): size of the copy buffer. Defaults to 16 MiB.
+
+    Returns:
+        tuple: number of bytes, adler32 and md5 checksums
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    adler = 1
+    md5 = hashlib.md5()
+    size = 0
+    with open(source, "rb", buffering=0) as f_in, open(destination, "wb", buffering=0) as f_out:
+        while True:
+            n = f_in.readinto(buffer)
+            if not n:
+                break
+            chunk = view[:n]
+            adler = zlib.adler32(chunk, adler)
+            md5.update(chunk)
+            written = 0
+            while written < n:
+                written += f_out.write(chunk[written:])
+            size += n
+    return size, "{:08x}".format(adler & 0xffffffff), md5.hexdigest()
+
+def copy_fast(source: str, destination: str) -> int:
+    """Copy a file in kernel space (copy_file_range or sendfile) without reading it in user space
+
+    Args:
+        source (str): source path
+        destination (str): destination path
+
+    Returns:
+        int: number of bytes
+    """
+    with open(source, "rb") as f_in, open(destination, "wb") as f_out:
+        size = os.fstat(f_in.fileno()).st_size
+        copied = 0
+        copy = getattr(os, "copy_file_range", None)
+        while copied < size:
+            try:
+                if copy is not None:
+                    n = copy(f_in.fileno(), f_out.fileno(), size - copied)
+                else:
+                    n = os.sendfile(f_out.fileno(), f_in.fileno(), None, size - copied)
+            except OSError:
+                if copy is None:
+                    raise
+                # copy_file_range not supported across these filesystems
+                copy = None
+                continue
+            if n == 0:
+                break
+            copied += n
+    return copied
+
+class RucioRegistrar:
+    """Bulk registration of replicas and attachments in RUCIO
+    """
+
+    def __init__(self, pool, rse: str):
+        """RucioRegistrar constructor
+
+        Args:
+            pool (ClientPool): pool of RUCIO clients
+            rse (str): RUCIO storage element of the replicas
+        """
+        self.pool = pool
+        self.rse = rse
+
+    def add_replicas(self, files: list):
+        """Register replicas of files
+
+        Args:
+            files (list): list of files {"scope", "name", "bytes", "adler32", ["md5"], ["pfn"]}
+        """
+        self.pool.call("replica", lambda client: client.add_replicas(self.rse, files))
+
+    def update_states(self, files: list):
+        """Mark as available existing replicas of files left in COPYING state
+
+        Args:
+            files (list): list of files {"scope", "name"}
+        """
+        states = [{"scope": f["scope"], "name": f["name"], "state": "A"} for f in files]
+        self.pool.call("replica", lambda client: client.update_replicas_states(self.rse, states))
+
+    def attach(self, attachments: dict):
+        """Attach files to datasets
+
+        Args:
+            attachments (dict): dictionary ("dataset":"list of items") of items to be attached to datasets
+        """
+        bulk = []
+        for ds, dids in attachments.items():
+            scope, name = utils.get_scope_and_name(ds)
+            bulk.append({"scope": scope, "name": name, "dids": dids})
+        self.pool.call("did", lambda client: client.attach_dids_to_dids(bulk, ignore_duplicate=True))
+
+class BulkRegistration:
+    """Registration of transferred items in batches, with one call
+    for the replicas and one for the attachments of each batch
+    """
+
+    def __init__(self, registrar, batch_size: int = 1000):
+        """BulkRegistration constructor
+
+        Args:
+            registrar (RucioRegistrar): bulk registrar of replicas and attachments
+            batch_size (int, optional): number of files registered in each bulk call. Defaults to 1000.
+        """
+        self.registrar = registrar
+        self.batch_size = batch_size
+        self.logger = logging.getLogger()
+
+    def register(self, items: list):
+        """Register the replicas of the transferred items and attach them to their datasets.
+        If a bulk call fails, items are registered one by one.
+
+        Args:
+            items (list): list of transferred items
+        """
+        if len(items) == 0:
+            return
+        self.logger.info("registering {} replicas".format(len(items)))
+        try:
+            self.register_bulk(items)
+        except Exception as e:
+            self.logger.info("registering {} replicas .. fail: {}, registering one by one".format(len(items), e))
+            for item in items:
+                try:
+                    self.register_bulk([item])
+                except Exception as e:
+                    self.logger.info("registering {} .. fail: {}".format(item['did_name'], e))
+        else:
+            self.logger.info("registering {} replicas .. done".format(len(items)))
+
+    def register_all(self, items: list):
+        """Register items already at their destination, in batches
+
+        Args:
+            items (list): list of items
+        """
+        for i in range(0, len(items), self.batch_size):
+            self.register(items[i:i + self.batch_size])
+
+    def register_bulk(self, items: list):
+        """Register replicas and attachments of items with one call each. Items with
+        an existing replica left COPYING (item["replica_state"]) are marked as available
+
+        Args:
+            items (list): list of transferred items
+        """
+        files = []
+        existing = []
+        attachments = {}
+        for item in items:
+            file = {"scope": item['did_scope'],
+                    "name": item['did_name'],
+                    "bytes": item['size'],
+                    "adler32": item['adler32']}
+            for key in ("md5", "pfn"):
+                if item.get(key) is not None:
+                    file[key] = item[key]
+            if item.get("replica_state") == "COPYING":
+                existing.append(file)
+            else:
+                files.append(file)
+            if item.get('dataset_name'):
+                ds = utils.get_scoped_name(item['dataset_name'], item['dataset_scope'])
+                attachments.setdefault(ds, []).append({"scope": item['did_scope'], "name": item['did_name']})
+        with trace.span("register", "file", files=len(items)):
+            if len(files) != 0:
+                self.registrar.add_replicas(files)
+            if len(existing) != 0:
+                self.registrar.update_states(existing)
+            if len(attachments) != 0:
+                self.registrar.attach(attachments)
+        for item in items:
+            item["upload_ok"] = True
+
+class LocalCopyEngine(BulkRegistration):
+    """Transfer engine copying the files into the locally mounted upload RSE.
+    The registrar can be any object with the add_replicas and attach methods
+    of RucioRegistrar, so that the engine can run against a local directory.
+    """
+
+    def __init__(self, rse_local_path: str, registrar, n_threads: int = 8, batch_size: int = 1000, buffer_size: int = 16*2**20, skip=None):
+        """LocalCopyEngine constructor
+
+        Args:
+            rse_local_path (str): local path of the upload RSE
+            registrar (RucioRegistrar): bulk registrar of replicas and attachments
+            n_threads (int, optional): number of parallel copies. Defaults to 8.
+            batch_size (int, optional): number of files registered in each bulk call. Defaults to 1000.
+            buffer_size (int, optional): size of the copy buffer. Defaults to 16 MiB.
+            skip (function, optional): function returning True for the items not to be copied now. Defaults to None.
+        """
+        super().__init__(registrar, batch_size)
+        self.rse_local_path = rse_local_path
+        self.n_threads = n_threads
+        self.buffer_size = buffer_size
+        self.skip = skip
+
+    def copy(self, item: dict) -> dict:
+        """Copy an item into its deterministic path
+
+        Args:
+            item (dict): item to be uploaded
+
+        Returns:
+            dict: the item, with its checksums, or None if skipped
+        """
+        if self.skip is not None and self.skip(item):
+            return None
+        destination_path = utils.deterministic_path(self.rse_local_path, item['did_scope'], item['did_name'])
+        temp_destination = destination_path + destination.TEMP_SUFFIX
+        if not item.get("destination_ready"):
+            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        try:
+            if item.get("adler32") is not None and item.get("md5") is not None:
+                size = copy_fast(item["path"], temp_destination)
+            else:
+                size, item["adler32"], item["md5"] = copy_with_checksums(item["path"], temp_destination, self.buffer_size)
+            if size != item["size"]:
+                raise IOError("copied {} bytes of {}".format(size, item["size"]))
+            os.replace(temp_destination, destination_path)
+        except BaseException:
+            if os.path.exists(temp_destination):
+                os.remove(temp_destination)
+            raise
+        return item
+
+    def transfer(self, items: list):
+        """Copy all the items and register them in batches while copying
+
+        Args:
+            items (list): list of items to be uploaded
+        """
+        copied = []
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            futures = {}
+            for item in items:
+                futures[executor.submit(self.copy, item)] = item
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    if future.result() is not None:
+                        copied.append(item)
+                        self.logger.info("copying {} .. done".format(item['did_name']))
+                except Exception as e:
+                    self.logger.info("copying {} .. fail: {}".format(item['did_name'], e))
+                if len(copied) >= self.batch_size:
+                    self.register(copied)
+                    copied = []
+        self.register(copied)
+
+def dcache_checksum(path: str) -> str:
+    """Get the adler32 checksum of a file from dCache
+
+    Args:
+        path (str): filepath
+
+    Returns:
+        str: adler32 checksum, None if not available
+    """
+    proc = subprocess.run('cat {}/\".(get)({})(checksum)\"'.format(os.path.dirname(path),os.path.basename(path)), shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60)
+    for line in proc.stdout.decode().split():
+        if line.upper().startswith("ADLER32:"):
+            return line.split(":")[1].strip().lower().zfill(8)
+    return None
+
+class InPlaceEngine(BulkRegistration):
+    """Transfer engine registering in place the files already in the namespace
+    of the RSE: "<local prefix>/<path>" is registered at "<pfn prefix>/<path>"
+    """
+
+    def __init__(self, local_prefix: str, pfn_prefix: str, registrar, n_threads: int = 8, batch_size: int = 1000):
+        """InPlaceEngine constructor
+
+        Args:
+            local_prefix (str): local path of the namespace of the RSE
+            pfn_prefix (str): PFN of the local prefix
+            registrar (RucioRegistrar): bulk registrar of replicas and attachments
+            n_threads (int, optional): number of parallel checksum lookups. Defaults to 8.
+            batch_size (int, optional): number of files registered in each bulk call. Defaults to 1000.
+        """
+        super().__init__(registrar, batch_size)
+        self.local_prefix = local_prefix.rstrip("/")
+        self.pfn_prefix = pfn_prefix.rstrip("/")
+        self.n_threads = n_threads
+
+    def in_namespace(self, item: dict) -> bool:
+        """Check if an item is in the namespace of the RSE
+
+        Args:
+            item (dict): item to be uploaded
+
+        Returns:
+            bool: True if the item is in the namespace of the RSE
+        """
+        return os.path.abspath(item["path"]).startswith(self.local_prefix + "/")
+
+    def split(self, items: list) -> tuple:
+        """Split the items in those to be registered in place and those to be uploaded
+
+        Args:
+            items (list): list of items to be uploaded
+
+        Returns:
+            tuple: list of items in the namespace of the RSE and list of the others
+        """
+        inside = []
+        outside = []
+        for item in items:
+            (inside if self.in_namespace(item) else outside).append(item)
+        return inside, outside
+
+    def resolve(self, item: dict) -> dict:
+        """Set PFN and checksum of an item; the checksum is taken from dCache or evaluated
+
+        Args:
+            item (dict): item to be registered
+
+        Returns:
+            dict: the item
+        """
+        item["pfn"] = self.pfn_prefix + os.path.abspath(item["path"])[len(self.local_prefix):]
+        if item.get("adler32") is None:
+            item["adler32"] = dcache_checksum(item["path"])
+        if item.get("adler32") is None:
+            item["adler32"] = utils.adler32(item["path"])
+        return item
+
+    def transfer(self, items: list):
+        """Register all the items in place, in batches
+
+        Args:
+            items (list): list of items in the namespace of the RSE
+        """
+        resolved = []
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            futures = {executor.submit(self.resolve, item): item for item in items}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    resolved.append(future.result())
+                except Exception as e:
+                    self.logger.info("resolving {} .. fail: {}".format(item['did_name'], e))
+                if len(resolved) >= self.batch_size:
+                    self.register(resolved)
+                    resolved = []
+        self.register(resolved)
@@ -0,0 +1,139 @@
+"""@package verify
+
+ Verification of the uploaded replicas: the state, size and adler32
+ checksum of the replicas at the upload RSE are fetched with bulk
+ list_replicas calls, run concurrently, and compared with the size
+ and the checksum of the local files.
+
+"""
+
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+import rucio_uploader.utils as utils
+
+# errors for which the item can be uploaded again
+REQUEUE_ERRORS = ["missing", "unavailable"]
+
+class ReplicaVerifier:
+    """Verifier of the replicas of the uploaded items
+    """
+
+    def __init__(self, pool, rses: list, n_threads: int = 8, batch_size: int = 1000):
+        """ReplicaVerifier constructor
+
+        Args:
+            pool (ClientPool): pool of RUCIO clients
+            rses (list): RSEs where the replicas are expected
+            n_threads (int, optional): number of parallel checksums and bulk calls. Defaults to 8.
+            batch_size (int, optional): number of files in each bulk call. Defaults to 1000.
+        """
+        self.pool = pool
+        self.rses = list(dict.fromkeys(rses))
+        self.n_threads = n_threads
+        self.batch_size = batch_size
+        self.logger = logging.getLogger()
+
+    def local_checksum(self, item: dict) -> bool:
+        """Evaluate the adler32 checksum of the local file, if not already known
+
+        Args:
+            item (dict): uploaded item
+
+        Returns:
+            bool: True if the checksum is known, False if the local file could not be read
+        """
+        if item.get("adler32") is None:
+            try:
+                item["adler32"] = utils.adler32(item["path"])
+            except OSError as e:
+                self.logger.info(" checksum of {} .. fail: {}".format(item["path"], e))
+                return False
+        return True
+
+    def fetch(self, batch: list) -> dict:
+        """Fetch the replicas of a batch of items with one bulk call
+
+        Args:
+            batch (list): list of items
+
+        Returns:
+            dict: dictionary ("scope:name":"replica") of the replicas found, None if the call failed
+        """
+        dids = [{"scope": item["did_scope"], "name": item["did_name"]} for item in batch]
+        try:
+            replicas = self.pool.call("replica", lambda client: list(client.list_replicas(dids,
+                                                                                         rse_expression="|".join(self.rses),
+                                                                                         all_states=True)))
+        except Exception as e:
+            self.logger.info(" listing replicas of {} files .. fail: {}".format(len(batch), e))
+            return None
+        return {utils.get_scoped_name(r["name"], r["scope"]): r for r in replicas}
+
+    def check(self, item: dict, replica: dict) -> str:
+        """Compare the replica of an item with the local file
+
+        Args:
+            item (dict): uploaded item
+            replica (dict): replica as returned by list_replicas, None if not found
+
+        Returns:
+            str: error ["missing", "unavailable", "size", "checksum"], None if the replica is good
+        """
+        if replica is None:
+            return "missing"
+        states = {rse: state for rse, state in replica.get("states", {}).items() if rse in self.rses}
+        if len(states) == 0:
+            return "missing"
+        if "AVAILABLE" not in states.values():
+            return "unavailable"
+        if replica.get("bytes") != item["size"]:
+            return "size"
+        if replica.get("adler32") is None or replica["adler32"].zfill(8) != item["adler32"]:
+            return "checksum"
+        return None
+
+    def verify(self, items: list) -> dict:
+        """Verify the replicas of the items. The error of each item is
+        stored in item["verify_error"]: None if the replica is good,
+        "unverified" if its replicas could not be listed or its local
+        file could not be read
+
+        Args:
+            items (list): list of uploaded items
+
+        Returns:
+            dict: dictionary ("error":"number of items") of the results
+        """
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            unverified = set(id(item) for item, ok in zip(items, executor.map(self.local_checksum, items)) if not ok)
+            replicas = {}
+            for batch, found in zip(batches, executor.map(self.fetch, batches)):
+                if found is None:
+                    unverified.update(id(item) for item in batch)
+                else:
+                    replicas.update(found)
+        counts = {}
+        for item in items:
+            if id(item) in unverified:
+                error = "unverified"
+            else:
+                error = self.check(item, replicas.get(utils.get_scoped_name(item["did_name"], item["did_scope"])))
+            item["verify_error"] = error
+            counts[error or "ok"] = counts.get(error or "ok", 0) + 1
+            if error is not None:
+                self.logger.info(" verifying {} .. fail: {}".format(item["path"], error))
+        return counts
+
+def summary(counts: dict) -> str:
+    """Return a one line summary of the verification
+
+    Args:
+        counts (dict): dictionary ("error":"number of items") as returned by ReplicaVerifier.verify
+
+    Returns:
+        str: summary of the verification
+    """
+    return ", ".join("{}: {}".format(k, counts[k]) for k in sorted(counts))
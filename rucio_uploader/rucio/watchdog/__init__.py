@@ -0,0 +1,181 @@
+"""@package watchdog
+
+ Watchdog of the transfers: each transfer runs in a separate thread
+ with a deadline derived from its size and from the throughput observed
+ in the previous transfers, bounded by a floor and a ceiling. A transfer
+ exceeding its deadline is abandoned: its thread is left running, but
+ the caller is released. The items can be requeued once the abandoned
+ transfer has failed, while a late success still counts: callbacks can
+ wait for the end of a transfer still running.
+
+"""
+
+import time
+
+from threading import Thread, Lock
+
+import rucio_uploader.trace as trace
+
+class Settlement:
+    """End of a transfer, with the callbacks waiting for it
+    """
+
+    def __init__(self):
+        """Settlement constructor
+        """
+        self.lock = Lock()
+        self.succeeded = None
+        self.callbacks = []
+
+    def end(self, succeeded: bool):
+        """Record the end of the transfer and call the waiting callbacks
+
+        Args:
+            succeeded (bool): True if the transfer succeeded
+        """
+        with self.lock:
+            self.succeeded = succeeded
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            callback(succeeded)
+
+    def add(self, callback):
+        """Call callback(succeeded) at the end of the transfer, now if already ended
+
+        Args:
+            callback (function): function called with True if the transfer succeeded
+        """
+        with self.lock:
+            if self.succeeded is None:
+                self.callbacks.append(callback)
+                return
+        callback(self.succeeded)
+
+class TransferTimeout(Exception):
+    """A transfer exceeded its deadline and was abandoned
+    """
+
+    def __init__(self, message: str, thread: Thread = None, outcome: dict = None, settlement: Settlement = None):
+        """TransferTimeout constructor
+
+        Args:
+            message (str): description of the timeout
+            thread (Thread, optional): thread of the abandoned transfer. Defaults to None.
+            outcome (dict, optional): "result" or "error" of the transfer, once ended. Defaults to None.
+            settlement (Settlement, optional): end of the abandoned transfer. Defaults to None (already ended).
+        """
+        super().__init__(message)
+        self.thread = thread
+        self.outcome = outcome if outcome is not None else {}
+        self.settlement = settlement
+        # files to be removed once the abandoned transfer has ended
+        self.temporary_files = []
+
+    def settle(self, grace: float) -> bool:
+        """Wait at most grace seconds for the end of the abandoned transfer
+
+        Args:
+            grace (float): seconds to wait
+
+        Returns:
+            bool: True if the transfer succeeded, False if it failed, None if it is still running
+        """
+        if self.thread is not None:
+            self.thread.join(grace)
+            if self.thread.is_alive():
+                return None
+        return "result" in self.outcome
+
+    def when_settled(self, callback):
+        """Call callback(succeeded) once the abandoned transfer has ended, now if already ended
+
+        Args:
+            callback (function): function called with True if the transfer succeeded
+        """
+        if self.settlement is None:
+            callback("result" in self.outcome)
+        else:
+            self.settlement.add(callback)
+
+class Watchdog:
+    """Watchdog giving each transfer a size-aware deadline
+    """
+
+    def __init__(self, floor: float = 300., ceiling: float = 21600., factor: float = 3., initial_rate: float = 10*2**20, alpha: float = 0.2):
+        """Watchdog constructor
+
+        Args:
+            floor (float, optional): minimum deadline in seconds, lowered to the ceiling if above. Defaults to 300.
+            ceiling (float, optional): maximum deadline in seconds. Defaults to 21600.
+            factor (float, optional): deadline as multiple of the expected duration. Defaults to 3.
+            initial_rate (float, optional): throughput in bytes/s assumed before any transfer. Defaults to 10 MiB/s.
+            alpha (float, optional): weight of the last transfer in the moving average of the throughput. Defaults to 0.2.
+        """
+        self.floor = min(floor, ceiling)
+        self.ceiling = ceiling
+        self.factor = factor
+        self.rate = initial_rate
+        self.alpha = alpha
+        self.lock = Lock()
+
+    def deadline(self, size: int) -> float:
+        """Return the deadline of a transfer
+
+        Args:
+            size (int): bytes to be transferred
+
+        Returns:
+            float: deadline in seconds
+        """
+        with self.lock:
+            rate = self.rate
+        return min(self.ceiling, max(self.floor, self.factor * size / rate))
+
+    def observe(self, size: int, seconds: float):
+        """Update the throughput with a completed transfer. Transfers
+        shorter than one second are dominated by overheads and ignored.
+
+        Args:
+            size (int): bytes transferred
+            seconds (float): duration of the transfer
+        """
+        if seconds < 1. or size == 0:
+            return
+        with self.lock:
+            self.rate = (1 - self.alpha) * self.rate + self.alpha * size / seconds
+
+    def run(self, function, size: int):
+        """Run a transfer in a separate thread, waiting at most its deadline
+
+        Args:
+            function (function): the transfer
+            size (int): bytes to be transferred
+
+        Raises:
+            TransferTimeout: if the transfer exceeded its deadline
+            Exception: the exception raised by the transfer, if any
+
+        Returns:
+            object: the result of the transfer
+        """
+        outcome = {}
+        settlement = Settlement()
+        def target():
+            try:
+                outcome["result"] = function()
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                settlement.end("result" in outcome)
+        deadline = self.deadline(size)
+        thread = Thread(target=trace.profiled(target), daemon=True)
+        start = time.time()
+        thread.start()
+        thread.join(deadline)
+        if thread.is_alive():
+            raise TransferTimeout("transfer of {} bytes exceeded its deadline of {:.0f} s".format(size, deadline), thread, outcome, settlement)
+        if "error" in outcome:
+            raise outcome["error"]
+        self.observe(size, time.time() - start)
+        return outcome.get("result")
@@ -1,6 +1,6 @@
 """@package rucio_items_wrapper
 
- Wrapper of RUCIO items: did, dataset, rule
+ Wrapper of RUCIO items: did, dataset, container, rule
 
 """
 
@@ -11,7 +11,7 @@ class RucioDID:
     """A RUCIO DID
     """
     
-    def __init__(self, path: str, name: str, scope: str = None, ds_name: str = None, ds_scope: str = None):
+    def __init__(self, path: str, name: str, scope: str = None, ds_name: str = None, ds_scope: str = None, size: int = None, adler32: str = None):
         """RUCIO DID constructor
 
         Args:
@@ -20,6 +20,8 @@ class RucioDID:
             scope (str, optional): scope of the RUCIO DID. Defaults to None.
             ds_name (str, optional): name of the RUCIO DID dataset. Defaults to None.
             ds_scope (str, optional): scope of the RUCIO DID dataset. Defaults to None.
+            size (int, optional): size of the file, if known. Defaults to None (read from the filesystem).
+            adler32 (str, optional): adler32 checksum of the file, if known. Defaults to None.
         """
         self.name = name
         self.scope = scope
@@ -30,11 +32,15 @@ class RucioDID:
         self.asAttach = {}
         self.in_rucio=False
         self.in_dataset=False
+        self.adler32 = adler32
         self.size = 0
-        try:
-            self.size = os.path.getsize(self.path)
-        except:
-            pass
+        if size is not None:
+            self.size = size
+        else:
+            try:
+                self.size = os.path.getsize(self.path)
+            except:
+                pass
     
     def get_scoped_name(self):
         """Return a string in the form: "<scope>:<item name>"
@@ -60,6 +66,8 @@ class RucioDID:
         self.asUpload["rse"] = rse
         self.asUpload["upload_ok"] = False
         self.asUpload["size"] = self.size
+        if self.adler32 is not None:
+            self.asUpload["adler32"] = self.adler32
     
     def toAttach(self):
         """Prepare DID to be attached to its dataset
@@ -102,6 +110,31 @@ class RucioDataset:
         """
         return utils.get_scoped_name(self.name,self.scope)
 
+class RucioContainer:
+    """A RUCIO container
+    """
+
+    def __init__(self, name: str, scope: str, datasets: list):
+        """RUCIO container constructor
+
+        Args:
+            name (str): name of the RUCIO container
+            scope (str): scope of the RUCIO container
+            datasets (list): list of the datasets (or containers)
+        """
+        self.name = name
+        self.scope = scope
+        self.datasets = datasets
+        self.in_rucio=False
+    
+    def get_scoped_name(self):
+        """Return a string in the form: "<scope>:<item name>"
+
+        Returns:
+            str: a string in the form: "<scope>:<item name>"
+        """
+        return utils.get_scoped_name(self.name,self.scope)
+
 class RucioRule:
     """A RUCIO rule
     """
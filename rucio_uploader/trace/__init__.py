@@ -0,0 +1,180 @@
+"""@package trace
+
+ Timeline tracing and profiling. Spans of the stages of each file and
+ of the phases of the manager are recorded, with their thread, and
+ exported as a Chrome/Perfetto trace file (chrome://tracing, ui.perfetto.dev).
+ The main thread and the upload workers can be profiled with cProfile,
+ their statistics are merged in a single pstats file.
+
+"""
+
+import os
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+
+from contextlib import contextmanager
+
+class Tracer:
+    """Recorder of spans in the Chrome trace event format
+    """
+
+    def __init__(self):
+        """Tracer constructor
+        """
+        self.enabled = False
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        """Start recording spans
+        """
+        self.origin = time.perf_counter()
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name: str, category: str = "", **args):
+        """Record a span around a block of code
+
+        Args:
+            name (str): name of the span
+            category (str, optional): category of the span. Defaults to "".
+            args: arguments shown with the span
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            thread = threading.current_thread()
+            event = {"name": name,
+                     "cat": category,
+                     "ph": "X",
+                     "ts": (start - self.origin) * 1e6,
+                     "dur": (end - start) * 1e6,
+                     "pid": os.getpid(),
+                     "tid": thread.ident,
+                     "args": args}
+            with self.lock:
+                self.events.append(event)
+                self.threads[thread.ident] = thread.name
+
+    def to_dict(self) -> dict:
+        """Return the trace in the Chrome trace event format
+
+        Returns:
+            dict: the trace
+        """
+        with self.lock:
+            names = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                     for tid, name in self.threads.items()]
+            return {"traceEvents": names + list(self.events), "displayTimeUnit": "ms"}
+
+    def write(self, path: str):
+        """Write the trace to a json file
+
+        Args:
+            path (str): trace file
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+
+class Profiler:
+    """cProfile profiler of the main thread and of the worker threads
+    """
+
+    def __init__(self):
+        """Profiler constructor
+        """
+        self.enabled = False
+        self.main = None
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def enable(self):
+        """Start profiling the calling (main) thread
+        """
+        self.enabled = True
+        self.main = cProfile.Profile()
+        self.main.enable()
+
+    def profiled(self, function):
+        """Return the function profiled in the thread that calls it
+
+        Args:
+            function (function): function, e.g. the target of a thread
+
+        Returns:
+            function: the profiled function, the function itself if profiling is not enabled
+        """
+        if not self.enabled:
+            return function
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                with self.lock:
+                    self.profiles.append(profile)
+        return wrapper
+
+    def write(self, path: str):
+        """Stop profiling the main thread and write the merged statistics
+
+        Args:
+            path (str): pstats file
+        """
+        self.main.disable()
+        stats = pstats.Stats(self.main)
+        with self.lock:
+            for profile in self.profiles:
+                stats.add(profile)
+        stats.dump_stats(path)
+
+TRACER = Tracer()
+PROFILER = Profiler()
+
+def span(name: str, category: str = "", **args):
+    """Record a span around a block of code with the global tracer
+
+    Args:
+        name (str): name of the span
+        category (str, optional): category of the span. Defaults to "".
+        args: arguments shown with the span
+    """
+    return TRACER.span(name, category, **args)
+
+def traced(name: str, category: str = "phase"):
+    """Decorator recording a span for each call of a function
+
+    Args:
+        name (str): name of the span
+        category (str, optional): category of the span. Defaults to "phase".
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def profiled(function):
+    """Return the function profiled with the global profiler, if enabled
+
+    Args:
+        function (function): function, e.g. the target of a thread
+
+    Returns:
+        function: the profiled function
+    """
+    return PROFILER.profiled(function)
@@ -5,6 +5,7 @@
 """
 
 import os
+import zlib
 import hashlib
 from datetime import datetime
 
@@ -52,8 +53,23 @@ def get_scope_and_name(sname: str) -> str:
     splits = sname.split(':')
     return splits[0],splits[1]
 
+def deterministic_path(rse_local_path: str, scope: str, name: str) -> str:
+    """Return the path of a file in a deterministic RSE: "<rse path>/xx/yy/<name>"
+    where xx and yy are the first digits of the md5 hash of "<scope>:<name>"
+
+    Args:
+        rse_local_path (str): local path of the RSE
+        scope (str): scope
+        name (str): filename
+
+    Returns:
+        str: path of the file in the RSE
+    """
+    hash = hashlib.md5("{}:{}".format(scope,name).encode('utf-8')).hexdigest()
+    return "{}/{}/{}/{}".format(rse_local_path,hash[:2],hash[2:4],name)
+
 def sources_exist(sources: list) -> bool:
-    """Check the sources exist
+    """Check the sources exist. "-" is the standard input
 
     Args:
         sources (list): list of sources
@@ -63,7 +79,7 @@ def sources_exist(sources: list) -> bool:
     """
     if sources is not None:
         for s in sources:
-            if not os.path.exists(s):
+            if s != "-" and not os.path.exists(s):
                 print("Error: {} does not exits".format(s))
                 return False
     return True
@@ -84,3 +100,42 @@ def md5(fname):
         for chunk in iter(lambda: f.read(4096), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
+
+def adler32(fname):
+    """Evaluate adler32 checksum of a file
+
+    Args:
+        fname (str): path of a file
+
+    Returns:
+        str: checksum of a file as 8 hexadecimal digits
+    """
+    value = 1
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(1048576), b""):
+            value = zlib.adler32(chunk, value)
+    return "{:08x}".format(value & 0xffffffff)
+
+def bucket(name: str, buckets: int) -> int:
+    """Return the stable bucket of a name, among a power of two number of buckets.
+    Doubling the buckets splits each bucket in two: bucket b in b and b + buckets.
+
+    Args:
+        name (str): name
+        buckets (int): number of buckets, a power of two
+
+    Returns:
+        int: bucket in [0, buckets)
+    """
+    return int(hashlib.md5(name.encode("utf-8")).hexdigest()[:8], 16) & (buckets - 1)
+
+def next_power_of_two(n: int) -> int:
+    """Return the smallest power of two not less than n
+
+    Args:
+        n (int): number
+
+    Returns:
+        int: power of two, 1 if n < 1
+    """
+    return 1 << max(0, n - 1).bit_length()
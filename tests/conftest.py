@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import rucio_uploader from the repository, not from an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,44 @@
+import time
+
+import rucio_uploader.rucio.lease as lease_table
+
+def tables(tmp_path, ttl=3600.):
+    path = str(tmp_path / "leases.db")
+    return lease_table.LeaseTable(path, ttl, "a"), lease_table.LeaseTable(path, ttl, "b")
+
+def test_claims_are_disjoint(tmp_path):
+    a, b = tables(tmp_path)
+    assert a.claim("file", ["x", "y"]) == {"x", "y"}
+    assert b.claim("file", ["y", "z"]) == {"z"}
+    # the owner keeps its leases, kinds are independent
+    assert a.claim("file", ["x", "z"]) == {"x"}
+    assert b.claim("dataset", ["x"]) == {"x"}
+
+def test_claim_more_keys_than_a_chunk(tmp_path):
+    a, b = tables(tmp_path)
+    keys = [str(i) for i in range(lease_table.CHUNK_SIZE * 2 + 1)]
+    assert a.claim("file", keys[::2]) == set(keys[::2])
+    assert b.claim("file", keys) == set(keys[1::2])
+
+def test_expired_leases_are_reclaimed(tmp_path):
+    a, b = tables(tmp_path, ttl=0.1)
+    assert a.claim("file", ["x"]) == {"x"}
+    assert b.claim("file", ["x"]) == set()
+    time.sleep(0.2)
+    assert b.claim("file", ["x"]) == {"x"}
+
+def test_renewed_leases_do_not_expire(tmp_path):
+    a, b = tables(tmp_path, ttl=0.3)
+    a.claim("file", ["x"])
+    time.sleep(0.2)
+    a.renew()
+    time.sleep(0.2)
+    assert b.claim("file", ["x"]) == set()
+
+def test_released_leases_are_free(tmp_path):
+    a, b = tables(tmp_path)
+    a.start()
+    a.claim("dataset", ["ds"])
+    assert b.claim("dataset", ["ds"]) == set()
+    a.stop()
+    assert b.claim("dataset", ["ds"]) == {"ds"}
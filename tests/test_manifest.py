@@ -0,0 +1,84 @@
+import io
+import gzip
+import json
+
+import pytest
+
+import rucio_uploader.interfaces.manifest as manifest_interface
+
+CONFIG = {"scope": "user.test",
+          "upl_rse": "FNAL_DCACHE",
+          "dst_rse": "CNAF",
+          "register_after_upload": True,
+          "ds_name_template": "run-{}-raw",
+          "filename_run_pattern": r".*_run([0-9]{4})_.*",
+          "inplace_local_prefix": "/pnfs",
+          "inplace_pfn_prefix": "gsiftp://fndca1.fnal.gov:2811/pnfs/fnal.gov/usr"}
+
+def read(path):
+    return list(manifest_interface.ManifestReader([str(path)]).read())
+
+def test_plain_with_optional_columns(tmp_path):
+    path = tmp_path / "list.txt"
+    path.write_text("\n/pnfs/a/data_run1000_1.root 10 1A2b myds\n/pnfs/a/data_run1000_2.root\n\n")
+    items = read(path)
+    assert [(x.path, x.size, x.adler32, x.dataset) for x in items] == [("/pnfs/a/data_run1000_1.root", 10, "00001a2b", "myds"),
+                                                                     ("/pnfs/a/data_run1000_2.root", None, None, None)]
+
+def test_gzip_csv(tmp_path):
+    path = tmp_path / "list.csv.gz"
+    with gzip.open(str(path), "wt") as f:
+        f.write("dataset,path,size\nmyds,/pnfs/a/f1.root,5\n,/pnfs/a/data_run1000_3.root,\n")
+    items = read(path)
+    assert [(x.path, x.size, x.adler32, x.dataset) for x in items] == [("/pnfs/a/f1.root", 5, None, "myds"),
+                                                                     ("/pnfs/a/data_run1000_3.root", None, None, None)]
+
+def test_jsonl(tmp_path):
+    path = tmp_path / "list.jsonl"
+    path.write_text(json.dumps({"path": "/pnfs/a/f.root", "size": 7, "adler32": "ABCDEF01"}) + "\n\n")
+    items = read(path)
+    assert [(x.path, x.size, x.adler32, x.dataset) for x in items] == [("/pnfs/a/f.root", 7, "abcdef01", None)]
+
+def test_empty_manifest(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_text("")
+    assert read(path) == []
+
+def test_invalid_manifest(tmp_path):
+    path = tmp_path / "list.txt"
+    path.write_text("/pnfs/a/f.root not_a_size\n")
+    with pytest.raises(SystemExit):
+        read(path)
+
+def test_stdin(monkeypatch):
+    stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(gzip.compress(b"/pnfs/a/f.root 3\n"))))
+    monkeypatch.setattr("sys.stdin", stdin)
+    items = list(manifest_interface.ManifestReader(["-"]).read())
+    assert [(x.path, x.size) for x in items] == [("/pnfs/a/f.root", 3)]
+
+def test_configurator_uses_the_manifest_columns(tmp_path):
+    path = tmp_path / "list.csv"
+    path.write_text("path,size,adler32,dataset\n"
+                    "/does/not/exist/data_run1000_1.root,10,abc,\n"
+                    "/does/not/exist/f.root,20,,myds\n"
+                    "/does/not/exist/other.root,30,,\n"
+                    "gsiftp://fndca1.fnal.gov:2811/pnfs/fnal.gov/usr/a/data_run1001_2.root,0,,\n")
+    items = manifest_interface.ManifestItemsConfigurator(manifest_interface.ManifestReader([str(path)]), CONFIG)
+
+    # sizes come from the manifest: the files are not stat'ed
+    first = items.dids["user.test:data_run1000_1.root"]
+    assert (first.size, first.ds_name, first.asUpload["adler32"]) == (10, "run-1000-raw", "00000abc")
+    assert items.dids["user.test:f.root"].ds_name == "myds"
+    assert "user.test:other.root" not in items.dids
+    assert items.zero_size_dids["user.test:data_run1001_2.root"].path == "/pnfs/a/data_run1001_2.root"
+    assert sorted(items.datasets) == ["user.test:myds", "user.test:run-1000-raw"]
+    assert [d.name for d in items.datasets["user.test:run-1000-raw"].dids] == ["data_run1000_1.root"]
+    assert sorted(items.rules) == sorted(items.datasets)
+
+@pytest.mark.parametrize("line", ['"a/b"', "[1]", '{"size": 3}', '{"path": "/pnfs/a/f.root", "size": [1]}'])
+def test_invalid_jsonl_line(tmp_path, capsys, line):
+    path = tmp_path / "list.jsonl"
+    path.write_text(json.dumps({"path": "/pnfs/a/f.root"}) + "\n\n" + line + "\n")
+    with pytest.raises(SystemExit):
+        read(path)
+    assert "line 3" in capsys.readouterr().out
@@ -0,0 +1,69 @@
+import pytest
+
+import rucio_uploader.rucio.plan as upload_plan
+import rucio_uploader.rucio.wrappers as wrapper
+
+def make_plan(n_uploads=5):
+    uploads = [{"path": "/pnfs/f{}.root".format(i),
+                "did_name": "f{}.root".format(i),
+                "did_scope": "user.test",
+                "dataset_name": "run-1000-raw",
+                "dataset_scope": "user.test",
+                "register_after_upload": True,
+                "rse": "FNAL_DCACHE",
+                "size": 100 + i,
+                "upload_ok": False} for i in range(n_uploads)]
+    uploads[0]["adler32"] = "0000abcd"
+    return upload_plan.UploadPlan({"scope": "user.test"},
+                                  [wrapper.RucioDataset("run-1000-raw", "user.test", [])],
+                                  [wrapper.RucioRule("CNAF", "run-1000-raw", "user.test", 2)],
+                                  {"user.test:run-1000-raw": [{"scope": "user.test", "name": "old.root"}]},
+                                  uploads,
+                                  [wrapper.RucioContainer("icarus-raw", "user.test", [])])
+
+def test_round_trip(tmp_path):
+    plan = make_plan()
+    path = str(tmp_path / "run.plan")
+    plan.write(path)
+    read = upload_plan.UploadPlan.read(path)
+
+    assert read.config == plan.config
+    assert [(ds.scope, ds.name) for ds in read.datasets] == [("user.test", "run-1000-raw")]
+    assert [(c.scope, c.name) for c in read.containers] == [("user.test", "icarus-raw")]
+    assert [(r.scope, r.name, r.rse, r.ncopy) for r in read.rules] == [("user.test", "run-1000-raw", "CNAF", 2)]
+    assert read.attachments == plan.attachments
+    assert read.uploads == plan.uploads
+    assert read.summary() == plan.summary()
+
+def test_version_1_without_containers():
+    plan = make_plan().to_dict()
+    plan["version"] = 1
+    del plan["containers"]
+    assert upload_plan.UploadPlan.from_dict(plan).containers == []
+
+def test_unsupported_version(tmp_path):
+    plan = make_plan().to_dict()
+    plan["version"] = upload_plan.PLAN_VERSION + 1
+    with pytest.raises(upload_plan.UploadPlanError):
+        upload_plan.UploadPlan.from_dict(plan)
+
+def test_unreadable_plan(tmp_path):
+    path = tmp_path / "run.plan"
+    path.write_text("not a plan")
+    with pytest.raises(upload_plan.UploadPlanError):
+        upload_plan.UploadPlan.read(str(path))
+
+def test_slices_partition_the_uploads():
+    plan = make_plan(10)
+    slices = [plan.slice(i, 3) for i in range(3)]
+    names = [x["did_name"] for s in slices for x in s.uploads]
+    assert sorted(names) == sorted(x["did_name"] for x in plan.uploads)
+    assert len(slices[0].datasets) == 1 and len(slices[0].rules) == 1 and len(slices[0].containers) == 1
+    assert slices[0].attachments == plan.attachments
+    for s in slices[1:]:
+        assert s.datasets == [] and s.rules == [] and s.containers == [] and s.attachments == {}
+
+@pytest.mark.parametrize("index,count", [(0, 0), (-1, 2), (2, 2)])
+def test_invalid_slice(index, count):
+    with pytest.raises(ValueError):
+        make_plan().slice(index, count)
@@ -0,0 +1,56 @@
+import time
+
+import rucio_uploader.rucio.recall as recall
+
+class StubLocator:
+    """Locator from a dictionary ("path":("volume", position))"""
+
+    def __init__(self, locations):
+        self.locations = locations
+
+    def locate(self, path):
+        return self.locations.get(path, (recall.UNKNOWN_VOLUME, 0))
+
+def item(path, size=1):
+    return {"path": path, "size": size}
+
+def planner(locations, recalled, **kwargs):
+    locality = {"/t/a": "NEARLINE", "/t/b": "NEARLINE", "/t/c": "NEARLINE", "/t/d": "ONLINE", "/t/e": "NEARLINE"}
+    return recall.RecallPlanner(lambda path: locality[path], StubLocator(locations), recall=recalled.append, **kwargs)
+
+def test_nearline_grouped_by_volume_in_position_order():
+    items = [item(p) for p in ["/t/a", "/t/b", "/t/c", "/t/d", "/t/e"]]
+    p = planner({"/t/a": ("V1", 30), "/t/b": ("V2", 5), "/t/c": ("V1", 10)}, [])
+    nearline = p.nearline(items)
+    assert [x["path"] for x in nearline] == ["/t/a", "/t/b", "/t/c", "/t/e"]
+    assert items[3]["locality"] == "ONLINE"
+    volumes = p.group(nearline)
+    assert {v: [x["path"] for x in xs] for v, xs in volumes.items()} == {"V1": ["/t/c", "/t/a"],
+                                                                          "V2": ["/t/b"],
+                                                                          recall.UNKNOWN_VOLUME: ["/t/e"]}
+
+def test_submit_largest_volume_first_in_order():
+    recalled = []
+    p = planner({}, recalled, max_volumes=1)
+    p.submit({"V2": [item("/t/b")], "V1": [item("/t/c"), item("/t/a")]})
+    assert recalled == ["/t/c", "/t/a", "/t/b"]
+
+def test_paced_recalls():
+    recalled = []
+    p = planner({}, recalled, bytes_per_sec=100.)
+    start = time.time()
+    p.recall_volume("V1", [item("/t/a", 10), item("/t/b", 10)])
+    assert recalled == ["/t/a", "/t/b"]
+    assert time.time() - start >= 0.09
+
+def test_trigger_recall_does_not_wait(monkeypatch):
+    started = []
+    class Popen:
+        def __init__(self, command, **kwargs):
+            started.append(command)
+    monkeypatch.setattr(recall.subprocess, "Popen", Popen)
+    def run(*args, **kwargs):
+        raise AssertionError("the recall waits for the copy")
+    monkeypatch.setattr(recall.subprocess, "run", run)
+    recall.trigger_recall("/pnfs/a/f.root")
+    assert started == ["timeout 3 ifdh cp /pnfs/a/f.root /dev/null"]
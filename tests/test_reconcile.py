@@ -0,0 +1,63 @@
+import os
+
+import rucio_uploader.utils as utils
+import rucio_uploader.rucio.reconcile as reconcile
+
+from test_verify import StubPool, item
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+def test_missing_local_file_with_destination(tmp_path):
+    rse = tmp_path / "rse"
+    write(utils.deterministic_path(str(rse), "user.test", "gone.root"), b"some data")
+    missing = item(tmp_path / "gone.root", "gone.root", 9)
+    reconciler = reconcile.ReplicaReconciler(StubPool([]), ["FNAL_DCACHE"], str(rse))
+    assert not reconciler.at_destination(missing)
+    assert reconciler.classify([missing], set()) == {reconcile.TRANSFER: 1}
+
+class FailingPool:
+    """Pool whose bulk calls fail"""
+
+    def call(self, kind, function):
+        raise ConnectionError("no server")
+
+def replica(name, state):
+    return {"scope": "user.test", "name": name, "states": {"FNAL_DCACHE": state}}
+
+def test_classify(tmp_path):
+    rse = tmp_path / "rse"
+    local = tmp_path / "local"
+    content = b"some data"
+    names = ["available", "copying", "bad", "unregistered", "new", "different"]
+    for name in names:
+        write(str(local / name), content)
+    for name in ["copying", "bad", "unregistered"]:
+        write(utils.deterministic_path(str(rse), "user.test", name), content)
+    write(utils.deterministic_path(str(rse), "user.test", "different"), b"other data")
+    items = [item(local / name, name, len(content)) for name in names]
+    pool = StubPool([replica("available", "AVAILABLE"),
+                     replica("copying", "COPYING"),
+                     replica("bad", "BAD")])
+    reconciler = reconcile.ReplicaReconciler(pool, ["FNAL_DCACHE"], str(rse))
+    counts = reconciler.classify(items, set("user.test:" + name for name in ["available", "copying", "bad"]))
+    assert {x["did_name"]: x["reconcile"] for x in items} == {"available": reconcile.DONE,
+                                                              "copying": reconcile.REGISTER,
+                                                              "bad": reconcile.TRANSFER,
+                                                              "unregistered": reconcile.REGISTER,
+                                                              "new": reconcile.TRANSFER,
+                                                              "different": reconcile.TRANSFER}
+    assert counts == {reconcile.DONE: 1, reconcile.REGISTER: 2, reconcile.TRANSFER: 3}
+    assert {x["did_name"]: x.get("replica_state") for x in items if x["reconcile"] != reconcile.DONE} == {"copying": "COPYING",
+                                                                                                        "bad": "BAD",
+                                                                                                        "unregistered": None,
+                                                                                                        "new": None,
+                                                                                                        "different": None}
+
+def test_classify_without_replica_listing(tmp_path):
+    items = [item(tmp_path / "a", "a", 1), item(tmp_path / "b", "b", 1)]
+    reconciler = reconcile.ReplicaReconciler(FailingPool(), ["FNAL_DCACHE"], str(tmp_path / "rse"))
+    reconciler.classify(items, {"user.test:a"})
+    assert [x["reconcile"] for x in items] == [reconcile.DONE, reconcile.TRANSFER]
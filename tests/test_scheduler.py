@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+
+import rucio_uploader.rucio.scheduler as scheduler
+
+class StubResolver:
+    """Resolver of the pool of a file from its directory
+    """
+
+    def pool(self, path):
+        return path.split("/")[1]
+
+def unit(pool, dataset, name, size=1):
+    return [{"path": "/{}/{}".format(pool, name),
+             "did_name": name,
+             "dataset_name": dataset,
+             "dataset_scope": "user.test",
+             "size": size,
+             "upload_ok": False}]
+
+def names(units):
+    return [u[0]["did_name"] for u in units]
+
+def drain(queue):
+    queue.close()
+    taken = []
+    while True:
+        u = queue.get()
+        if u is None:
+            return taken
+        taken.append(u)
+        u[0]["upload_ok"] = True
+        queue.done(u)
+
+def test_fifo_keeps_the_input_order():
+    queue = scheduler.UploadScheduler(StubResolver(), policy="fifo")
+    for i, ds in enumerate(["run-1002-raw", "run-1000-raw", "run-1001-raw"]):
+        queue.put(unit("p", ds, "f{}".format(i)))
+    assert names(drain(queue)) == ["f0", "f1", "f2"]
+
+def test_smallest_dataset_first():
+    queue = scheduler.UploadScheduler(StubResolver(), policy="smallest")
+    queue.put(unit("p", "run-1000-raw", "big", 100))
+    queue.put(unit("p", "run-1001-raw", "small", 10))
+    queue.put(unit("p", "run-1002-raw", "medium", 50))
+    assert names(drain(queue)) == ["small", "medium", "big"]
+
+def test_newest_run_first():
+    queue = scheduler.UploadScheduler(StubResolver(), policy="newest")
+    for run in [1000, 1002, 1001]:
+        queue.put(unit("p", "run-{}-raw".format(run), str(run)))
+    assert names(drain(queue)) == ["1002", "1001", "1000"]
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        scheduler.UploadScheduler(StubResolver(), policy="random")
+
+def test_pool_concurrency_budget():
+    queue = scheduler.UploadScheduler(StubResolver(), max_active=1, policy="fifo")
+    queue.put(unit("a", "run-1000-raw", "a1"))
+    queue.put(unit("a", "run-1000-raw", "a2"))
+    queue.put(unit("b", "run-1001-raw", "b1"))
+    first = queue.get()
+    # pool a is busy: pool b is served
+    second = queue.get()
+    assert names([first, second]) == ["a1", "b1"]
+    assert queue.pools["a"].ready_at(0.) is None
+    queue.done(first)
+    assert names([queue.get()]) == ["a2"]
+
+def test_unlimited_budget_by_default():
+    budget = scheduler.PoolBudget()
+    budget.append("ds", ["unit"])
+    for _ in range(100):
+        budget.start(1, 0.)
+    assert budget.ready_at(0.) == 0.
+
+def test_pool_bandwidth_budget():
+    budget = scheduler.PoolBudget(bytes_per_sec=100.)
+    budget.append("ds", ["unit"])
+    budget.start(200, 10.)
+    assert budget.ready_at(10.) == 12.
+    budget.start(100, 12.)
+    assert budget.ready_at(12.) == 13.
+
+def test_workers_wait_for_requeued_units():
+    queue = scheduler.UploadScheduler(StubResolver())
+    queue.put(unit("p", "run-1000-raw", "f"))
+    queue.close()
+    u = queue.get()
+    taken = []
+    worker = threading.Thread(target=lambda: taken.append(queue.get()))
+    worker.start()
+    # the queue is closed and empty, but the unit is still active and can be requeued
+    worker.join(0.2)
+    assert worker.is_alive()
+    queue.requeue(u)
+    queue.done(u)
+    worker.join(5)
+    assert names(taken) == ["f"]
+    queue.done(taken[0])
+    assert queue.get() is None
+
+def test_items_done_after_their_last_unit():
+    done = []
+    queue = scheduler.UploadScheduler(StubResolver(), on_items_done=done.extend)
+    queue.put(unit("p", "run-1000-raw", "f"))
+    u = queue.get()
+    queue.requeue(u)
+    queue.done(u)
+    assert done == []
+    queue.done(queue.get())
+    assert [x["did_name"] for x in done] == ["f"]
+
+def test_retried_items_are_counted_once():
+    completed = []
+    queue = scheduler.UploadScheduler(StubResolver(), on_dataset_complete=completed.append)
+    failed = unit("p", "run-1000-raw", "f0")
+    queue.put(failed)
+    queue.put(unit("p", "run-1000-raw", "f1"))
+    u = queue.get()
+    queue.done(u)
+    # retried while the dataset is still in progress
+    queue.put(failed)
+    assert len(queue.datasets["user.test:run-1000-raw"].items) == 2
+    drain(queue)
+    assert [len(p.items) for p in completed] == [2]
+    assert queue.datasets == {}
+
+def test_datasets_complete_one_at_a_time():
+    completed = []
+    queue = scheduler.UploadScheduler(StubResolver(), policy="smallest", on_dataset_complete=lambda p: completed.append(p.name))
+    # interleaved input, files of two pools
+    for i in range(3):
+        queue.put(unit("a", "run-1000-raw", "big{}".format(i), 100))
+        queue.put(unit("b", "run-1001-raw", "small{}".format(i), 10))
+    order = names(drain(queue))
+    assert order == ["small0", "small1", "small2", "big0", "big1", "big2"]
+    assert completed == ["user.test:run-1001-raw", "user.test:run-1000-raw"]
@@ -0,0 +1,25 @@
+import rucio_uploader.rucio.scheduler as scheduler
+
+def item(dataset, name, size):
+    return {"path": "/p/" + name, "did_name": name, "dataset_name": dataset, "dataset_scope": "user.test", "size": size}
+
+def names(units):
+    return [[x["did_name"] for x in unit] for unit in units]
+
+def test_small_files_grouped_by_dataset():
+    items = [item("run-1000-raw", "a", 10),
+             item("run-1001-raw", "b", 10),
+             item("run-1000-raw", "big", 100),
+             item("run-1000-raw", "c", 10),
+             item("run-1001-raw", "d", 10)]
+    units = scheduler.group_small_files(items, 100, 1000, 10)
+    assert names(units) == [["a", "c"], ["b", "d"], ["big"]]
+
+def test_groups_limited_in_bytes_and_files():
+    items = [item("run-1000-raw", str(i), 30) for i in range(7)]
+    assert names(scheduler.group_small_files(items, 100, 60, 10)) == [["0", "1"], ["2", "3"], ["4", "5"], ["6"]]
+    assert names(scheduler.group_small_files(items, 100, 1000, 3)) == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+
+def test_no_grouping_with_zero_threshold():
+    items = [item("run-1000-raw", str(i), 1) for i in range(3)]
+    assert names(scheduler.group_small_files(items, 0, 1000, 10)) == [["0"], ["1"], ["2"]]
@@ -0,0 +1,73 @@
+import rucio_uploader.utils as utils
+import rucio_uploader.rucio.wrappers as wrapper
+import rucio_uploader.interfaces.multi as multi_interface
+
+SCOPE = "user.test"
+
+def test_next_power_of_two():
+    assert [utils.next_power_of_two(n) for n in [0, 1, 2, 3, 4, 5, 8, 9]] == [1, 1, 2, 4, 4, 8, 8, 16]
+
+def test_bucket_is_stable_and_doubling_splits():
+    names = ["file_{}.root".format(i) for i in range(200)]
+    for name in names:
+        b = utils.bucket(name, 4)
+        assert 0 <= b < 4
+        assert b == utils.bucket(name, 4)
+        assert utils.bucket(name, 8) in [b, b + 4]
+    assert set(utils.bucket(name, 1) for name in names) == {0}
+
+def configurator(runs: dict) -> multi_interface.MultiItemsConfigurator:
+    """Build a configurator without sources, from {dataset name: number of files}"""
+    items = multi_interface.MultiItemsConfigurator.__new__(multi_interface.MultiItemsConfigurator)
+    items.config = {}
+    items.dids = {}
+    items.datasets = {}
+    items.rules = {}
+    items.containers = {}
+    items.zero_size_dids = {}
+    for ds_name, nfiles in runs.items():
+        ds = wrapper.RucioDataset(ds_name, SCOPE, [])
+        for i in range(nfiles):
+            did = wrapper.RucioDID("/data/{}_{}.root".format(ds_name, i), "{}_{}.root".format(ds_name, i), SCOPE, ds_name, SCOPE, 10)
+            did.configure(True, "FNAL_DCACHE")
+            items.dids[did.get_scoped_name()] = did
+            ds.dids.append(did)
+        sname = utils.get_scoped_name(ds_name, SCOPE)
+        items.datasets[sname] = ds
+        items.rules[sname] = wrapper.RucioRule("CNAF", ds_name, SCOPE)
+    return items
+
+def test_split_only_runs_above_the_cap():
+    items = configurator({"run-1000-raw": 10, "run-1001-raw": 25})
+    items.split(10)
+    assert list(items.containers) == [SCOPE + ":run-1001-raw"]
+    assert SCOPE + ":run-1000-raw" in items.datasets
+    subs = sorted(ds.name for ds in items.containers[SCOPE + ":run-1001-raw"].datasets)
+    # 25 files, 10 per dataset: 4 buckets
+    assert set(subs) <= {"run-1001-raw-{:03d}".format(b) for b in range(4)}
+    assert sum(len(items.datasets[utils.get_scoped_name(s, SCOPE)].dids) for s in subs) == 25
+    for did in items.dids.values():
+        assert did.asUpload["dataset_name"] == did.ds_name
+        assert utils.get_scoped_name(did.ds_name, SCOPE) in items.datasets
+
+def test_split_follows_rucio_layouts():
+    items = configurator({"run-1000-raw": 5, "run-1001-raw": 25, "run-1002-raw": 3})
+    layouts = {SCOPE + ":run-1001-raw": ("DATASET", 0),
+               SCOPE + ":run-1002-raw": ("CONTAINER", 2)}
+    items.split(10, lambda datasets: layouts)
+    # existing dataset never split, existing container split whatever the size
+    assert sorted(items.containers) == [SCOPE + ":run-1002-raw"]
+    assert len(items.datasets[SCOPE + ":run-1001-raw"].dids) == 25
+    assert SCOPE + ":run-1002-raw" not in items.datasets
+    for ds in items.containers[SCOPE + ":run-1002-raw"].datasets:
+        assert ds.name in ["run-1002-raw-000", "run-1002-raw-001"]
+
+def test_group_rules_uses_the_containers_of_split_runs():
+    items = configurator({"run-1000-raw": 25, "run-2001-raw": 1, "other": 1})
+    items.split(10)
+    items.group_rules("icarus-{tier}-{block}")
+    assert sorted(items.rules) == sorted([SCOPE + ":icarus-raw-1000", SCOPE + ":icarus-raw-2000", SCOPE + ":other"])
+    children = items.containers[SCOPE + ":icarus-raw-1000"].datasets
+    assert children == [items.containers[SCOPE + ":run-1000-raw"]]
+    assert [c.name for c in items.containers[SCOPE + ":icarus-raw-2000"].datasets] == ["run-2001-raw"]
+    assert items.rules[SCOPE + ":icarus-raw-1000"].rse == "CNAF"
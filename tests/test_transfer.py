@@ -0,0 +1,96 @@
+import os
+import zlib
+import hashlib
+
+import rucio_uploader.utils as utils
+import rucio_uploader.rucio.destination as destination
+import rucio_uploader.rucio.transfer as transfer
+
+class StubRegistrar:
+    """Registrar recording the bulk calls instead of calling RUCIO
+    """
+
+    def __init__(self):
+        self.replicas = []
+        self.attachments = {}
+
+    def add_replicas(self, files):
+        self.replicas.extend(files)
+
+    def update_states(self, files):
+        pass
+
+    def attach(self, attachments):
+        for ds, dids in attachments.items():
+            self.attachments.setdefault(ds, []).extend(dids)
+
+def make_item(path, name, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    return {"path": path,
+            "did_name": name,
+            "did_scope": "user.test",
+            "dataset_name": "run-1000-raw",
+            "dataset_scope": "user.test",
+            "size": len(content),
+            "upload_ok": False}
+
+def test_local_copy_engine(tmp_path):
+    source = tmp_path / "source"
+    rse = tmp_path / "rse"
+    source.mkdir()
+    contents = {"f{}.root".format(i): os.urandom(1000 * i + 1) for i in range(5)}
+    items = [make_item(str(source / name), name, content) for name, content in contents.items()]
+
+    registrar = StubRegistrar()
+    engine = transfer.LocalCopyEngine(str(rse), registrar, n_threads=2, batch_size=2, buffer_size=256)
+    engine.transfer(items)
+
+    for item in items:
+        content = contents[item["did_name"]]
+        path = utils.deterministic_path(str(rse), "user.test", item["did_name"])
+        with open(path, "rb") as f:
+            assert f.read() == content
+        assert not os.path.exists(path + destination.TEMP_SUFFIX)
+        assert item["upload_ok"]
+        assert item["adler32"] == "{:08x}".format(zlib.adler32(content) & 0xffffffff)
+        assert item["md5"] == hashlib.md5(content).hexdigest()
+
+    assert sorted(f["name"] for f in registrar.replicas) == sorted(contents)
+    assert all(f["adler32"] == next(x["adler32"] for x in items if x["did_name"] == f["name"]) for f in registrar.replicas)
+    assert sorted(d["name"] for d in registrar.attachments["user.test:run-1000-raw"]) == sorted(contents)
+
+def test_local_copy_engine_size_mismatch(tmp_path):
+    item = make_item(str(tmp_path / "f.root"), "f.root", b"abc")
+    item["size"] = 4
+    registrar = StubRegistrar()
+    transfer.LocalCopyEngine(str(tmp_path / "rse"), registrar).transfer([item])
+
+    path = utils.deterministic_path(str(tmp_path / "rse"), "user.test", "f.root")
+    assert not item["upload_ok"]
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + destination.TEMP_SUFFIX)
+    assert registrar.replicas == []
+
+def test_local_copy_engine_fast_copy_with_known_checksums(tmp_path):
+    item = make_item(str(tmp_path / "f.root"), "f.root", b"0123456789")
+    item["adler32"] = "{:08x}".format(zlib.adler32(b"0123456789"))
+    item["md5"] = hashlib.md5(b"0123456789").hexdigest()
+    transfer.LocalCopyEngine(str(tmp_path / "rse"), StubRegistrar()).transfer([item])
+
+    with open(utils.deterministic_path(str(tmp_path / "rse"), "user.test", "f.root"), "rb") as f:
+        assert f.read() == b"0123456789"
+    assert item["upload_ok"]
+
+def test_only_copying_replicas_are_marked_available(tmp_path):
+    class Registrar(StubRegistrar):
+        def update_states(self, files):
+            self.updated = [f["name"] for f in files]
+    registrar = Registrar()
+    items = []
+    for name, state in [("copying", "COPYING"), ("bad", "BAD"), ("new", None)]:
+        items.append(dict(make_item(str(tmp_path / name), name, b"data"), adler32="00000001", replica_state=state))
+    transfer.BulkRegistration(registrar).register_all(items)
+    assert registrar.updated == ["copying"]
+    assert sorted(f["name"] for f in registrar.replicas) == ["bad", "new"]
+    assert all(x["upload_ok"] for x in items)
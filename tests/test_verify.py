@@ -0,0 +1,30 @@
+import zlib
+
+import rucio_uploader.rucio.verify as verify
+
+class StubPool:
+    """Pool returning the given replicas to list_replicas"""
+
+    def __init__(self, replicas: list):
+        self.replicas = replicas
+
+    def call(self, kind, function):
+        return self.replicas
+
+def item(path, name, size):
+    return {"path": str(path), "did_name": name, "did_scope": "user.test", "size": size}
+
+def test_verify_classifies_items(tmp_path):
+    good = tmp_path / "good.root"
+    good.write_bytes(b"good data")
+    checksum = "{:08x}".format(zlib.adler32(b"good data"))
+    items = [item(good, "good.root", 9),
+             item(good, "bad.root", 9),
+             item(good, "missing.root", 9),
+             item(tmp_path / "gone.root", "gone.root", 9)]
+    pool = StubPool([{"scope": "user.test", "name": "good.root", "bytes": 9, "adler32": checksum, "states": {"FNAL_DCACHE": "AVAILABLE"}},
+                     {"scope": "user.test", "name": "bad.root", "bytes": 9, "adler32": "00000001", "states": {"FNAL_DCACHE": "AVAILABLE"}},
+                     {"scope": "user.test", "name": "gone.root", "bytes": 9, "adler32": checksum, "states": {"FNAL_DCACHE": "AVAILABLE"}}])
+    counts = verify.ReplicaVerifier(pool, ["FNAL_DCACHE"]).verify(items)
+    assert [x["verify_error"] for x in items] == [None, "checksum", "missing", "unverified"]
+    assert counts == {"ok": 1, "checksum": 1, "missing": 1, "unverified": 1}
@@ -0,0 +1,43 @@
+import os
+import time
+
+import rucio_uploader.interfaces.watch as watch_interface
+
+class SilentINotify:
+    """inotify missing the writes of other clients, as on NFS or /pnfs"""
+
+    def add_watch(self, path, mask):
+        return 1
+
+    def read(self, timeout):
+        time.sleep(timeout / 1000.)
+        return []
+
+def touch(path, age=0.):
+    path.write_bytes(b"data")
+    mtime = time.time() - age
+    os.utime(str(path), (mtime, mtime))
+
+def watcher(tmp_path, debounce=10., interval=0.1):
+    watcher = watch_interface.DirectoryWatcher([str(tmp_path)], r".*_run([0-9]+)_.*", debounce, interval)
+    watcher.inotify = SilentINotify()
+    watcher.mask = 0
+    return watcher
+
+def test_debounce(tmp_path):
+    touch(tmp_path / "data_run1000_1.root", age=60)
+    touch(tmp_path / "data_run1000_2.root")
+    touch(tmp_path / "other.root", age=60)
+    w = watcher(tmp_path)
+    assert w.wait(0.2) == [str(tmp_path / "data_run1000_1.root")]
+    assert w.wait(0.2) == []
+    # complete once not modified for the debounce time
+    touch(tmp_path / "data_run1000_2.root", age=60)
+    assert w.wait(0.2) == [str(tmp_path / "data_run1000_2.root")]
+
+def test_rescan_with_inotify(tmp_path):
+    w = watcher(tmp_path)
+    assert w.wait(0.05) == []
+    (tmp_path / "sub").mkdir()
+    touch(tmp_path / "sub" / "data_run1000_3.root", age=60)
+    assert w.wait(0.5) == [str(tmp_path / "sub" / "data_run1000_3.root")]
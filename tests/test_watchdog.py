@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+import rucio_uploader.rucio.watchdog as watchdog
+import rucio_uploader.rucio.scheduler as scheduler
+
+from test_scheduler import StubResolver, unit
+
+def hung_transfer(release, fail=False):
+    def transfer():
+        release.wait()
+        if fail:
+            raise OSError("mover failed")
+        return "uploaded"
+    return transfer
+
+def timeout(transfer):
+    with pytest.raises(watchdog.TransferTimeout) as e:
+        watchdog.Watchdog(floor=0.05, ceiling=0.05).run(transfer, 1)
+    return e.value
+
+def test_deadline_bounds():
+    dog = watchdog.Watchdog(floor=300., ceiling=100., factor=3., initial_rate=1.)
+    assert dog.deadline(1) == 100.
+    assert dog.deadline(10**9) == 100.
+    dog = watchdog.Watchdog(floor=10., ceiling=100., factor=3., initial_rate=1.)
+    assert [dog.deadline(s) for s in [1, 20, 1000]] == [10., 60., 100.]
+
+def test_transfer_within_deadline():
+    assert watchdog.Watchdog(floor=1., ceiling=1.).run(lambda: "uploaded", 1) == "uploaded"
+    release = threading.Event()
+    release.set()
+    with pytest.raises(OSError):
+        watchdog.Watchdog(floor=1., ceiling=1.).run(hung_transfer(release, fail=True), 1)
+
+def test_transfer_that_does_not_stop_is_settled_when_it_ends():
+    release = threading.Event()
+    error = timeout(hung_transfer(release))
+    assert error.settle(0.01) is None
+    settled = []
+    error.when_settled(settled.append)
+    assert settled == []
+    release.set()
+    error.thread.join(1.)
+    assert settled == [True]
+    # already ended: called at once
+    error.when_settled(settled.append)
+    assert settled == [True, True]
+
+def test_failed_transfer_after_timeout():
+    release = threading.Event()
+    error = timeout(hung_transfer(release, fail=True))
+    release.set()
+    assert error.settle(1.) is False
+    assert isinstance(error.outcome["error"], OSError)
+
+def test_unit_of_a_running_transfer_stays_active():
+    queue = scheduler.UploadScheduler(StubResolver())
+    queue.put(unit("p", "run-1000-raw", "f0"))
+    taken = queue.get()
+    release = threading.Event()
+    error = timeout(hung_transfer(release))
+    # as RucioClient.abandon: the unit is done once the transfer ends
+    error.when_settled(lambda succeeded: queue.done(taken))
+    queue.close()
+    ended = []
+    worker = threading.Thread(target=lambda: ended.append(queue.get()))
+    worker.start()
+    worker.join(0.1)
+    assert worker.is_alive() and queue.active() == 1
+    release.set()
+    worker.join(1.)
+    assert ended == [None] and queue.active() == 0